@@ -68,6 +68,12 @@ def url_alias_resolution(config: Config):
     uvloop.run(command.url_alias_resolution.run(config))
 
 
+@app.command
+@click.pass_obj
+def worker(config: Config):
+    uvloop.run(command.worker.run(config))
+
+
 @app.command
 @click.pass_obj
 def youtube_url_convert(config: Config):
@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Self
+
+from cancer.config import FileIdCacheConfig
+from cancer.port.file_id_cache import FileIdCache
+from cancer.url import normalize_url
+
+_LOG = logging.getLogger(__name__)
+
+
+class SqliteFileIdCache(FileIdCache):
+    def __init__(self, path: Path, ttl: timedelta, max_entries: int) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_ids (
+                url TEXT PRIMARY KEY,
+                file_ids TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS file_ids_last_used_at"
+            " ON file_ids (last_used_at)"
+        )
+
+    @classmethod
+    def from_config(cls, config: FileIdCacheConfig) -> Self:
+        return cls(
+            path=config.path,
+            ttl=config.ttl,
+            max_entries=config.max_entries,
+        )
+
+    def _get(self, key: str) -> list[str] | None:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_ids, created_at FROM file_ids WHERE url = ?",
+                (key,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            file_ids, created_at = row
+            if now - created_at > self.ttl.total_seconds():
+                self._connection.execute("DELETE FROM file_ids WHERE url = ?", (key,))
+                return None
+
+            self._connection.execute(
+                "UPDATE file_ids SET last_used_at = ? WHERE url = ?",
+                (now, key),
+            )
+
+        return json.loads(file_ids)
+
+    def _put(self, key: str, file_ids: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?)",
+                (key, json.dumps(file_ids), now, now),
+            )
+            self._connection.execute(
+                "DELETE FROM file_ids WHERE created_at < ?",
+                (now - self.ttl.total_seconds(),),
+            )
+            self._connection.execute(
+                """
+                DELETE FROM file_ids WHERE url IN (
+                    SELECT url FROM file_ids
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def _remove(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM file_ids WHERE url = ?", (key,))
+
+    async def get(self, url: str) -> list[str] | None:
+        file_ids = await asyncio.to_thread(self._get, normalize_url(url))
+        if file_ids is not None:
+            _LOG.debug("Found cached file IDs for URL %s", url)
+        return file_ids
+
+    async def put(self, url: str, file_ids: list[str]) -> None:
+        await asyncio.to_thread(self._put, normalize_url(url), file_ids)
+
+    async def remove(self, url: str) -> None:
+        await asyncio.to_thread(self._remove, normalize_url(url))
+
+    async def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+        _LOG.info("File ID cache closed")
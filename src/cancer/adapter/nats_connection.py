@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+from nats.aio.client import Client, RawCredentials
+
+from cancer.config import EventNatsConfig
+
+_LOG = logging.getLogger(__name__)
+
+
+class NatsConnection:
+    def __init__(self, config: EventNatsConfig):
+        self.config = config
+        self._client: Client | None = None
+        self._lock = asyncio.Lock()
+
+    async def get_client(self) -> Client:
+        async with self._lock:
+            client = self._client
+            if client is None:
+                client = Client()
+                credentials = self.config.credentials
+                raw_credentials = RawCredentials(credentials) if credentials else None
+                await client.connect(
+                    self.config.endpoint,
+                    allow_reconnect=True,
+                    user_credentials=raw_credentials,
+                )
+                self._client = client
+            return client
+
+    async def close(self) -> None:
+        client = self._client
+        if client is None or client.is_draining or client.is_closed:
+            return
+
+        _LOG.info("Draining NATS client")
+        await client.drain()
+        _LOG.info("Closing NATS client")
+        await client.close()
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import logging
+from collections.abc import Collection
+from dataclasses import dataclass
+
+from cancer.message import Message, Topic
+from cancer.port.publisher import Publisher, PublishingException
+from cancer.port.subscriber import MessageCallback, Subscriber, get_requeue_delay
+
+_LOG = logging.getLogger(__name__)
+
+_MAX_PENDING = 1000
+
+
+@dataclass(eq=False)
+class _Delivery:
+    data: bytes
+    num_delivered: int = 0
+
+
+class MemoryBroker:
+    def __init__(self, max_pending: int = _MAX_PENDING) -> None:
+        # Only enforced for new messages, redeliveries must never be lost
+        self.max_pending = max_pending
+        self._queues: dict[Topic, asyncio.Queue[_Delivery]] = {}
+
+    def get_queue(self, topic: Topic) -> asyncio.Queue[_Delivery]:
+        queue = self._queues.get(topic)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[topic] = queue
+        return queue
+
+    def publish(self, topic: Topic, data: bytes) -> None:
+        queue = self.get_queue(topic)
+        if queue.qsize() >= self.max_pending:
+            raise PublishingException(
+                f"Too many pending messages on topic {topic.value}"
+            )
+        queue.put_nowait(_Delivery(data))
+
+    def redeliver(self, topic: Topic, delivery: _Delivery) -> None:
+        self.get_queue(topic).put_nowait(delivery)
+
+
+@functools.cache
+def get_memory_broker() -> MemoryBroker:
+    return MemoryBroker()
+
+
+class MemoryPublisher(Publisher):
+    def __init__(self, broker: MemoryBroker, topics: Collection[Topic] | None = None):
+        self.broker = broker
+        # The topics with a subscriber in this process, None for all of them
+        self.topics = topics
+
+    async def publish(
+        self,
+        topic: Topic,
+        message: Message,
+        *,
+        is_priority: bool = False,
+    ):
+        if self.topics is not None and topic not in self.topics:
+            # Nothing would ever take it out of the queue again
+            _LOG.warning(
+                "Dropping event %s, topic %s is not handled in this process",
+                message.message_id,
+                topic.value,
+            )
+            return
+
+        _LOG.debug("Publishing event %s", message.message_id)
+        self.broker.publish(topic, message.serialize())
+
+    async def close(self) -> None:
+        _LOG.info("Memory publisher closed")
+
+
+class MemorySubscriber(Subscriber):
+    def __init__(self, broker: MemoryBroker, max_in_flight: int = 4):
+        self.broker = broker
+        self.max_in_flight = max_in_flight
+        self._closed = asyncio.Event()
+        # The broker is shared, so each subscriber only owns its own redeliveries
+        self._delayed: set[asyncio.TimerHandle] = set()
+
+    def _requeue(self, topic: Topic, delivery: _Delivery, delay: float) -> None:
+        if delay <= 0:
+            self.broker.redeliver(topic, delivery)
+            return
+
+        loop = asyncio.get_running_loop()
+
+        def _fire() -> None:
+            self._delayed.discard(handle)
+            self.broker.redeliver(topic, delivery)
+
+        handle = loop.call_later(delay, _fire)
+        self._delayed.add(handle)
+
+    async def _process_delivery[T: Message](
+        self,
+        topic: Topic,
+        delivery: _Delivery,
+        message_type: type[T],
+        handle: MessageCallback[T],
+    ) -> None:
+        delivery.num_delivered += 1
+        try:
+            decoded = message_type.deserialize(delivery.data)
+        except Exception as e:
+            _LOG.error("Could not decode message", exc_info=e)
+            return
+
+        try:
+            result = await handle(decoded, delivery.num_delivered)
+        except Exception as e:
+            _LOG.error("Handler failed to handle message, requeuing", exc_info=e)
+            self._requeue(topic, delivery, 0)
+            return
+
+        match result:
+            case Subscriber.Result.Ack:
+                pass
+            case Subscriber.Result.Drop:
+                _LOG.warning("Dropping message")
+            case Subscriber.Result.Requeue:
+                delay = get_requeue_delay(delivery.num_delivered)
+                _LOG.info(
+                    "Requeuing message due to handler result (delay: %s)",
+                    delay,
+                )
+                self._requeue(topic, delivery, delay.total_seconds())
+            case Subscriber.RequeueAfter() as requeue:
+                _LOG.info(
+                    "Requeuing message as requested by handler (delay: %s)",
+                    requeue.delay,
+                )
+                self._requeue(topic, delivery, requeue.delay.total_seconds())
+            case _:
+                _LOG.error("Unknown event handler result: %s", result)
+
+    async def subscribe[T: Message](
+        self,
+        topic: Topic,
+        message_type: type[T],
+        handle: MessageCallback[T],
+        *,
+        max_in_flight: int | None = None,
+    ) -> None:
+        if max_in_flight is None:
+            max_in_flight = self.max_in_flight
+
+        queue = self.broker.get_queue(topic)
+        in_flight: set[asyncio.Task[None]] = set()
+        closed = asyncio.create_task(self._closed.wait())
+
+        try:
+            while not self._closed.is_set():
+                if len(in_flight) >= max_in_flight:
+                    await asyncio.wait(
+                        {*in_flight, closed},
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+                    continue
+
+                get = asyncio.create_task(queue.get())
+                await asyncio.wait({get, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+
+                task = asyncio.create_task(
+                    self._process_delivery(topic, get.result(), message_type, handle)
+                )
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+        finally:
+            closed.cancel()
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+    async def close(self) -> None:
+        self._closed.set()
+        if self._delayed:
+            _LOG.warning("Discarding %d delayed messages", len(self._delayed))
+        for handle in self._delayed:
+            handle.cancel()
+        self._delayed.clear()
+        _LOG.info("Memory subscriber closed")
@@ -1,146 +1,435 @@
 import asyncio
+import hashlib
 import logging
+import time
+from dataclasses import dataclass
 
-from nats.aio.client import Client, RawCredentials
+from nats.aio.msg import Msg
 from nats.errors import TimeoutError
+from nats.js.api import Header
 from nats.js.client import JetStreamContext
 from nats.js.errors import ServiceUnavailableError
 
+from cancer.adapter.nats_connection import NatsConnection
 from cancer.config import EventNatsConfig
-from cancer.message import Message, Topic
+from cancer.message import (
+    Codec,
+    DownloadMessage,
+    Message,
+    Topic,
+    UnknownCodecException,
+    UrlConvertMessage,
+    VoiceMessage,
+)
 from cancer.port.publisher import Publisher, PublishingException
-from cancer.port.subscriber import MessageCallback, Subscriber
+from cancer.port.subscriber import MessageCallback, Subscriber, get_requeue_delay
+from cancer.url import normalize_url
 
 _LOG = logging.getLogger(__name__)
 
+# JetStream's default if the consumer doesn't configure one
+_DEFAULT_ACK_WAIT = 30.0
+
+_FETCH_TIMEOUT = 5.0
+_LANE_FETCH_TIMEOUT = 1.0
+_PRIORITY_FETCH_TIMEOUT = 0.1
+
+
+def _create_message_id(topic: Topic, message: Message) -> str:
+    parts: list[str]
+    match message:
+        case DownloadMessage(urls=urls) | UrlConvertMessage(urls=urls):
+            parts = sorted(normalize_url(url) for url in urls)
+        case VoiceMessage(file_id=file_id):
+            parts = [file_id]
+        case _:
+            parts = []
+
+    key = "\n".join(
+        [str(message.chat_id), str(message.message_id), topic.value, *parts]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
 
 class NatsPublisher(Publisher):
-    def __init__(self, config: EventNatsConfig):
+    def __init__(
+        self, config: EventNatsConfig, connection: NatsConnection | None = None
+    ):
         self.config = config
-        self._client: Client | None = None
-
-    async def _get_client(self) -> Client:
-        client = self._client
-        if client is None:
-            client = Client()
-            credentials = self.config.credentials
-            raw_credentials = RawCredentials(credentials) if credentials else None
-            await client.connect(
-                self.config.endpoint,
-                allow_reconnect=True,
-                user_credentials=raw_credentials,
+        self._connection = connection or NatsConnection(config)
+        self._jetstream: JetStreamContext | None = None
+        self.deduplicated_count = 0
+
+    async def _get_jetstream(self) -> JetStreamContext:
+        jetstream = self._jetstream
+        if jetstream is None:
+            client = await self._connection.get_client()
+            jetstream = client.jetstream(
+                publish_async_max_pending=self.config.max_pending_acks,
             )
-            self._client = client
-        return client
+            self._jetstream = jetstream
+        return jetstream
 
-    async def publish(self, topic: Topic, message: Message):
+    async def publish(
+        self,
+        topic: Topic,
+        message: Message,
+        *,
+        is_priority: bool = False,
+    ):
         _LOG.debug("Publishing event %s", message.message_id)
-        client = await self._get_client()
-        jetstream = client.jetstream()
+        jetstream = await self._get_jetstream()
 
         try:
-            await jetstream.publish(
-                subject=self.config.get_publish_subject(topic),
-                payload=message.serialize(),
+            # Waits for a free slot if too many acks are outstanding
+            ack = await jetstream.publish_async(
+                subject=self.config.get_publish_subject(
+                    topic,
+                    is_priority=is_priority,
+                ),
+                payload=message.serialize(self.config.codec),
                 stream=self.config.stream_name,
+                headers={
+                    **self.config.codec.to_headers(),
+                    Header.MSG_ID: _create_message_id(topic, message),
+                },
+            )
+            pub_ack = await asyncio.wait_for(
+                ack,
+                timeout=self.config.publish_timeout.total_seconds(),
             )
         except Exception as e:
-            raise PublishingException from e
+            raise PublishingException(
+                f"Could not publish message {message.message_id} to {topic.value}"
+            ) from e
+
+        if pub_ack.duplicate:
+            self.deduplicated_count += 1
+            _LOG.info(
+                "Stream dropped duplicate of message %d on topic %s",
+                message.message_id,
+                topic.value,
+            )
 
     async def close(self) -> None:
-        if (client := self._client) is not None:
-            _LOG.info("Draining NATS client")
-            await client.drain()
-            _LOG.info("Closing NATS client")
-            await client.close()
-        _LOG.info("NATS publisher closed")
+        if (jetstream := self._jetstream) is not None:
+            try:
+                await jetstream.publish_async_completed()
+            except Exception as e:
+                _LOG.error("Could not wait for outstanding publish acks", exc_info=e)
+
+        await self._connection.close()
+        _LOG.info(
+            "NATS publisher closed (deduplicated publishes: %d)",
+            self.deduplicated_count,
+        )
+
+
+@dataclass
+class HeartbeatStats:
+    heartbeats_sent: int = 0
+    redeliveries_avoided: int = 0
+
+
+@dataclass
+class DrainReport:
+    finished: int = 0
+    requeued: int = 0
+    released: int = 0
 
 
 class NatsSubscriber(Subscriber):
-    def __init__(self, config: EventNatsConfig):
+    def __init__(
+        self, config: EventNatsConfig, connection: NatsConnection | None = None
+    ):
         self.config = config
-        self._client: Client | None = None
-
-    async def _get_client(self) -> Client:
-        client = self._client
-        if client is None:
-            client = Client()
-            credentials = self.config.credentials
-            raw_credentials = RawCredentials(credentials) if credentials else None
-            await client.connect(
-                self.config.endpoint,
-                allow_reconnect=True,
-                user_credentials=raw_credentials,
+        self.heartbeat_stats = HeartbeatStats()
+        self._connection = connection or NatsConnection(config)
+        self._stopping = asyncio.Event()
+        self._is_closing = False
+        self._closed = asyncio.Event()
+        self._in_flight: dict[asyncio.Task[None], Msg] = {}
+        self._released = 0
+
+    @staticmethod
+    async def _get_ack_wait(sub: JetStreamContext.PullSubscription) -> float:
+        try:
+            info = await sub.consumer_info()
+        except Exception as e:
+            _LOG.warning("Could not get consumer info", exc_info=e)
+            return _DEFAULT_ACK_WAIT
+
+        return info.config.ack_wait or _DEFAULT_ACK_WAIT
+
+    async def _keep_in_progress(self, message: Msg, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await message.in_progress()
+            except Exception as e:
+                _LOG.warning("Could not mark message as in progress", exc_info=e)
+            else:
+                self.heartbeat_stats.heartbeats_sent += 1
+
+    async def _run_handler[T: Message](
+        self,
+        message: Msg,
+        decoded: T,
+        handle: MessageCallback[T],
+        ack_wait: float,
+    ) -> Subscriber.Result | Subscriber.RequeueAfter:
+        if (interval := self.config.heartbeat_interval) is not None:
+            heartbeat_interval = interval.total_seconds()
+        else:
+            heartbeat_interval = ack_wait / 3
+
+        heartbeat = asyncio.create_task(
+            self._keep_in_progress(message, heartbeat_interval)
+        )
+        start = time.monotonic()
+        try:
+            return await handle(decoded, message.metadata.num_delivered)
+        finally:
+            heartbeat.cancel()
+            if time.monotonic() - start > ack_wait:
+                self.heartbeat_stats.redeliveries_avoided += 1
+                _LOG.info(
+                    "Handler ran for longer than the ack wait of %d seconds",
+                    ack_wait,
+                )
+
+    async def _process_message[T: Message](
+        self,
+        message: Msg,
+        message_type: type[T],
+        handle: MessageCallback[T],
+        ack_wait: float,
+    ) -> None:
+        try:
+            codec = Codec.from_headers(message.headers)
+        except UnknownCodecException as e:
+            # Published by a newer version, which may still be rolling out
+            delay = get_requeue_delay(message.metadata.num_delivered)
+            _LOG.warning("Requeuing message (delay: %s)", delay, exc_info=e)
+            await message.nak(delay=delay.total_seconds())
+            return
+
+        try:
+            decoded = message_type.deserialize(message.data, codec)
+        except Exception as e:
+            _LOG.error("Could not decode message", exc_info=e)
+            await message.term()
+            return
+
+        try:
+            result = await self._run_handler(message, decoded, handle, ack_wait)
+        except Exception as e:
+            _LOG.error("Handler failed to handle message, requeuing", exc_info=e)
+            await message.nak()
+            return
+
+        match result:
+            case Subscriber.Result.Ack:
+                await message.ack()
+            case Subscriber.Result.Drop:
+                _LOG.warning("Dropping message")
+                await message.term()
+            case Subscriber.Result.Requeue:
+                delay = get_requeue_delay(message.metadata.num_delivered)
+                _LOG.info(
+                    "Requeuing message due to handler result (delay: %s)",
+                    delay,
+                )
+                await message.nak(delay=delay.total_seconds())
+            case Subscriber.RequeueAfter(delay=delay):
+                _LOG.info(
+                    "Requeuing message as requested by handler (delay: %s)", delay
+                )
+                await message.nak(delay=delay.total_seconds())
+            case _:
+                raise ValueError(f"Unknown event handler result: {result}")
+
+    async def _handle_message[T: Message](
+        self,
+        message: Msg,
+        message_type: type[T],
+        handle: MessageCallback[T],
+        ack_wait: float,
+    ) -> None:
+        try:
+            await self._process_message(message, message_type, handle, ack_wait)
+        except Exception as e:
+            _LOG.error("Could not settle message", exc_info=e)
+
+    @staticmethod
+    async def _fetch(
+        sub: JetStreamContext.PullSubscription,
+        batch: int,
+        timeout: float,
+    ) -> list[Msg]:
+        try:
+            return await sub.fetch(batch, timeout=timeout)
+        except TimeoutError:
+            return []
+        except ServiceUnavailableError as e:
+            _LOG.error(
+                "NATS service unavailable. Retrying after a short wait...",
+                exc_info=e,
             )
-            self._client = client
-        return client
+            await asyncio.sleep(1)
+            return []
+        except Exception as e:
+            _LOG.error("Could not fetch messages", exc_info=e)
+            return []
 
     async def subscribe[T: Message](
         self,
         topic: Topic,
         message_type: type[T],
         handle: MessageCallback,
+        *,
+        max_in_flight: int | None = None,
     ):
-        client = await self._get_client()
+        client = await self._connection.get_client()
         jetstream = client.jetstream()
         sub: JetStreamContext.PullSubscription = await jetstream.pull_subscribe_bind(
             consumer=self.config.get_consumer_name(topic),
             stream=self.config.stream_name,
         )
 
-        while not (client.is_draining or client.is_closed):
-            try:
-                msgs = await sub.fetch()
-            except TimeoutError:
-                continue
-            except ServiceUnavailableError as e:
-                _LOG.error(
-                    "NATS service unavailable. Retrying after a short wait...",
-                    exc_info=e,
-                )
-                await asyncio.sleep(1)
-                continue
-            except Exception as e:
-                _LOG.error("Could not fetch messages", exc_info=e)
+        priority_sub: JetStreamContext.PullSubscription | None = None
+        if self.config.priority_weight > 0:
+            priority_sub = await jetstream.pull_subscribe_bind(
+                consumer=self.config.get_consumer_name(topic, is_priority=True),
+                stream=self.config.stream_name,
+            )
+
+        ack_wait = await self._get_ack_wait(sub)
+        if max_in_flight is None:
+            max_in_flight = self.config.max_in_flight
+        in_flight: set[asyncio.Task[None]] = set()
+        priority_streak = 0
+
+        while not (self._stopping.is_set() or client.is_draining or client.is_closed):
+            if len(in_flight) >= max_in_flight:
+                # Don't take messages off the stream we can't work on yet
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
                 continue
 
-            for message in msgs:
-                try:
-                    decoded = message_type.deserialize(message.data)
-                except Exception as e:
-                    _LOG.error("Could not decode message", exc_info=e)
-                    await message.term()
-                    continue
-
-                try:
-                    result = await handle(decoded, message.metadata.num_delivered)
-                except Exception as e:
-                    _LOG.error(
-                        "Handler failed to handle message, requeuing", exc_info=e
+            batch = min(self.config.fetch_batch_size, max_in_flight - len(in_flight))
+            msgs: list[Msg] = []
+            if priority_sub is None:
+                msgs = await self._fetch(sub, batch, _FETCH_TIMEOUT)
+            else:
+                if priority_streak < self.config.priority_weight:
+                    msgs = await self._fetch(
+                        priority_sub,
+                        batch,
+                        _PRIORITY_FETCH_TIMEOUT,
                     )
-                    await message.nak()
+
+                if msgs:
+                    priority_streak += 1
                 else:
-                    match result:
-                        case Subscriber.Result.Ack:
-                            await message.ack()
-                        case Subscriber.Result.Drop:
-                            _LOG.warning("Dropping message")
-                            await message.term()
-                        case Subscriber.Result.Requeue:
-                            # 20, 60, 180, 540, 1620
-                            delay = 20 * pow(3, message.metadata.num_delivered - 1)
-                            _LOG.info(
-                                "Requeuing message due to handler result (delay: %d seconds)",
-                                delay,
-                            )
-                            await message.nak(delay=delay)
-                        case _:
-                            raise ValueError(f"Unknown event handler result: {result}")
+                    priority_streak = 0
+                    # Short, so new priority messages don't wait behind an idle lane
+                    msgs = await self._fetch(sub, batch, _LANE_FETCH_TIMEOUT)
+
+            if not msgs:
+                continue
+
+            if self._stopping.is_set():
+                # Fetched while shutting down, let another replica have them
+                for message in msgs:
+                    await self._release(message)
+                break
+
+            for message in msgs:
+                task = asyncio.create_task(
+                    self._handle_message(message, message_type, handle, ack_wait)
+                )
+                in_flight.add(task)
+                self._in_flight[task] = message
+                task.add_done_callback(in_flight.discard)
+                task.add_done_callback(self._forget)
+
+        if in_flight:
+            await asyncio.wait(in_flight)
+
+        if self._is_closing:
+            # Don't return before the close naked the cancelled messages and
+            # flushed the connection, the caller may tear down the loop after us
+            await self._closed.wait()
+
+    def _forget(self, task: asyncio.Task[None]) -> None:
+        self._in_flight.pop(task, None)
+
+    async def _release(self, message: Msg) -> bool:
+        if message.is_acked:
+            return False
+
+        try:
+            await message.nak()
+        except Exception as e:
+            _LOG.error("Could not release message", exc_info=e)
+            return False
+
+        self._released += 1
+        return True
+
+    async def drain(self) -> DrainReport:
+        self._stopping.set()
+        report = DrainReport()
+
+        pending: set[asyncio.Task[None]] = set(self._in_flight)
+        messages = dict(self._in_flight)
+        if pending:
+            grace_period = self.config.shutdown_grace_period
+            _LOG.info(
+                "Waiting up to %s for %d in-flight messages",
+                grace_period,
+                len(pending),
+            )
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=grace_period.total_seconds(),
+            )
+            report.finished = len(done)
+
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+
+        for task in pending:
+            if await self._release(messages[task]):
+                report.requeued += 1
+
+        report.released = self._released - report.requeued
+        return report
 
     async def close(self) -> None:
-        if (client := self._client) is not None:
-            _LOG.info("Draining NATS client")
-            await client.drain()
-            _LOG.info("Closing NATS client")
-            await client.close()
-        _LOG.info("NATS subscriber closed")
+        if self._is_closing:
+            await self._closed.wait()
+            return
+
+        self._is_closing = True
+        try:
+            report = await self.drain()
+            _LOG.info(
+                "Drained subscriber"
+                " (finished: %d, requeued: %d, released unstarted: %d)",
+                report.finished,
+                report.requeued,
+                report.released,
+            )
+
+            await self._connection.close()
+        finally:
+            self._closed.set()
+
+        _LOG.info(
+            "NATS subscriber closed (heartbeats sent: %d, redeliveries avoided: %d)",
+            self.heartbeat_stats.heartbeats_sent,
+            self.heartbeat_stats.redeliveries_avoided,
+        )
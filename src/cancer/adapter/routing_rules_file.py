@@ -0,0 +1,47 @@
+import asyncio
+import logging
+from collections.abc import AsyncGenerator
+from datetime import timedelta
+from pathlib import Path
+
+from cancer.port.routing_rules import RoutingRuleSource
+
+_LOG = logging.getLogger(__name__)
+
+
+class FileRoutingRuleSource(RoutingRuleSource):
+    def __init__(self, path: Path, poll_interval: timedelta) -> None:
+        self.path = path
+        self.poll_interval = poll_interval
+
+    def _get_version(self) -> tuple[int, int] | None:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> bytes | None:
+        try:
+            return self.path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    async def watch(self) -> AsyncGenerator[bytes | None]:
+        is_loaded = False
+        last_version: tuple[int, int] | None = None
+        while True:
+            try:
+                version = await asyncio.to_thread(self._get_version)
+                if not is_loaded or version != last_version:
+                    document = await asyncio.to_thread(self._read)
+                    is_loaded = True
+                    last_version = version
+                    yield document
+            except OSError as e:
+                _LOG.error("Could not read routing rules", exc_info=e)
+
+            await asyncio.sleep(self.poll_interval.total_seconds())
+
+    async def close(self) -> None:
+        pass
@@ -0,0 +1,65 @@
+import logging
+from collections.abc import AsyncGenerator
+
+from nats.errors import TimeoutError
+from nats.js.kv import KV_DEL, KV_PURGE, KeyValue
+
+from cancer.adapter.nats_connection import NatsConnection
+from cancer.port.routing_rules import RoutingRuleSource
+
+_LOG = logging.getLogger(__name__)
+
+_UPDATE_TIMEOUT = 60.0
+
+
+class NatsRoutingRuleSource(RoutingRuleSource):
+    def __init__(self, connection: NatsConnection, bucket: str, key: str) -> None:
+        self.connection = connection
+        self.bucket = bucket
+        self.key = key
+        self._watcher: KeyValue.KeyWatcher | None = None
+
+    async def watch(self) -> AsyncGenerator[bytes | None]:
+        client = await self.connection.get_client()
+        kv = await client.jetstream().key_value(self.bucket)
+        self._watcher = await kv.watch(self.key)
+        try:
+            async for document in self._watch_updates(self._watcher):
+                yield document
+        finally:
+            await self._stop_watcher()
+
+    async def _watch_updates(
+        self,
+        watcher: KeyValue.KeyWatcher,
+    ) -> AsyncGenerator[bytes | None]:
+        is_loaded = False
+        while True:
+            try:
+                entry = await watcher.updates(timeout=_UPDATE_TIMEOUT)
+            except TimeoutError:
+                continue
+
+            if entry is None:
+                # Marks the end of the initial values, only relevant if there are none
+                if not is_loaded:
+                    is_loaded = True
+                    yield None
+                continue
+
+            is_loaded = True
+            if entry.operation in (KV_DEL, KV_PURGE):
+                _LOG.info("Routing rules were deleted from %s", self.bucket)
+                yield None
+            else:
+                yield entry.value
+
+    async def _stop_watcher(self) -> None:
+        watcher = self._watcher
+        self._watcher = None
+        if watcher is not None:
+            await watcher.stop()
+
+    async def close(self) -> None:
+        # The connection is shared with the publisher, which closes it
+        await self._stop_watcher()
@@ -0,0 +1,86 @@
+import logging
+import random
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import timedelta
+
+from cancer.config import CircuitBreakerConfig
+
+_LOG = logging.getLogger(__name__)
+
+# Spreads the requeued messages of an open circuit over a part of the backoff
+_JITTER = 0.2
+
+
+@dataclass
+class _Circuit:
+    failures: int = 0
+    trips: int = 0
+    open_until: float | None = None
+    is_probing: bool = False
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        config: CircuitBreakerConfig,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.config = config
+        self._clock = clock
+        self._circuits: dict[str, _Circuit] = {}
+
+    @staticmethod
+    def _jitter(seconds: float) -> timedelta:
+        return timedelta(seconds=seconds + random.uniform(0, seconds * _JITTER))
+
+    def get_delay(self, host: str) -> timedelta | None:
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.open_until is None:
+            return None
+
+        remaining = circuit.open_until - self._clock()
+        if remaining > 0:
+            return self._jitter(remaining)
+
+        if circuit.is_probing:
+            return self._jitter(self.config.base_delay.total_seconds())
+
+        return None
+
+    def acquire(self, host: str) -> timedelta | None:
+        if (delay := self.get_delay(host)) is not None:
+            return delay
+
+        circuit = self._circuits.get(host)
+        if circuit is not None and circuit.open_until is not None:
+            _LOG.info("Probing %s before closing its circuit", host)
+            circuit.is_probing = True
+
+        return None
+
+    def release(self, host: str) -> None:
+        if (circuit := self._circuits.get(host)) is not None:
+            circuit.is_probing = False
+
+    def record_success(self, host: str) -> None:
+        circuit = self._circuits.pop(host, None)
+        if circuit is not None and circuit.open_until is not None:
+            _LOG.info("Closing circuit for %s", host)
+
+    def record_failure(self, host: str) -> None:
+        circuit = self._circuits.setdefault(host, _Circuit())
+        circuit.failures += 1
+        if not circuit.is_probing and circuit.failures < self.config.failure_threshold:
+            return
+
+        circuit.trips += 1
+        circuit.failures = 0
+        circuit.is_probing = False
+        backoff = min(
+            self.config.max_delay.total_seconds(),
+            self.config.base_delay.total_seconds() * pow(2, circuit.trips - 1),
+        )
+        circuit.open_until = self._clock() + backoff
+        _LOG.warning("Opening circuit for %s for %d seconds", host, backoff)
@@ -3,6 +3,7 @@ from . import (
     handle_updates,
     telegram_audio_convert,
     url_alias_resolution,
+    worker,
     youtube_url_convert,
 )
 
@@ -11,5 +12,6 @@ __all__ = [
     "handle_updates",
     "telegram_audio_convert",
     "url_alias_resolution",
+    "worker",
     "youtube_url_convert",
 ]
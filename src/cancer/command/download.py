@@ -1,109 +1,193 @@
 import asyncio
+import itertools
+import json
 import logging
 import sys
 import uuid
-from asyncio.locks import Lock
+import warnings
+from collections import defaultdict
 from collections.abc import Callable
-from dataclasses import dataclass
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import timedelta
+from io import BytesIO
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import cast
+from typing import Any, cast
+from urllib.parse import urlsplit
 
 from httpx import AsyncClient
 from PIL import Image
-from telegram import Bot, ReplyParameters, Video
+from telegram import Bot, InputFile, InputMediaVideo, ReplyParameters, Video
 from telegram.constants import ReactionEmoji
-from telegram.error import BadRequest, NetworkError, TelegramError
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.warnings import PTBDeprecationWarning
 from yt_dlp import YoutubeDL
+from yt_dlp.extractor import gen_extractor_classes
 from yt_dlp.utils import DownloadError, ExtractorError, UnsupportedError
 
+from cancer.adapter.file_id_cache_sqlite import SqliteFileIdCache
+from cancer.circuit_breaker import CircuitBreaker
 from cancer.command.util import initialize_subscriber
-from cancer.config import Config, DownloaderConfig, DownloaderCredentials
+from cancer.config import (
+    Config,
+    DownloaderConfig,
+    DownloaderCredentials,
+    EventBroker,
+)
 from cancer.message import DownloadMessage
+from cancer.port.file_id_cache import FileIdCache
 from cancer.port.subscriber import Subscriber
+from cancer.process_pool import ProcessPool
+from cancer.scheduling import FairScheduler
+from cancer.storage import StorageFullException, StorageManager
+from cancer.url import normalize_host
 
 _LOG = logging.getLogger(__name__)
 
-_busy_lock = Lock()
-
 
 @dataclass
 class VideoInfo:
+    url: str
     size: int | None
     thumbnails: list[str]
+    ie_result: dict[str, Any]
 
 
-async def _run_blocking[T](func: Callable[[], T]) -> T:
-    return await asyncio.get_running_loop().run_in_executor(None, func)
+@dataclass
+class _CuredFile:
+    thumb_path: Path | None
+    video_file: Path
+    cure_path: Path
 
 
-def _get_info(url: str) -> VideoInfo:
-    ytdl = YoutubeDL()
+def _open_upload(path: Path, files: ExitStack) -> InputFile:
+    # Streamed from disk by the HTTP client instead of being read into memory
+    return InputFile(
+        files.enter_context(path.open("rb")),
+        filename=path.name,
+        attach=True,
+        read_file_handle=False,
+    )
 
-    try:
-        info = ytdl.extract_info(url, download=False)
-    except DownloadError:
-        return VideoInfo(None, [])
 
-    size: int | None
-    if info is None:
-        size = None
-        thumbnails = []
-    else:
-        size = cast(
-            int | None,
-            info.get("filesize") or info.get("filesize_approx"),
+@dataclass
+class _Upload:
+    url: str
+    # Either a freshly cured file or the file ID of a cached upload
+    media: _CuredFile | str
+
+    def to_input_media(self, files: ExitStack) -> InputMediaVideo:
+        media = self.media
+        if isinstance(media, str):
+            return InputMediaVideo(media)
+
+        thumb_path = media.thumb_path
+        return InputMediaVideo(
+            _open_upload(media.cure_path, files),
+            thumbnail=_open_upload(thumb_path, files) if thumb_path else None,
         )
 
-        if size is None:
-            _LOG.debug("Got no file size for URL %s", url)
-        else:
-            _LOG.debug(
-                "Got a file size of approx. %d MB for URL %s",
-                round(float(size) / 1_000_000),
-                url,
-            )
 
-        raw_thumbnails = cast(list, info.get("thumbnails", []))
-        if raw_thumbnails:
-            _LOG.debug(
-                "Thumbnails for URL %s have the following keys: %s",
-                url,
-                list(raw_thumbnails[0].keys()),
-            )
-        thumbnails = [
-            t["url"]
-            for t in sorted(
-                raw_thumbnails,
-                key=lambda t: t.get("preference") or t.get("filesize") or -999999,
-                reverse=True,
-            )
-        ]
+@dataclass
+class _UrlResult:
+    url: str
+    files: list[_CuredFile] = field(default_factory=list)
+    cached_file_ids: list[str] | None = None
+    found_too_large: bool = False
+
+
+async def _run_blocking[T](func: Callable[[], T]) -> T:
+    return await asyncio.get_running_loop().run_in_executor(None, func)
+
+
+def _get_retry_delay(e: RetryAfter) -> float:
+    with warnings.catch_warnings():
+        # Both types of the upcoming migration to timedelta are handled here
+        warnings.simplefilter("ignore", PTBDeprecationWarning)
+        retry_after = e.retry_after
 
-    return VideoInfo(size, thumbnails)
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
 
 
 class AccessDeniedException(Exception):
-    pass
+    def __init__(self, message: str, host: str) -> None:
+        super().__init__(message)
+        self.host = host
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # Raised in process pool workers, so it has to survive pickling
+        return type(self), (str(self), self.host)
 
 
 class TryAgainException(Exception):
     pass
 
 
-def _download_videos(
-    base_folder: Path,
-    credentials: DownloaderCredentials,
-    url: str,
-) -> list[Path]:
-    cure_id = str(uuid.uuid4())
-    cure_dir = base_folder / cure_id
-    cure_dir.mkdir()
+class FileTooLargeException(Exception):
+    pass
+
+
+def _get_format_selector(max_file_size: int) -> str:
+    # Leave some room for the audio track when merging separate streams
+    video_size = int(max_file_size * 0.85)
+    audio_size = max_file_size - video_size
+
+    def _limit(size: int) -> str:
+        return f"[filesize<?{size}][filesize_approx<?{size}]"
+
+    return "/".join(
+        [
+            f"bv*[vcodec^=avc1]{_limit(video_size)}+ba[acodec^=mp4a]{_limit(audio_size)}",
+            f"b[vcodec^=avc1]{_limit(max_file_size)}",
+            f"bv*{_limit(video_size)}+ba{_limit(audio_size)}",
+            f"b{_limit(max_file_size)}",
+            "wv*+wa",
+            "w",
+        ]
+    )
+
+
+def _create_size_guard(max_file_size: int) -> Callable[[dict[str, Any]], None]:
+    # Bytes per file of each entry, the limit applies to a merged entry,
+    # not to all entries of a playlist or carousel together.
+    downloaded_bytes: dict[str, dict[str, int]] = defaultdict(dict)
+
+    def _guard(progress: dict[str, Any]) -> None:
+        filename = progress.get("filename", "")
+        info_dict = progress.get("info_dict") or {}
+        entry_files = downloaded_bytes[info_dict.get("id") or filename]
+        # Estimates of fragmented downloads are too unreliable to abort on
+        entry_files[filename] = max(
+            progress.get("downloaded_bytes") or 0,
+            progress.get("total_bytes") or 0,
+        )
+
+        total = sum(entry_files.values())
+        if total > max_file_size:
+            raise FileTooLargeException(
+                f"Download exceeds {max_file_size} bytes ({total} bytes)"
+            )
+
+    return _guard
+
 
-    params = {
-        "outtmpl": f"{cure_dir}/output%(autonumber)d.%(ext)s",
+def _create_ytdl(
+    credentials: DownloaderCredentials,
+    max_file_size: int,
+    cure_dir: Path | None = None,
+) -> YoutubeDL:
+    params: dict[str, Any] = {
+        "format": _get_format_selector(max_file_size),
+        "format_sort": ["vcodec:h264", "acodec:aac", "ext:mp4:m4a"],
+        "merge_output_format": "mp4",
     }
 
+    if cure_dir is not None:
+        params["outtmpl"] = f"{cure_dir}/output%(autonumber)d.%(ext)s"
+        params["progress_hooks"] = [_create_size_guard(max_file_size)]
+
     if (username := credentials.username) and (password := credentials.password):
         params["username"] = username
         params["password"] = password
@@ -111,33 +195,134 @@ def _download_videos(
     if cookie_file := credentials.cookie_file:
         params["cookies"] = str(cookie_file)
 
-    ytdl = YoutubeDL(params=params)  # type: ignore[arg-type]
+    return YoutubeDL(params=params)  # type: ignore[arg-type]
+
+
+def _check_download_error(url: str, e: DownloadError) -> None:
+    cause = e.exc_info[1] if e.exc_info else None
+    if isinstance(cause, UnsupportedError):
+        _LOG.warning("Download URL unsupported by youtube-dl: %s", url, exc_info=e)
+        return
+
+    if isinstance(cause, ExtractorError):
+        if (
+            cause.msg == "There's no video in this tweet."
+            and not cause.expected
+            and not cause.video_id
+        ):
+            _LOG.info("YouTubeDL did not find any videos at %s", url)
+            return
+
+        if cause.msg and "rate-limit reached or login required" in cause.msg:
+            raise AccessDeniedException(
+                f"Maybe we should include login data for {url}",
+                host=normalize_host(urlsplit(url).netloc),
+            ) from e
+
+    raise TryAgainException from e
+
+
+# Only populated in process pool workers, YoutubeDL instances aren't thread-safe
+_warm_ytdls: dict[tuple[DownloaderCredentials, int], YoutubeDL] | None = None
+
+
+def _warm_up_worker(credentials: DownloaderCredentials, max_file_size: int) -> None:
+    global _warm_ytdls
+    _warm_ytdls = {
+        (credentials, max_file_size): _create_ytdl(credentials, max_file_size),
+    }
+
+    # Compiles the URL patterns of all extractors, which is otherwise done lazily
+    # during the first extraction.
+    for extractor in gen_extractor_classes():
+        extractor.suitable("")
+
+
+def _get_extraction_ytdl(
+    credentials: DownloaderCredentials,
+    max_file_size: int,
+) -> YoutubeDL:
+    if _warm_ytdls is None:
+        return _create_ytdl(credentials, max_file_size)
+
+    key = (credentials, max_file_size)
+    ytdl = _warm_ytdls.get(key)
+    if ytdl is None:
+        ytdl = _create_ytdl(credentials, max_file_size)
+        _warm_ytdls[key] = ytdl
+
+    return ytdl
+
+
+def _get_info(
+    url: str,
+    credentials: DownloaderCredentials,
+    max_file_size: int,
+) -> VideoInfo | None:
+    ytdl = _get_extraction_ytdl(credentials, max_file_size)
 
     try:
-        return_code = ytdl.download([url])  # type: ignore[func-returns-value]
+        info = ytdl.extract_info(url, download=False)
     except DownloadError as e:
-        cause = e.exc_info
-        if isinstance(cause, UnsupportedError):
-            _LOG.warning("Download URL unsupported by youtube-dl: %s", url, exc_info=e)
-            return []
-
-        if isinstance(cause, ExtractorError):
-            if (
-                cause.msg == "There's no video in this tweet."
-                and not cause.expected
-                and not cause.video_id
-            ):
-                _LOG.info("YouTubeDL did not find any videos at %s", url)
-                return []
+        _check_download_error(url, e)
+        return None
 
-            if "rate-limit reached or login required" in cause.msg:
-                raise AccessDeniedException(
-                    f"Maybe we should include login data for {url}"
-                ) from e
+    if info is None:
+        return None
 
-        raise TryAgainException from e
-    if return_code != 0:
-        _LOG.error("YTDL returned error code %d", return_code)
+    size = cast(
+        int | None,
+        info.get("filesize") or info.get("filesize_approx"),
+    )
+
+    if size is None:
+        _LOG.debug("Got no file size for URL %s", url)
+    else:
+        _LOG.debug(
+            "Got a file size of approx. %d MB for URL %s",
+            round(float(size) / 1_000_000),
+            url,
+        )
+
+    raw_thumbnails = cast(list, info.get("thumbnails", []))
+    if raw_thumbnails:
+        _LOG.debug(
+            "Thumbnails for URL %s have the following keys: %s",
+            url,
+            list(raw_thumbnails[0].keys()),
+        )
+    thumbnails = [
+        t["url"]
+        for t in sorted(
+            raw_thumbnails,
+            key=lambda t: t.get("preference") or t.get("filesize") or -999999,
+            reverse=True,
+        )
+    ]
+
+    # The info dict may have to cross a process boundary
+    ie_result = cast(dict[str, Any], ytdl.sanitize_info(info))
+    return VideoInfo(url, size, thumbnails, ie_result)
+
+
+def _download_videos(
+    base_folder: Path,
+    credentials: DownloaderCredentials,
+    max_file_size: int,
+    info: VideoInfo,
+) -> list[Path]:
+    cure_id = str(uuid.uuid4())
+    cure_dir = base_folder / cure_id
+    cure_dir.mkdir()
+
+    ytdl = _create_ytdl(credentials, max_file_size, cure_dir)
+
+    try:
+        # Reuse the extraction result instead of letting ytdl fetch the page again.
+        # It went through sanitize_info, so it's a plain dict instead of an _InfoDict.
+        ytdl.process_ie_result(cast(Any, info.ie_result), download=True)
+    except DownloadError as e:
+        _check_download_error(info.url, e)
         return []
 
     cure_names = list(Path.iterdir(cure_dir))
@@ -146,100 +331,347 @@ def _download_videos(
     return cure_names
 
 
-def _get_dimensions(image_path: Path) -> tuple[int, int]:
-    image = Image.open(image_path)
-    return image.size
+async def _run_process(*args: str | Path) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"{args[0]} failed! Output:\n{stdout.decode('utf-8')}"
+            f"\n\nStderr: {stderr.decode('utf-8')}"
+        )
 
+    return stdout
+
+
+@dataclass
+class _StreamCodecs:
+    video: str | None
+    audio: str | None
+
+
+async def _probe_codecs(path: Path) -> _StreamCodecs:
+    output = await _run_process(
+        "ffprobe",
+        "-v",
+        "error",
+        "-show_entries",
+        "stream=codec_type,codec_name",
+        "-of",
+        "json",
+        path,
+    )
+    streams = json.loads(output).get("streams", [])
+
+    def _find_codec(codec_type: str) -> str | None:
+        for stream in streams:
+            if stream.get("codec_type") == codec_type:
+                return stream.get("codec_name")
+        return None
+
+    return _StreamCodecs(video=_find_codec("video"), audio=_find_codec("audio"))
+
+
+_COMPATIBLE_VIDEO_CODECS = {"h264"}
+_COMPATIBLE_AUDIO_CODECS = {"aac", "mp3"}
+
+_VIDEO_TRANSCODE_ARGS = [
+    "-c:v",
+    "libx264",
+    "-preset",
+    "veryfast",
+    "-crf",
+    "23",
+    "-pix_fmt",
+    "yuv420p",
+]
+_AUDIO_TRANSCODE_ARGS = ["-c:a", "aac", "-b:a", "128k"]
+
+
+def _get_codec_args(codecs: _StreamCodecs | None) -> list[str]:
+    if codecs is None:
+        return [*_VIDEO_TRANSCODE_ARGS, *_AUDIO_TRANSCODE_ARGS]
+
+    if codecs.video in _COMPATIBLE_VIDEO_CODECS:
+        args = ["-c:v", "copy"]
+    else:
+        args = list(_VIDEO_TRANSCODE_ARGS)
+
+    if codecs.audio is None or codecs.audio in _COMPATIBLE_AUDIO_CODECS:
+        args.extend(["-c:a", "copy"])
+    else:
+        args.extend(_AUDIO_TRANSCODE_ARGS)
+
+    return args
+
+
+async def _convert_cure(
+    input_path: Path,
+    output_path: Path,
+    codec_args: list[str],
+) -> None:
+    _LOG.info(
+        "Converting from %s to %s using %s",
+        input_path,
+        output_path,
+        " ".join(codec_args),
+    )
+    await _run_process(
+        "ffmpeg",
+        "-y",
+        "-i",
+        input_path,
+        "-sn",
+        "-dn",
+        *codec_args,
+        "-movflags",
+        "+faststart",
+        output_path,
+    )
+
+
+def _is_compatible(codecs: _StreamCodecs) -> bool:
+    return codecs.video in _COMPATIBLE_VIDEO_CODECS and (
+        codecs.audio is None or codecs.audio in _COMPATIBLE_AUDIO_CODECS
+    )
+
+
+async def _try_probe_codecs(path: Path) -> _StreamCodecs | None:
+    try:
+        return await _probe_codecs(path)
+    except Exception as e:
+        _LOG.warning("Could not probe %s", path, exc_info=e)
+        return None
+
+
+async def _make_compatible(
+    original_path: Path,
+    converted_path: Path,
+    codecs: _StreamCodecs | None,
+) -> None:
+    codec_args = _get_codec_args(codecs)
+    full_transcode_args = _get_codec_args(None)
+    try:
+        await _convert_cure(original_path, converted_path, codec_args)
+    except RuntimeError as e:
+        if codec_args == full_transcode_args:
+            raise
+
+        _LOG.warning(
+            "Could not copy streams of %s, transcoding instead",
+            original_path,
+            exc_info=e,
+        )
+        await _convert_cure(original_path, converted_path, full_transcode_args)
 
-class _Downloader:
-    def __init__(self, bot: Bot, config: DownloaderConfig) -> None:
-        self.bot = bot
-        self.config = config
 
-    async def _convert_cure(self, input_path: Path, output_path: Path) -> None:
-        _LOG.info("Converting from %s to %s", input_path, output_path)
-        process = await asyncio.create_subprocess_exec(
+_MAX_MEDIA_GROUP_SIZE = 10
+_MAX_THUMB_SIZE = 200_000
+_MAX_THUMB_DIMENSION = 320
+_MAX_CONCURRENT_THUMB_FETCHES = 4
+
+
+@dataclass
+class _ThumbCandidate:
+    url: str
+    content: bytes
+    dimensions: tuple[int, int]
+
+    @property
+    def fits(self) -> bool:
+        return max(self.dimensions) <= _MAX_THUMB_DIMENSION
+
+
+def _read_dimensions(content: bytes) -> tuple[int, int] | None:
+    # Pillow only parses the header here, the image data isn't decoded
+    try:
+        with Image.open(BytesIO(content)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def _shrink_thumb(content: bytes, thumb_path: Path) -> None:
+    with Image.open(BytesIO(content)) as image:
+        image.thumbnail((_MAX_THUMB_DIMENSION, _MAX_THUMB_DIMENSION))
+        image.convert("RGB").save(thumb_path, "JPEG", quality=85)
+
+
+async def _fetch_thumb(client: AsyncClient, url: str) -> _ThumbCandidate | None:
+    content = bytearray()
+    dimensions: tuple[int, int] | None = None
+
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+
+        content_length = response.headers.get("content-length")
+        if content_length and int(content_length) > _MAX_THUMB_SIZE:
+            _LOG.info("Skipping thumbnail %s because its file size is too large", url)
+            return None
+
+        async for chunk in response.aiter_bytes():
+            content.extend(chunk)
+            if len(content) > _MAX_THUMB_SIZE:
+                _LOG.info(
+                    "Skipping thumbnail %s because its file size is too large", url
+                )
+                return None
+
+            if dimensions is None:
+                dimensions = _read_dimensions(bytes(content))
+
+    if dimensions is None:
+        _LOG.info("Skipping thumbnail %s because it's not a readable image", url)
+        return None
+
+    _LOG.debug(
+        "Found thumbnail %s with dimensions %d x %d and size %d",
+        url,
+        dimensions[0],
+        dimensions[1],
+        len(content),
+    )
+    return _ThumbCandidate(url, bytes(content), dimensions)
+
+
+async def _generate_thumb(video_path: Path, thumb_path: Path) -> Path | None:
+    try:
+        await _run_process(
             "ffmpeg",
+            "-y",
             "-i",
-            input_path,
-            output_path,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+            video_path,
+            "-frames:v",
+            "1",
+            "-vf",
+            f"scale={_MAX_THUMB_DIMENSION}:{_MAX_THUMB_DIMENSION}"
+            ":force_original_aspect_ratio=decrease",
+            "-q:v",
+            "5",
+            thumb_path,
         )
-        if await process.wait() != 0:
-            if (stdout := process.stdout) is not None:
-                output = (await stdout.read()).decode("utf-8")
-            else:
-                output = ""
-
-            if (stderr := process.stderr) is not None:
-                error_output = (await stderr.read()).decode("utf-8")
-            else:
-                error_output = ""
-
-            raise RuntimeError(
-                f"Could not convert file! Output:\n{output}\n\nStderr: {error_output}"
-            )
+    except (OSError, RuntimeError) as e:
+        _LOG.warning("Could not generate thumbnail for %s", video_path, exc_info=e)
+        return None
+
+    if thumb_path.stat().st_size > _MAX_THUMB_SIZE:
+        _LOG.info("Generated thumbnail for %s is too large", video_path)
+        return None
+
+    return thumb_path
+
+
+class _Downloader:
+    def __init__(
+        self,
+        bot: Bot,
+        config: DownloaderConfig,
+        file_id_cache: FileIdCache,
+        process_pool: ProcessPool | None,
+        storage: StorageManager,
+    ) -> None:
+        self.bot = bot
+        self.config = config
+        self.file_id_cache = file_id_cache
+        self.process_pool = process_pool
+        self.storage = storage
+
+        concurrency = config.concurrency
+        self._payload_scheduler: FairScheduler[int] = FairScheduler(
+            max_running=concurrency.max_payloads,
+            max_running_per_key=concurrency.max_payloads_per_chat,
+        )
+        self._extraction_slots = asyncio.Semaphore(concurrency.max_extractions)
+        self._download_slots = asyncio.Semaphore(concurrency.max_downloads)
+        self._conversion_slots = asyncio.Semaphore(concurrency.max_conversions)
+        self._upload_slots = asyncio.Semaphore(concurrency.max_uploads)
+        self._circuit_breaker = CircuitBreaker(config.circuit_breaker)
+
+    async def _run_ytdl[T](self, func: Callable[..., T], *args: Any) -> T:
+        if (process_pool := self.process_pool) is None:
+            return await _run_blocking(lambda: func(*args))
+
+        return await process_pool.run(func, *args)
 
     async def _ensure_compatibility(self, original_path: Path) -> Path | None:
         ext = original_path.suffix
-        if ext == ".mp4":
-            return original_path
-
         if ext in [".png", ".jpg"]:
             return None
 
+        # The fallback formats can merge VP9/AV1 and Opus into an mp4 container
+        codecs = await _try_probe_codecs(original_path)
+        if ext == ".mp4" and (codecs is None or _is_compatible(codecs)):
+            return original_path
+
         converted_path = original_path.with_suffix(".mp4")
-        await self._convert_cure(original_path, converted_path)
+        if converted_path == original_path:
+            converted_path = original_path.with_stem(f"{original_path.stem}-cured")
+
+        async with self._conversion_slots:
+            await _make_compatible(original_path, converted_path, codecs)
         return converted_path
 
     async def _download_thumb(
         self, client: AsyncClient, cure_dir: Path, urls: list[str]
     ) -> Path | None:
-        for url in urls:
-            if not url.endswith(".jpg"):
-                continue
+        fetch_slots = asyncio.Semaphore(_MAX_CONCURRENT_THUMB_FETCHES)
+
+        async def _fetch(url: str) -> _ThumbCandidate | None:
+            async with fetch_slots:
+                try:
+                    return await _fetch_thumb(client, url)
+                except Exception as e:
+                    _LOG.warning("Could not download thumbnail %s", url, exc_info=e)
+                    return None
+
+        tasks = [
+            asyncio.create_task(_fetch(url)) for url in urls if url.endswith(".jpg")
+        ]
+        oversized: list[_ThumbCandidate] = []
+        winner: _ThumbCandidate | None = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                candidate = await next_done
+                if candidate is None:
+                    continue
+
+                if candidate.fits:
+                    winner = candidate
+                    break
 
+                _LOG.info(
+                    "Thumbnail %s has too large dimensions (%d x %d)",
+                    candidate.url,
+                    candidate.dimensions[0],
+                    candidate.dimensions[1],
+                )
+                oversized.append(candidate)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        thumb_path = cure_dir / "thumb.jpg"
+        if winner is not None:
+            _LOG.debug("Using thumbnail %s", winner.url)
+            thumb_path.write_bytes(winner.content)
+            return thumb_path
+
+        for candidate in oversized:
+            _LOG.debug("Shrinking thumbnail %s", candidate.url)
             try:
-                response = await client.get(url)
-                response.raise_for_status()
+                await _run_blocking(
+                    lambda: _shrink_thumb(candidate.content, thumb_path)
+                )
             except Exception as e:
-                _LOG.warning("Could not download thumbnail %s", url, exc_info=e)
+                _LOG.warning("Could not shrink thumbnail %s", candidate.url, exc_info=e)
                 continue
-            else:
-                # TODO: maybe don't download the whole content here
-                if len(response.content) > 200_000:
-                    _LOG.info(
-                        "Skipping thumbnail %s because its file size is too large", url
-                    )
-                    continue
-
-                _LOG.debug("Found thumbnail with size %d", len(response.content))
-
-                thumb_path = cure_dir / "thumb.jpg"
-                with thumb_path.open("wb") as f:
-                    f.write(response.content)
-
-                dimensions = await _run_blocking(lambda: _get_dimensions(thumb_path))
-                if max(dimensions) > 320:
-                    _LOG.info(
-                        "Skipping thumbnail %s because its"
-                        " dimensions (%d x %d) are too large",
-                        url,
-                        dimensions[0],
-                        dimensions[1],
-                    )
-                    continue
-                else:
-                    _LOG.debug(
-                        "Using thumbnail %s with dimensions %d x %d and size %d",
-                        url,
-                        dimensions[0],
-                        dimensions[1],
-                        thumb_path.stat().st_size,
-                    )
 
+            if thumb_path.stat().st_size <= _MAX_THUMB_SIZE:
                 return thumb_path
+
         return None
 
     async def _upload_video(
@@ -250,7 +682,7 @@ class _Downloader:
         video_file: Path,
         cure_path: Path | None = None,
         retries: int = 2,
-    ) -> Path | None:
+    ) -> str | None:
         _LOG.info(
             "Uploading video %s (%d retries left)",
             video_file,
@@ -267,16 +699,17 @@ class _Downloader:
             return None
 
         try:
-            message = await self.bot.send_video(
-                chat_id,
-                cure_path,
-                reply_parameters=ReplyParameters(
-                    message_id,
+            with ExitStack() as files:
+                message = await self.bot.send_video(
+                    chat_id,
+                    _open_upload(cure_path, files),
+                    reply_parameters=ReplyParameters(
+                        message_id,
+                    )
+                    if message_id
+                    else None,
+                    thumbnail=_open_upload(thumb_path, files) if thumb_path else None,
                 )
-                if message_id
-                else None,
-                thumbnail=thumb_path,
-            )
         except NetworkError as e:
             if retries > 0:
                 _LOG.warning("Video upload failed due to network issue. Retrying...")
@@ -305,8 +738,32 @@ class _Downloader:
             return None
 
         video = cast(Video, message.video)
-        file_id = video.file_id
-        return Path(file_id)
+        return video.file_id
+
+    async def _send_cached_video(
+        self,
+        chat_id: int,
+        message_id: int,
+        file_id: str,
+    ) -> bool:
+        _LOG.info("Sending cached video %s", file_id)
+        try:
+            await self.bot.send_video(
+                chat_id,
+                file_id,
+                reply_parameters=ReplyParameters(message_id),
+            )
+        except BadRequest as e:
+            # A subclass of NetworkError, but retrying won't make the file ID valid
+            _LOG.error("Could not send cached video %s", file_id, exc_info=e)
+            return False
+        except NetworkError as e:
+            raise TryAgainException from e
+        except TelegramError as e:
+            _LOG.error("Could not send cached video %s", file_id, exc_info=e)
+            return False
+
+        return True
 
     async def _notify_failure(
         self,
@@ -334,90 +791,365 @@ class _Downloader:
         except BadRequest:
             _LOG.warning("Could not set reaction on message (probably deleted)")
 
+    async def _cure_url(
+        self,
+        client: AsyncClient,
+        url_slots: asyncio.Semaphore,
+        work_dirs: ExitStack,
+        url: str,
+    ) -> _UrlResult:
+        async with url_slots:
+            if cached_file_ids := await self.file_id_cache.get(url):
+                return _UrlResult(url, cached_file_ids=cached_file_ids)
+
+            async with self._extraction_slots:
+                info = await self._run_ytdl(
+                    _get_info,
+                    url,
+                    self.config.credentials,
+                    self.config.max_file_size,
+                )
+
+            if info is None:
+                return _UrlResult(url)
+
+            if info.size is not None and info.size > self.config.max_file_size:
+                _LOG.info("Skipping URL %s because it's too large", url)
+                return _UrlResult(url, found_too_large=True)
+
+            folder = work_dirs.enter_context(
+                self.storage.work_dir(info.size, self.config.max_file_size)
+            )
+
+            thumb_file: Path | None = None
+            if info.thumbnails:
+                _LOG.debug(
+                    "Found %d thumbnail candidates for URL %s",
+                    len(info.thumbnails),
+                    url,
+                )
+                thumb_file = await self._download_thumb(client, folder, info.thumbnails)
+
+            try:
+                async with self._download_slots:
+                    download_result = await self._run_ytdl(
+                        _download_videos,
+                        folder,
+                        self.config.credentials,
+                        self.config.max_file_size,
+                        info,
+                    )
+            except FileTooLargeException as e:
+                _LOG.info("Aborted download of URL %s", url, exc_info=e)
+                return _UrlResult(url, found_too_large=True)
+
+            result = _UrlResult(url)
+            for file in download_result:
+                cure_path = await self._ensure_compatibility(file)
+                if cure_path is None:
+                    _LOG.info("Not uploading incompatible file %s", file)
+                    continue
+
+                file_thumb = thumb_file
+                if file_thumb is None:
+                    async with self._conversion_slots:
+                        file_thumb = await _generate_thumb(
+                            cure_path,
+                            cure_path.with_name(f"{cure_path.stem}-thumb.jpg"),
+                        )
+
+                result.files.append(_CuredFile(file_thumb, file, cure_path))
+
+            return result
+
+    @staticmethod
+    def _handle_cure_failure(
+        errors: ExceptionGroup,
+        attempt: int,
+    ) -> Subscriber.Result:
+        access_denied, rest = errors.split(AccessDeniedException)
+        if access_denied is not None:
+            _LOG.error("Was denied access to service", exc_info=access_denied)
+            return Subscriber.Result.Requeue
+
+        storage_full, rest = errors.split(StorageFullException)
+        if storage_full is not None:
+            _LOG.warning("Not enough storage for payload", exc_info=storage_full)
+            return Subscriber.Result.Requeue
+
+        try_again, rest = errors.split(TryAgainException)
+        if try_again is None or rest is not None:
+            raise errors
+
+        if attempt < 6:
+            _LOG.warning("Got exception during download", exc_info=try_again)
+            return Subscriber.Result.Requeue
+
+        _LOG.error(
+            "Want to requeue, but maximum number of attempts reached. Dropping message.",
+            exc_info=try_again,
+        )
+        return Subscriber.Result.Drop
+
+    async def _send_media_group(
+        self,
+        payload: DownloadMessage,
+        uploads: list[_Upload],
+        retries: int = 2,
+    ) -> list[str | None]:
+        _LOG.info(
+            "Uploading media group of %d videos (%d retries left)",
+            len(uploads),
+            retries,
+        )
+
+        try:
+            with ExitStack() as files:
+                messages = await self.bot.send_media_group(
+                    payload.chat_id,
+                    [upload.to_input_media(files) for upload in uploads],
+                    reply_parameters=ReplyParameters(payload.message_id),
+                )
+        except BadRequest:
+            # E.g. a stale file ID, which the single uploads can sort out
+            raise
+        except RetryAfter as e:
+            # Falling back to single uploads would only make the flood worse
+            if retries > 0:
+                delay = _get_retry_delay(e)
+                _LOG.warning("Hit flood control, retrying media group in %ss", delay)
+                await asyncio.sleep(delay)
+                return await self._send_media_group(payload, uploads, retries - 1)
+
+            _LOG.error("Media group hit flood control repeatedly", exc_info=e)
+            raise TryAgainException from e
+        except NetworkError as e:
+            if retries > 0:
+                _LOG.warning(
+                    "Media group upload failed due to network issue. Retrying..."
+                )
+                return await self._send_media_group(payload, uploads, retries - 1)
+
+            _LOG.error(
+                "Media group failed due to network multiple times. Requeueing...",
+                exc_info=e,
+            )
+            raise TryAgainException from e
+
+        return [cast(Video, message.video).file_id for message in messages]
+
+    async def _send_single(
+        self,
+        payload: DownloadMessage,
+        upload: _Upload,
+    ) -> str | None:
+        media = upload.media
+        if isinstance(media, str):
+            if await self._send_cached_video(
+                payload.chat_id, payload.message_id, media
+            ):
+                return media
+            return None
+
+        async with self._upload_slots:
+            return await self._upload_video(
+                payload.chat_id,
+                payload.message_id,
+                media.thumb_path,
+                media.video_file,
+                media.cure_path,
+            )
+
+    async def _send_uploads(
+        self,
+        payload: DownloadMessage,
+        uploads: list[_Upload],
+    ) -> list[str | None]:
+        if len(uploads) > 1:
+            try:
+                async with self._upload_slots:
+                    return await self._send_media_group(payload, uploads)
+            except TelegramError as e:
+                _LOG.warning(
+                    "Could not send media group, falling back to single uploads",
+                    exc_info=e,
+                )
+
+        return [await self._send_single(payload, upload) for upload in uploads]
+
+    async def _send_results(
+        self,
+        payload: DownloadMessage,
+        results: list[_UrlResult],
+    ) -> list[str]:
+        uploads = [
+            _Upload(result.url, media)
+            for result in results
+            for media in (result.cached_file_ids or result.files)
+        ]
+
+        # Albums keep their order in the chat, so the batches are sent one by one
+        file_ids: list[str | None] = []
+        for batch in itertools.batched(uploads, _MAX_MEDIA_GROUP_SIZE):
+            file_ids.extend(await self._send_uploads(payload, list(batch)))
+
+        stale_urls: list[str] = []
+        uploaded = list(zip(uploads, file_ids, strict=True))
+        for result in results:
+            result_file_ids = [
+                file_id for upload, file_id in uploaded if upload.url == result.url
+            ]
+
+            if result.cached_file_ids is not None:
+                if None in result_file_ids:
+                    await self.file_id_cache.remove(result.url)
+                    stale_urls.append(result.url)
+                continue
+
+            if result_file_ids and None not in result_file_ids:
+                await self.file_id_cache.put(
+                    result.url,
+                    cast(list[str], result_file_ids),
+                )
+
+        return stale_urls
+
+    def _acquire_circuits(self, hosts: set[str]) -> timedelta | None:
+        acquired: list[str] = []
+        for host in hosts:
+            if (delay := self._circuit_breaker.acquire(host)) is not None:
+                for acquired_host in acquired:
+                    self._circuit_breaker.release(acquired_host)
+                return delay
+            acquired.append(host)
+
+        return None
+
+    def _trip_circuits(self, hosts: set[str]) -> timedelta | None:
+        for host in hosts:
+            self._circuit_breaker.record_failure(host)
+
+        delays = [
+            delay
+            for host in hosts
+            if (delay := self._circuit_breaker.get_delay(host)) is not None
+        ]
+        return max(delays, default=None)
+
     async def handle_payload(
         self,
         payload: DownloadMessage,
         attempt: int,
-    ) -> Subscriber.Result:
+    ) -> Subscriber.Result | Subscriber.RequeueAfter:
         _LOG.info("Received payload: %s", payload)
 
-        client = AsyncClient(timeout=60)
-
-        with TemporaryDirectory(dir=str(self.config.storage_dir)) as folder_path:
-            folder = Path(folder_path)
-            async with _busy_lock:
-                found_too_large = False
-                files: list[tuple[Path | None, Path]] = []
-                for url in payload.urls:
-                    info = await _run_blocking(lambda: _get_info(url))
-                    if info.size is not None and info.size > self.config.max_file_size:
-                        _LOG.info("Skipping URL %s because it's too large", url)
-                        found_too_large = True
-                        continue
-
-                    thumb_file: Path | None = None
-                    if info.thumbnails:
-                        _LOG.debug(
-                            "Found %d thumbnail candidates for URL %s",
-                            len(info.thumbnails),
-                            url,
-                        )
-                        thumb_file = await self._download_thumb(
-                            client, folder, info.thumbnails
-                        )
+        hosts = {normalize_host(urlsplit(url).netloc) for url in payload.urls}
+        if (delay := self._acquire_circuits(hosts)) is not None:
+            _LOG.info("Circuit is open for one of %s, requeuing", hosts)
+            return Subscriber.RequeueAfter(delay)
 
-                    try:
-                        download_result = await _run_blocking(
-                            lambda: _download_videos(
-                                folder,
-                                self.config.credentials,
-                                url,
-                            )
-                        )
-                    except TryAgainException as e:
-                        if attempt < 6:
-                            _LOG.warning("Got exception during download", exc_info=e)
-                            return Subscriber.Result.Requeue
-
-                        _LOG.error(
-                            "Want to requeue, but maximum number of attempts reached. Dropping message.",
-                            exc_info=e,
-                        )
-                        return Subscriber.Result.Drop
-                    except AccessDeniedException as e:
-                        _LOG.error("Was denied access to service", exc_info=e)
-                        return Subscriber.Result.Requeue
-
-                    for file in download_result:
-                        files.append((thumb_file, file))
-
-                if not files:
-                    _LOG.warning("Download returned no videos")
-                    if found_too_large:
-                        reaction = ReactionEmoji.SPOUTING_WHALE
-                        private_message = (
-                            "Das Video ist zu groß für die Telegram Bot API"
-                        )
-                    else:
-                        reaction = ReactionEmoji.MOYAI
-                        private_message = "Konnte keine Videos finden"
-
-                    await self._notify_failure(
-                        chat_id=payload.chat_id,
-                        message_id=payload.message_id,
-                        reaction=reaction,
-                        private_chat_message=private_message,
-                    )
-                    return Subscriber.Result.Ack
+        try:
+            async with self._payload_scheduler.slot(
+                payload.chat_id,
+                cost=len(payload.urls),
+            ):
+                result = await self._handle_payload(payload, attempt)
+        finally:
+            for host in hosts:
+                self._circuit_breaker.release(host)
 
-                for thumb_file, file in files:
-                    await self._upload_video(
-                        payload.chat_id, payload.message_id, thumb_file, file
-                    )
+        if result == Subscriber.Result.Ack:
+            for host in hosts:
+                self._circuit_breaker.record_success(host)
+
+        return result
 
-                _LOG.info("Successfully handled payload")
+    async def _cure_urls(
+        self,
+        work_dirs: ExitStack,
+        urls: list[str],
+    ) -> list[_UrlResult]:
+        url_slots = asyncio.Semaphore(self.config.concurrency.max_urls_per_payload)
+        async with AsyncClient(timeout=60) as client, asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(self._cure_url(client, url_slots, work_dirs, url))
+                for url in urls
+            ]
+
+        return [task.result() for task in tasks]
+
+    def _handle_cure_errors(
+        self,
+        errors: ExceptionGroup,
+        attempt: int,
+    ) -> Subscriber.Result | Subscriber.RequeueAfter:
+        access_denied = errors.subgroup(AccessDeniedException)
+        if access_denied is not None:
+            # Only the services that denied access, not every host of the payload
+            denied_hosts = {
+                e.host
+                for e in access_denied.exceptions
+                if isinstance(e, AccessDeniedException)
+            }
+            if delay := self._trip_circuits(denied_hosts):
+                _LOG.error("Was denied access to service", exc_info=errors)
+                return Subscriber.RequeueAfter(delay)
+
+        return self._handle_cure_failure(errors, attempt)
+
+    async def _notify_no_videos(
+        self,
+        payload: DownloadMessage,
+        results: list[_UrlResult],
+    ) -> None:
+        _LOG.warning("Download returned no videos")
+        if any(result.found_too_large for result in results):
+            reaction = ReactionEmoji.SPOUTING_WHALE
+            private_message = "Das Video ist zu groß für die Telegram Bot API"
+        else:
+            reaction = ReactionEmoji.MOYAI
+            private_message = "Konnte keine Videos finden"
+
+        await self._notify_failure(
+            chat_id=payload.chat_id,
+            message_id=payload.message_id,
+            reaction=reaction,
+            private_chat_message=private_message,
+        )
+
+    async def _handle_payload(
+        self,
+        payload: DownloadMessage,
+        attempt: int,
+    ) -> Subscriber.Result | Subscriber.RequeueAfter:
+        with ExitStack() as work_dirs:
+            try:
+                results = await self._cure_urls(work_dirs, payload.urls)
+            except ExceptionGroup as e:
+                return self._handle_cure_errors(e, attempt)
+
+            if not any(result.files or result.cached_file_ids for result in results):
+                await self._notify_no_videos(payload, results)
                 return Subscriber.Result.Ack
 
+            stale_urls = await self._send_results(payload, results)
+            if stale_urls:
+                # The cache entries are gone by now, so this downloads them again
+                _LOG.warning("Cached videos of %s were rejected", stale_urls)
+                try:
+                    results = await self._cure_urls(work_dirs, stale_urls)
+                except ExceptionGroup as e:
+                    return self._handle_cure_errors(e, attempt)
+
+                if not any(result.files for result in results):
+                    await self._notify_no_videos(payload, results)
+                    return Subscriber.Result.Ack
+
+                await self._send_results(payload, results)
+
+            _LOG.info("Successfully handled payload")
+            return Subscriber.Result.Ack
+
 
 async def run(config: Config) -> None:
     downloader_config = config.download
@@ -425,13 +1157,50 @@ async def run(config: Config) -> None:
         _LOG.error("No downloader config found")
         sys.exit(1)
 
-    storage_dir = downloader_config.storage_dir
-    if not storage_dir.exists():
-        storage_dir.mkdir()
+    if config.event.broker == EventBroker.memory:
+        _LOG.error("The memory broker can't deliver to a separate downloader process")
+        sys.exit(1)
+
+    storage = StorageManager(downloader_config.storage_dir, downloader_config.storage)
+    storage.start()
 
     topic = downloader_config.topic
     _LOG.debug("Subscribing to topic %s", topic)
     subscriber = await initialize_subscriber(config.event)
-    downloader = _Downloader(Bot(config.telegram.token), downloader_config)
+    file_id_cache = SqliteFileIdCache.from_config(downloader_config.file_id_cache)
+
+    process_pool: ProcessPool | None = None
+    if (pool_config := downloader_config.process_pool) is not None:
+        _LOG.info("Running yt-dlp in %d worker processes", pool_config.size)
+        process_pool = ProcessPool(
+            size=pool_config.size,
+            max_jobs_per_worker=pool_config.max_jobs_per_worker,
+            max_worker_rss=pool_config.max_worker_rss,
+            initializer=_warm_up_worker,
+            initargs=(downloader_config.credentials, downloader_config.max_file_size),
+        )
+        await process_pool.start()
+
+    downloader = _Downloader(
+        Bot(config.telegram.token),
+        downloader_config,
+        file_id_cache,
+        process_pool,
+        storage,
+    )
 
-    await subscriber.subscribe(topic, DownloadMessage, downloader.handle_payload)
+    sweeper = asyncio.create_task(storage.sweep_periodically())
+    try:
+        concurrency = downloader_config.concurrency
+        await subscriber.subscribe(
+            topic,
+            DownloadMessage,
+            downloader.handle_payload,
+            # Pending payloads wait in the scheduler so it can pick a fair order
+            max_in_flight=concurrency.max_payloads + concurrency.max_pending_payloads,
+        )
+    finally:
+        sweeper.cancel()
+        await file_id_cache.close()
+        if process_pool is not None:
+            await process_pool.close()
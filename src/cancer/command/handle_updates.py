@@ -1,42 +1,44 @@
+import asyncio
+import functools
 import logging
 import signal
 from collections import defaultdict
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
 from dataclasses import dataclass
-from typing import Any, cast
-from urllib.parse import ParseResult, urlparse
+from typing import cast
 
 from bs_nats_updater import create_updater
+from telegram import Message as TelegramMessage
 from telegram import MessageEntity, Update, Voice
 from telegram.constants import ChatType, MessageEntityType, ReactionEmoji
 from telegram.error import BadRequest
-from telegram.ext import ApplicationBuilder, MessageHandler
-
+from telegram.ext import Application, ApplicationBuilder, MessageHandler
+
+from cancer.adapter.nats_connection import NatsConnection
+from cancer.adapter.publisher_memory import (
+    MemoryPublisher,
+    MemorySubscriber,
+    get_memory_broker,
+)
 from cancer.adapter.publisher_nats import NatsPublisher
-from cancer.config import Config, EventConfig
+from cancer.adapter.routing_rules_file import FileRoutingRuleSource
+from cancer.adapter.routing_rules_nats import NatsRoutingRuleSource
+from cancer.command import worker
+from cancer.config import Config, EventBroker
+from cancer.dedup import RecentLinks
 from cancer.message import Message, Topic
-from cancer.port.publisher import Publisher, PublishingException
+from cancer.port.publisher import Publisher
+from cancer.port.routing_rules import RoutingRuleSource
+from cancer.port.subscriber import Subscriber
+from cancer.routing import Cancer, InvalidRulesException, UrlRouter, parse_rules
+from cancer.scheduling import BackgroundQueue
+from cancer.update_processor import ChatUpdateProcessor
 
 _LOG = logging.getLogger(__name__)
 
-
-@dataclass
-class Cancer:
-    host: str
-    treatment: Topic | None
-    private_treatment: Topic | None = None
-    path: str | None = None
-
-    def matches(self, symptoms: ParseResult) -> bool:
-        if symptoms.netloc.startswith(self.host):
-            return not self.path or symptoms.path.startswith(self.path)
-        return False
-
-    def get_treatment(self, *, is_private: bool) -> Topic | None:
-        if is_private:
-            return self.private_treatment or self.treatment
-
-        return self.treatment
+_SIDE_EFFECTS_GRACE_PERIOD = 5.0
+_RULE_WATCH_MIN_DELAY = 1.0
+_RULE_WATCH_MAX_DELAY = 300.0
 
 
 _CANCERS = [
@@ -107,6 +109,8 @@ _CANCERS = [
     ),
 ]
 
+_DEFAULT_ROUTER = UrlRouter(_CANCERS)
+
 
 @dataclass
 class Diagnosis:
@@ -126,19 +130,8 @@ class Diagnosis:
         return treatment
 
 
-@dataclass
-class Cure:
-    cure_path: str
-    cancer: str
-
-
-@dataclass
-class Drug:
-    drug_id: str
-    cancer: str
-
-
 def _diagnose_cancer(
+    router: UrlRouter,
     parse_entity: Callable[[MessageEntity], str],
     entity: MessageEntity,
     is_direct_chat: bool,
@@ -151,20 +144,15 @@ def _diagnose_cancer(
         return None
 
     _LOG.info("Extracted URL %s", url)
-    symptoms = urlparse(url)
-    for cancer in _CANCERS:
-        if cancer.matches(symptoms):
-            diagnosis = Diagnosis(
-                cancer=cancer,
-                case=url,
-                is_private=is_direct_chat,
-            )
-            if not diagnosis.has_treatment:
-                continue
-
-            return diagnosis
+    cancer = router.route(url, is_private=is_direct_chat)
+    if cancer is None:
+        return None
 
-    return None
+    return Diagnosis(
+        cancer=cancer,
+        case=url,
+        is_private=is_direct_chat,
+    )
 
 
 def _make_message(
@@ -176,9 +164,39 @@ def _make_message(
     return treatment.create_message(chat_id, message_id, [d.case for d in diagnoses])
 
 
+async def _reply_healthy(message: TelegramMessage) -> None:
+    try:
+        await message.reply_text(
+            "Joa weiß nicht, versteh ich jetzt auch nicht so genau 🤷‍♂️"
+        )
+    except BadRequest:
+        pass
+
+
+async def _react(message: TelegramMessage, *, is_direct_chat: bool) -> None:
+    try:
+        await message.set_reaction(
+            reaction=ReactionEmoji.SALUTING_FACE
+            if is_direct_chat
+            else ReactionEmoji.POUTING_FACE,
+        )
+    except Exception as e:
+        # Don't really care if this fails.
+        _LOG.error("Could not set message reaction", exc_info=e)
+
+
 class _CancerBot:
-    def __init__(self, publisher: Publisher) -> None:
+    def __init__(
+        self,
+        publisher: Publisher,
+        side_effects: BackgroundQueue,
+        recent_links: RecentLinks,
+    ) -> None:
         self.publisher = publisher
+        self.side_effects = side_effects
+        self.recent_links = recent_links
+        # Replaced as a whole when the routing rules change
+        self.router = _DEFAULT_ROUTER
 
     async def handle_update(self, update: Update, _):
         message = update.message
@@ -210,14 +228,25 @@ class _CancerBot:
             _LOG.debug("Not a text or caption")
             return
 
+        router = self.router
         diagnosis_by_treatment: dict[Topic, list[Diagnosis]] = defaultdict(list)
+        new_links: dict[Topic, list[str]] = defaultdict(list)
         if entities:
             for entity in entities:
                 diagnosis = _diagnose_cancer(
-                    parse_entity, entity, is_direct_chat=is_direct_chat
+                    router, parse_entity, entity, is_direct_chat=is_direct_chat
                 )
-                if diagnosis:
-                    diagnosis_by_treatment[diagnosis.treatment].append(diagnosis)
+                if not diagnosis:
+                    continue
+
+                # Reposts in private chats are deliberate, e.g. to retry a download
+                if not is_direct_chat:
+                    if not self.recent_links.add(chat_id, diagnosis.case):
+                        _LOG.info("Skipping recently posted URL %s", diagnosis.case)
+                        continue
+                    new_links[diagnosis.treatment].append(diagnosis.case)
+
+                diagnosis_by_treatment[diagnosis.treatment].append(diagnosis)
 
         if is_direct_chat and voice:
             diagnosis_by_treatment[Topic.voiceDownload].append(
@@ -232,54 +261,182 @@ class _CancerBot:
             _LOG.debug("Message was healthy")
 
             if is_direct_chat:
-                try:
-                    await message.reply_text(
-                        "Joa weiß nicht, versteh ich jetzt auch nicht so genau 🤷‍♂️"
-                    )
-                except BadRequest:
-                    pass
+                self.side_effects.submit(functools.partial(_reply_healthy, message))
 
             return
 
+        events = {
+            treatment: _make_message(chat_id, message.message_id, treatment, diagnoses)
+            for treatment, diagnoses in diagnosis_by_treatment.items()
+        }
         try:
-            await message.set_reaction(
-                reaction=ReactionEmoji.SALUTING_FACE
-                if is_direct_chat
-                else ReactionEmoji.POUTING_FACE,
+            failures = await self._publish_events(events, is_priority=is_direct_chat)
+        except BaseException:
+            # Cancelled while publishing, so we don't know what made it
+            self._forget_links(chat_id, new_links, events)
+            raise
+
+        if failures:
+            # Let the next post of the links try again, but only of the failed topics
+            self._forget_links(chat_id, new_links, failures)
+            raise ExceptionGroup(
+                "Could not publish all events", list(failures.values())
             )
-        except Exception as e:
-            # Don't really care if this fails.
-            _LOG.error("Could not set message reaction", exc_info=e)
 
-        for treatment in Topic:
-            diagnoses = diagnosis_by_treatment[treatment]
-            if not diagnoses:
-                _LOG.debug("No diagnosed cases for treatment %s", treatment)
-                continue
-
-            event = _make_message(chat_id, message.message_id, treatment, diagnoses)
+        # Cosmetic, so it must not delay the publishing of the next update
+        self.side_effects.submit(
+            functools.partial(_react, message, is_direct_chat=is_direct_chat)
+        )
 
+    async def watch_routing_rules(self, source: RoutingRuleSource) -> None:
+        delay = _RULE_WATCH_MIN_DELAY
+        while True:
             try:
-                await self.publisher.publish(treatment, event)
-                _LOG.info("Published event on topic %s", treatment.value)
-            except PublishingException as e:
-                _LOG.error("Could not publish event", exc_info=e)
-                raise
+                async for document in source.watch():
+                    self._apply_routing_rules(document)
+                    delay = _RULE_WATCH_MIN_DELAY
+            except Exception as e:
+                _LOG.error("Routing rule watch failed, retrying", exc_info=e)
+            else:
+                _LOG.warning("Routing rule watch ended, retrying")
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RULE_WATCH_MAX_DELAY)
+
+    def _apply_routing_rules(self, document: bytes | None) -> None:
+        if document is None:
+            _LOG.info("No routing rules configured, using the built-in ones")
+            self.router = _DEFAULT_ROUTER
+            return
 
+        try:
+            rules = parse_rules(document)
+        except InvalidRulesException as e:
+            _LOG.error("Keeping the current routing rules", exc_info=e)
+            return
 
-def _init_publisher(config: EventConfig) -> Publisher:
-    nats_config = config.nats
-    if nats_config is None:
-        raise ValueError("nats config is required when broker is nats")
+        self.router = UrlRouter(rules)
+        _LOG.info("Loaded %d routing rules", len(rules))
+
+    def _forget_links(
+        self,
+        chat_id: int,
+        links: dict[Topic, list[str]],
+        topics: Iterable[Topic],
+    ) -> None:
+        for topic in topics:
+            for url in links.get(topic, []):
+                self.recent_links.remove(chat_id, url)
+
+    async def _publish_events(
+        self,
+        events: dict[Topic, Message],
+        *,
+        is_priority: bool,
+    ) -> dict[Topic, Exception]:
+        results = await asyncio.gather(
+            *(
+                self.publisher.publish(topic, event, is_priority=is_priority)
+                for topic, event in events.items()
+            ),
+            return_exceptions=True,
+        )
+
+        failures: dict[Topic, Exception] = {}
+        for topic, result in zip(events, results):
+            if isinstance(result, Exception):
+                _LOG.error("Could not publish event", exc_info=result)
+                failures[topic] = result
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                _LOG.info("Published event on topic %s", topic.value)
+
+        return failures
+
+
+def _init_publisher(config: Config, connection: NatsConnection | None) -> Publisher:
+    event_config = config.event
+    match event_config.broker:
+        case EventBroker.memory:
+            # Only the topics of the local worker have a subscriber
+            worker_config = config.worker
+            topics = set(worker_config.topics) if worker_config is not None else set()
+            return MemoryPublisher(get_memory_broker(), topics=topics)
+        case EventBroker.nats:
+            nats_config = event_config.nats
+            if nats_config is None:
+                raise ValueError("nats config is required when broker is nats")
+
+            return NatsPublisher(nats_config, connection)
+
+
+def _init_rule_source(
+    config: Config,
+    connection: NatsConnection | None,
+) -> RoutingRuleSource | None:
+    routing_config = config.update_handler.routing
+    if routing_config.rules_file is not None:
+        return FileRoutingRuleSource(
+            routing_config.rules_file,
+            routing_config.rules_poll_interval,
+        )
+
+    if routing_config.rules_bucket is not None:
+        if connection is None:
+            raise ValueError("nats broker is required for a routing rules bucket")
+
+        return NatsRoutingRuleSource(
+            connection,
+            routing_config.rules_bucket,
+            routing_config.rules_key,
+        )
 
-    return NatsPublisher(nats_config)
+    return None
 
 
 def run(config: Config) -> None:
-    publisher: Publisher = _init_publisher(config.event)
-    cancer_bot = _CancerBot(publisher)
+    # Shared by the publisher and the routing rule watch, closed by the publisher
+    nats_connection = (
+        NatsConnection(nats_config) if (nats_config := config.event.nats) else None
+    )
+    publisher: Publisher = _init_publisher(config, nats_connection)
+    side_effects = BackgroundQueue(
+        max_running=config.update_handler.max_side_effects,
+        max_pending=config.update_handler.max_pending_side_effects,
+    )
+    recent_links = RecentLinks(
+        window=config.update_handler.duplicate_window,
+        max_entries=config.update_handler.max_recent_links,
+    )
+    cancer_bot = _CancerBot(publisher, side_effects, recent_links)
+    rule_source = _init_rule_source(config, nats_connection)
+
+    # Without a broker process, the worker topics are handled in this process
+    local_subscriber: Subscriber | None = None
+    if config.event.broker == EventBroker.memory:
+        _LOG.warning("Using the memory broker, only worker topics will be handled")
+        if config.worker is not None:
+            local_subscriber = MemorySubscriber(get_memory_broker())
+
+    # Not started with app.create_task, the application waits for those to finish
+    # before it calls post_stop
+    local_worker: asyncio.Task[None] | None = None
+    rule_watcher: asyncio.Task[None] | None = None
+
+    async def __post_init(app: Application) -> None:
+        nonlocal local_worker, rule_watcher
+        if rule_source is not None:
+            rule_watcher = asyncio.create_task(
+                cancer_bot.watch_routing_rules(rule_source)
+            )
+
+        if local_subscriber is not None:
+            worker_config = worker.check_config(config)
+            local_worker = asyncio.create_task(
+                worker.serve(worker_config, local_subscriber, app.bot)
+            )
 
-    async def __post_init(_: Any) -> None:
         signal_file = config.running_signal_file
         if signal_file is None:
             return
@@ -287,11 +444,31 @@ def run(config: Config) -> None:
         with signal_file.open("w"):
             pass
 
+    async def __post_stop(_: Application) -> None:
+        if rule_watcher is not None:
+            rule_watcher.cancel()
+            await asyncio.gather(rule_watcher, return_exceptions=True)
+        if rule_source is not None:
+            await rule_source.close()
+        await side_effects.close(_SIDE_EFFECTS_GRACE_PERIOD)
+        if local_subscriber is not None:
+            await local_subscriber.close()
+        if local_worker is not None:
+            # Returns once the subscriber finished its in-flight messages
+            await local_worker
+        await publisher.close()
+
     app = (
         ApplicationBuilder()
         .updater(create_updater(config.telegram.token, config.telegram.updater_nats))
+        .concurrent_updates(
+            ChatUpdateProcessor(
+                max_running=config.update_handler.max_updates,
+                max_queued=config.update_handler.max_queued_updates,
+            )
+        )
         .post_init(__post_init)
-        .post_stop(lambda _: publisher.close())
+        .post_stop(__post_stop)
         .build()
     )
 
@@ -8,7 +8,7 @@ from telegram.constants import FileSizeLimit
 from cancer.command.util import initialize_subscriber
 from cancer.config import Config
 from cancer.message import Topic, VoiceMessage
-from cancer.port.subscriber import Subscriber
+from cancer.port.subscriber import MessageCallback, Subscriber
 
 _LOG = logging.getLogger(__name__)
 
@@ -46,15 +46,17 @@ class _TelegramAudioConverter:
         return Subscriber.Result.Ack
 
 
+def create_handler(bot: Bot) -> MessageCallback[VoiceMessage]:
+    return _TelegramAudioConverter(bot).handle_payload
+
+
 async def run(config: Config) -> None:
     topic = Topic.voiceDownload
     _LOG.debug("Subscribing to topic %s", topic)
 
     subscriber = await initialize_subscriber(config.event)
-    converter = _TelegramAudioConverter(Bot(config.telegram.token))
-
     await subscriber.subscribe(
         topic,
         VoiceMessage,
-        converter.handle_payload,
+        create_handler(Bot(config.telegram.token)),
     )
@@ -9,7 +9,7 @@ from cancer.command.util import initialize_subscriber
 from cancer.config import Config
 from cancer.message import Topic
 from cancer.message.youtube_url_convert import UrlConvertMessage
-from cancer.port.subscriber import Subscriber
+from cancer.port.subscriber import MessageCallback, Subscriber
 
 _LOG = logging.getLogger(__name__)
 
@@ -75,15 +75,17 @@ class _UrlAliasResolver:
         return Subscriber.Result.Ack
 
 
+def create_handler(bot: Bot) -> MessageCallback[UrlConvertMessage]:
+    return _UrlAliasResolver(bot).handle_payload
+
+
 async def run(config: Config) -> None:
     topic = Topic.urlAliasResolution
     _LOG.debug("Subscribing to topic %s", topic)
 
     subscriber = await initialize_subscriber(config.event)
-    converter = _UrlAliasResolver(Bot(config.telegram.token))
-
     await subscriber.subscribe(
         topic,
         UrlConvertMessage,
-        converter.handle_payload,
+        create_handler(Bot(config.telegram.token)),
     )
@@ -2,15 +2,21 @@ import asyncio
 import logging
 import signal
 
+from cancer.adapter.publisher_memory import MemorySubscriber, get_memory_broker
 from cancer.adapter.publisher_nats import NatsSubscriber
-from cancer.config import EventConfig
+from cancer.config import EventBroker, EventConfig
 from cancer.port.subscriber import Subscriber
 
 _LOG = logging.getLogger(__name__)
 
+# The loop only keeps weak references to tasks
+_CLOSE_TASKS: set[asyncio.Task[None]] = set()
+
 
 def _close_subscriber(subscriber: Subscriber) -> None:
-    asyncio.ensure_future(subscriber.close())
+    task = asyncio.create_task(subscriber.close())
+    _CLOSE_TASKS.add(task)
+    task.add_done_callback(_CLOSE_TASKS.discard)
 
 
 def _close_subscriber_on_signal(subscriber: Subscriber):
@@ -22,9 +28,17 @@ def _close_subscriber_on_signal(subscriber: Subscriber):
 async def initialize_subscriber(config: EventConfig) -> Subscriber:
     subscriber: Subscriber
 
-    nats_config = config.nats
-    _LOG.info("Using NATS subscriber")
-    subscriber = NatsSubscriber(nats_config)
+    match config.broker:
+        case EventBroker.memory:
+            _LOG.info("Using in-memory subscriber")
+            subscriber = MemorySubscriber(get_memory_broker())
+        case EventBroker.nats:
+            nats_config = config.nats
+            if nats_config is None:
+                raise ValueError("nats config is required when broker is nats")
+
+            _LOG.info("Using NATS subscriber")
+            subscriber = NatsSubscriber(nats_config)
 
     _close_subscriber_on_signal(subscriber)
 
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import sys
+from collections.abc import Callable
+from typing import Any
+
+from telegram import Bot
+
+from cancer.command import (
+    telegram_audio_convert,
+    url_alias_resolution,
+    youtube_url_convert,
+)
+from cancer.command.util import initialize_subscriber
+from cancer.config import Config, WorkerConfig
+from cancer.message import Message, Topic, UrlConvertMessage, VoiceMessage
+from cancer.port.subscriber import MessageCallback, Subscriber
+
+_LOG = logging.getLogger(__name__)
+
+_HANDLERS: dict[Topic, tuple[type[Message], Callable[[Bot], MessageCallback[Any]]]] = {
+    Topic.voiceDownload: (VoiceMessage, telegram_audio_convert.create_handler),
+    Topic.urlAliasResolution: (
+        UrlConvertMessage,
+        url_alias_resolution.create_handler,
+    ),
+    Topic.youtubeUrlConvert: (UrlConvertMessage, youtube_url_convert.create_handler),
+}
+
+
+def _create_handler(
+    topic: Topic,
+    bot: Bot,
+) -> tuple[type[Message], MessageCallback[Any]]:
+    message_type, create_handler = _HANDLERS[topic]
+    return message_type, create_handler(bot)
+
+
+async def serve(config: WorkerConfig, subscriber: Subscriber, bot: Bot) -> None:
+    async with asyncio.TaskGroup() as tg:
+        for topic, max_in_flight in config.topics.items():
+            _LOG.debug("Subscribing to topic %s", topic)
+            message_type, handle = _create_handler(topic, bot)
+            tg.create_task(
+                subscriber.subscribe(
+                    topic,
+                    message_type,
+                    handle,
+                    max_in_flight=max_in_flight,
+                )
+            )
+
+
+def check_config(config: Config) -> WorkerConfig:
+    worker_config = config.worker
+    if worker_config is None:
+        _LOG.error("No worker config found")
+        sys.exit(1)
+
+    unsupported = [topic for topic in worker_config.topics if topic not in _HANDLERS]
+    if unsupported:
+        _LOG.error(
+            "Worker can't handle topics %s",
+            ", ".join(topic.value for topic in unsupported),
+        )
+        sys.exit(1)
+
+    return worker_config
+
+
+async def run(config: Config) -> None:
+    worker_config = check_config(config)
+    subscriber = await initialize_subscriber(config.event)
+    await serve(worker_config, subscriber, Bot(config.telegram.token))
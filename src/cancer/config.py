@@ -1,12 +1,14 @@
 import logging
 from dataclasses import dataclass
+from datetime import timedelta
+from enum import Enum
 from pathlib import Path
 from typing import Self, cast
 
 from bs_config import Env
 from bs_nats_updater import NatsConfig
 
-from cancer.message import Topic
+from cancer.message import Codec, Topic
 
 _LOG = logging.getLogger(__name__)
 
@@ -26,10 +28,133 @@ class DownloaderCredentials:
         )
 
 
+@dataclass(frozen=True, kw_only=True)
+class CircuitBreakerConfig:
+    failure_threshold: int
+    base_delay: timedelta
+    max_delay: timedelta
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            failure_threshold=env.get_int(
+                "circuit-breaker-failure-threshold", default=2
+            ),
+            base_delay=timedelta(
+                seconds=env.get_int("circuit-breaker-base-delay-seconds", default=60)
+            ),
+            max_delay=timedelta(
+                seconds=env.get_int("circuit-breaker-max-delay-seconds", default=3600)
+            ),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class DownloaderConcurrency:
+    max_payloads: int
+    max_payloads_per_chat: int
+    max_pending_payloads: int
+    max_urls_per_payload: int
+    max_extractions: int
+    max_downloads: int
+    max_conversions: int
+    max_uploads: int
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            max_payloads=env.get_int("max-concurrent-payloads", default=4),
+            max_payloads_per_chat=env.get_int(
+                "max-concurrent-payloads-per-chat", default=2
+            ),
+            max_pending_payloads=env.get_int("max-pending-payloads", default=12),
+            max_urls_per_payload=env.get_int("max-concurrent-urls", default=4),
+            max_extractions=env.get_int("max-concurrent-extractions", default=4),
+            max_downloads=env.get_int("max-concurrent-downloads", default=4),
+            max_conversions=env.get_int("max-concurrent-conversions", default=1),
+            max_uploads=env.get_int("max-concurrent-uploads", default=2),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class FileIdCacheConfig:
+    path: Path
+    ttl: timedelta
+    max_entries: int
+
+    @classmethod
+    def from_env(cls, env: Env, storage_dir: Path) -> Self:
+        return cls(
+            path=env.get_string(
+                "file-id-cache-file",
+                default=storage_dir / "file-id-cache.sqlite3",
+                transform=Path,
+            ),
+            ttl=timedelta(
+                seconds=env.get_int(
+                    "file-id-cache-ttl-seconds",
+                    default=int(timedelta(days=7).total_seconds()),
+                )
+            ),
+            max_entries=env.get_int("file-id-cache-max-entries", default=10_000),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class ProcessPoolConfig:
+    size: int
+    max_jobs_per_worker: int
+    max_worker_rss: int
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self | None:
+        size = env.get_int("ytdl-process-workers", default=0)
+        if size <= 0:
+            return None
+
+        return cls(
+            size=size,
+            max_jobs_per_worker=env.get_int("ytdl-worker-max-jobs", default=50),
+            max_worker_rss=env.get_int("ytdl-worker-max-rss", default=512_000_000),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class StorageConfig:
+    quota: int
+    orphan_max_age: timedelta
+    sweep_interval: timedelta
+    scratch_dir: Path | None
+    scratch_max_file_size: int
+    scratch_quota: int
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            quota=env.get_int("storage-quota", default=1_500_000_000),
+            orphan_max_age=timedelta(
+                seconds=env.get_int("storage-orphan-max-age-seconds", default=3600)
+            ),
+            sweep_interval=timedelta(
+                seconds=env.get_int("storage-sweep-interval-seconds", default=600)
+            ),
+            scratch_dir=env.get_string("scratch-dir", transform=Path),
+            scratch_max_file_size=env.get_int(
+                "scratch-max-file-size", default=10_000_000
+            ),
+            scratch_quota=env.get_int("scratch-quota", default=100_000_000),
+        )
+
+
 @dataclass(frozen=True, kw_only=True)
 class DownloaderConfig:
+    circuit_breaker: CircuitBreakerConfig
+    concurrency: DownloaderConcurrency
     credentials: DownloaderCredentials
+    file_id_cache: FileIdCacheConfig
     max_file_size: int
+    process_pool: ProcessPoolConfig | None
+    storage: StorageConfig
     storage_dir: Path
     topic: Topic
     upload_chat_id: int
@@ -48,12 +173,18 @@ class DownloaderConfig:
     @classmethod
     def from_env(cls, env: Env) -> Self | None:
         try:
+            storage_dir = env.get_string(
+                "storage-dir", default=Path("downloads"), transform=Path
+            )
             return cls(
+                circuit_breaker=CircuitBreakerConfig.from_env(env),
+                concurrency=DownloaderConcurrency.from_env(env),
                 credentials=DownloaderCredentials.from_env(env),
+                file_id_cache=FileIdCacheConfig.from_env(env, storage_dir),
                 max_file_size=env.get_int("max-download-file-size", default=40_000_000),
-                storage_dir=env.get_string(
-                    "storage-dir", default=Path("downloads"), transform=Path
-                ),
+                process_pool=ProcessPoolConfig.from_env(env),
+                storage=StorageConfig.from_env(env),
+                storage_dir=storage_dir,
                 topic=env.get_string(
                     "download-type",
                     default=cast(Topic, Topic.download),
@@ -92,38 +223,170 @@ class TelegramConfig:
         )
 
 
+@dataclass(frozen=True, kw_only=True)
+class RoutingConfig:
+    # Falls back to the built-in rules if neither is set
+    rules_file: Path | None
+    rules_poll_interval: timedelta
+    rules_bucket: str | None
+    rules_key: str
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            rules_file=env.get_string("routing-rules-file", transform=Path),
+            rules_poll_interval=timedelta(
+                seconds=env.get_int("routing-rules-poll-interval-seconds", default=10)
+            ),
+            rules_bucket=env.get_string("routing-rules-bucket"),
+            rules_key=env.get_string("routing-rules-key", default="rules"),
+        )
+
+
+@dataclass(frozen=True, kw_only=True)
+class UpdateHandlerConfig:
+    max_updates: int
+    # Updates beyond the running and queued ones are dropped
+    max_queued_updates: int
+    max_side_effects: int
+    max_pending_side_effects: int
+    # Repeated links in a group chat are skipped within this window
+    duplicate_window: timedelta
+    max_recent_links: int
+    routing: RoutingConfig
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self:
+        return cls(
+            max_updates=env.get_int("max-concurrent-updates", default=8),
+            max_queued_updates=env.get_int("max-queued-updates", default=256),
+            max_side_effects=env.get_int("max-concurrent-side-effects", default=4),
+            max_pending_side_effects=env.get_int(
+                "max-pending-side-effects",
+                default=100,
+            ),
+            duplicate_window=timedelta(
+                seconds=env.get_int("duplicate-link-window-seconds", default=600)
+            ),
+            max_recent_links=env.get_int("max-recent-links", default=10_000),
+            routing=RoutingConfig.from_env(env),
+        )
+
+
 @dataclass(frozen=True, kw_only=True)
 class EventNatsConfig:
+    codec: Codec
     endpoint: str
     credentials: str | None
     stream_name: str
+    fetch_batch_size: int
+    heartbeat_interval: timedelta | None
+    max_in_flight: int
+    max_pending_acks: int
+    # Priority lane fetches in a row before the normal lane gets a turn, 0 disables
+    priority_weight: int
+    publish_timeout: timedelta
+    shutdown_grace_period: timedelta
 
-    def get_publish_subject(self, topic: Topic) -> str:
-        return f"{self.stream_name}.{topic.value}"
-
-    def get_consumer_name(self, topic: Topic) -> str:
+    def _get_lane_name(self, topic: Topic, is_priority: bool) -> str:
+        if is_priority and self.priority_weight > 0:
+            return f"{topic.value}-priority"
         return topic.value
 
+    def get_publish_subject(self, topic: Topic, *, is_priority: bool = False) -> str:
+        return f"{self.stream_name}.{self._get_lane_name(topic, is_priority)}"
+
+    def get_consumer_name(self, topic: Topic, *, is_priority: bool = False) -> str:
+        return self._get_lane_name(topic, is_priority)
+
+    @staticmethod
+    def _parse_heartbeat_interval(seconds: int) -> timedelta | None:
+        # Derived from the consumer's ack wait if not set
+        if seconds <= 0:
+            return None
+        return timedelta(seconds=seconds)
+
     @classmethod
     def from_env(cls, env: Env) -> Self:
         return cls(
+            codec=env.get_string(
+                "codec",
+                default=cast(Codec, Codec.json),
+                transform=Codec,
+            ),
             endpoint=env.get_string("endpoint", required=True),
             credentials=env.get_string("credentials"),
             stream_name=env.get_string("stream-name", required=True),
+            fetch_batch_size=env.get_int("fetch-batch-size", default=4),
+            heartbeat_interval=cls._parse_heartbeat_interval(
+                env.get_int("in-progress-interval-seconds", default=0)
+            ),
+            max_in_flight=env.get_int("max-in-flight-messages", default=4),
+            max_pending_acks=env.get_int("max-pending-acks", default=256),
+            priority_weight=env.get_int("priority-weight", default=0),
+            publish_timeout=timedelta(
+                seconds=env.get_int("publish-timeout-seconds", default=5)
+            ),
+            shutdown_grace_period=timedelta(
+                seconds=env.get_int("shutdown-grace-period-seconds", default=25)
+            ),
         )
 
 
+class EventBroker(str, Enum):
+    # Only within the update handler process, i.e. for the worker topics. The
+    # downloaders run in their own processes and need nats.
+    memory = "memory"
+    nats = "nats"
+
+
 @dataclass(frozen=True, kw_only=True)
 class EventConfig:
-    nats: EventNatsConfig
+    broker: EventBroker
+    nats: EventNatsConfig | None
 
     @classmethod
     def from_env(cls, env: Env) -> Self:
+        broker = env.get_string(
+            "event-broker",
+            default=cast(EventBroker, EventBroker.nats),
+            transform=EventBroker,
+        )
         return cls(
-            nats=EventNatsConfig.from_env(env / "nats-cancer"),
+            broker=broker,
+            nats=EventNatsConfig.from_env(env / "nats-cancer")
+            if broker == EventBroker.nats
+            else None,
         )
 
 
+@dataclass(frozen=True, kw_only=True)
+class WorkerConfig:
+    # Topics without a limit use the subscriber's default
+    topics: dict[Topic, int | None]
+
+    @staticmethod
+    def _parse_topics(value: str) -> dict[Topic, int | None]:
+        topics: dict[Topic, int | None] = {}
+        for entry in value.split(","):
+            name, _, limit = entry.strip().partition(":")
+            topics[Topic(name)] = int(limit) if limit else None
+        return topics
+
+    @classmethod
+    def from_env(cls, env: Env) -> Self | None:
+        try:
+            topics = env.get_string("worker-topics", transform=cls._parse_topics)
+        except ValueError as e:
+            _LOG.error("Could not parse worker topics. %s", e)
+            return None
+
+        if not topics:
+            return None
+
+        return cls(topics=topics)
+
+
 @dataclass(frozen=True, kw_only=True)
 class Config:
     download: DownloaderConfig | None
@@ -131,6 +394,8 @@ class Config:
     running_signal_file: Path | None
     sentry: SentryConfig
     telegram: TelegramConfig
+    update_handler: UpdateHandlerConfig
+    worker: WorkerConfig | None
 
     @classmethod
     def from_env(cls, env: Env) -> Self:
@@ -143,4 +408,6 @@ class Config:
             ),
             sentry=SentryConfig.from_env(env),
             telegram=TelegramConfig.from_env(env / "telegram"),
+            update_handler=UpdateHandlerConfig.from_env(env),
+            worker=WorkerConfig.from_env(env),
         )
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from datetime import timedelta
+
+from cancer.url import normalize_url
+
+
+class RecentLinks:
+    def __init__(
+        self,
+        window: timedelta,
+        max_entries: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.window = window
+        self.max_entries = max_entries
+        self._clock = clock
+        # Oldest first, a repeat doesn't extend the window of the first post
+        self._seen: OrderedDict[tuple[int, str], float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window.total_seconds()
+        while self._seen:
+            key, seen_at = next(iter(self._seen.items()))
+            if seen_at > cutoff:
+                break
+            del self._seen[key]
+
+    def add(self, chat_id: int, url: str) -> bool:
+        now = self._clock()
+        self._expire(now)
+
+        key = (chat_id, normalize_url(url))
+        if key in self._seen:
+            return False
+
+        self._seen[key] = now
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+        return True
+
+    def remove(self, chat_id: int, url: str) -> None:
+        self._seen.pop((chat_id, normalize_url(url)), None)
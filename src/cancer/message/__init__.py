@@ -1,3 +1,4 @@
+from .codec import CODEC_HEADER, Codec, UnknownCodecException  # noqa
 from .download import DownloadMessage  # noqa
 from .message import Message  # noqa
 from .topic import Topic  # noqa
@@ -0,0 +1,93 @@
+import dataclasses
+import json
+import operator
+from collections.abc import Callable, Mapping
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Self
+
+CODEC_HEADER = "Cancer-Codec"
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+_DECODER = json.JSONDecoder()
+
+
+class UnknownCodecException(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class _Schema:
+    names: tuple[str, ...]
+    known_names: frozenset[str]
+    get_values: Callable[[Any], tuple[Any, ...]]
+
+
+_SCHEMAS: dict[type, _Schema] = {}
+
+
+def _get_schema(message_type: type) -> _Schema:
+    schema = _SCHEMAS.get(message_type)
+    if schema is None:
+        names = tuple(field.name for field in dataclasses.fields(message_type))
+        schema = _Schema(
+            names=names,
+            known_names=frozenset(names),
+            get_values=operator.attrgetter(*names),
+        )
+        _SCHEMAS[message_type] = schema
+
+    return schema
+
+
+class Codec(Enum):
+    # The original format: a JSON object keyed by field name
+    json = "json/1"
+    # A JSON array in field order. New fields must be appended and have defaults.
+    compact = "compact/2"
+
+    @classmethod
+    def from_headers(cls, headers: Mapping[str, str] | None) -> Self:
+        if not headers or (value := headers.get(CODEC_HEADER)) is None:
+            return cls.json
+
+        try:
+            return cls(value)
+        except ValueError as e:
+            raise UnknownCodecException(f"Unknown codec {value}") from e
+
+    def to_headers(self) -> dict[str, str]:
+        return {CODEC_HEADER: self.value}
+
+    def encode(self, message: Any) -> bytes:
+        schema = _get_schema(type(message))
+        values = schema.get_values(message)
+        match self:
+            case Codec.json:
+                encoded = _ENCODER.encode(dict(zip(schema.names, values)))
+            case Codec.compact:
+                encoded = _ENCODER.encode(values)
+
+        return encoded.encode("utf-8")
+
+    def decode[T](self, message_type: type[T], data: bytes) -> T:
+        if not isinstance(data, bytes):
+            raise ValueError(f"Not a bytes: {data}")
+
+        schema = _get_schema(message_type)
+        decoded = _DECODER.decode(data.decode("utf-8"))
+        match self:
+            case Codec.json:
+                try:
+                    return message_type(**decoded)
+                except TypeError:
+                    # Fields added by newer producers
+                    return message_type(
+                        **{
+                            key: value
+                            for key, value in decoded.items()
+                            if key in schema.known_names
+                        }
+                    )
+            case Codec.compact:
+                return message_type(*decoded[: len(schema.names)])
@@ -1,6 +1,8 @@
 import abc
 import dataclasses
-import json
+from typing import Self
+
+from .codec import Codec
 
 
 @dataclasses.dataclass
@@ -8,12 +10,9 @@ class Message(abc.ABC):
     chat_id: int
     message_id: int
 
-    def serialize(self) -> bytes:
-        return json.dumps(dataclasses.asdict(self)).encode("utf-8")
+    def serialize(self, codec: Codec = Codec.json) -> bytes:
+        return codec.encode(self)
 
     @classmethod
-    def deserialize(cls, serialized: bytes):
-        if not isinstance(serialized, bytes):
-            raise ValueError(f"Not a bytes: {serialized}")
-
-        return cls(**json.loads(serialized.decode("utf-8")))
+    def deserialize(cls, serialized: bytes, codec: Codec = Codec.json) -> Self:
+        return codec.decode(cls, serialized)
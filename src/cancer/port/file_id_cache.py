@@ -0,0 +1,19 @@
+import abc
+
+
+class FileIdCache(abc.ABC):
+    @abc.abstractmethod
+    async def get(self, url: str) -> list[str] | None:
+        pass
+
+    @abc.abstractmethod
+    async def put(self, url: str, file_ids: list[str]) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def remove(self, url: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        pass
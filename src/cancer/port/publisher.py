@@ -9,7 +9,13 @@ class PublishingException(Exception):
 
 class Publisher(abc.ABC):
     @abc.abstractmethod
-    async def publish(self, topic: Topic, message: Message):
+    async def publish(
+        self,
+        topic: Topic,
+        message: Message,
+        *,
+        is_priority: bool = False,
+    ):
         pass
 
     @abc.abstractmethod
@@ -0,0 +1,14 @@
+import abc
+from collections.abc import AsyncGenerator
+
+
+class RoutingRuleSource(abc.ABC):
+    # Yields every version of the rules document, None if there is none (anymore).
+    # A generator, so callers can close it to end the watch.
+    @abc.abstractmethod
+    def watch(self) -> AsyncGenerator[bytes | None]:
+        pass
+
+    @abc.abstractmethod
+    async def close(self) -> None:
+        pass
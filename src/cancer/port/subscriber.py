@@ -1,10 +1,19 @@
 import abc
 from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import timedelta
 from enum import Enum, auto
 
 from cancer.message import Message, Topic
 
-type MessageCallback[T] = Callable[[T, int], Awaitable[Subscriber.Result]]
+type MessageCallback[T] = Callable[
+    [T, int], Awaitable[Subscriber.Result | Subscriber.RequeueAfter]
+]
+
+
+def get_requeue_delay(num_delivered: int) -> timedelta:
+    # 20, 60, 180, 540, 1620
+    return timedelta(seconds=20 * pow(3, num_delivered - 1))
 
 
 class Subscriber(abc.ABC):
@@ -13,9 +22,18 @@ class Subscriber(abc.ABC):
         Drop = auto()
         Requeue = auto()
 
+    @dataclass(frozen=True)
+    class RequeueAfter:
+        delay: timedelta
+
     @abc.abstractmethod
     async def subscribe[T: Message](
-        self, topic: Topic, message_type: type[T], handle: MessageCallback[T]
+        self,
+        topic: Topic,
+        message_type: type[T],
+        handle: MessageCallback[T],
+        *,
+        max_in_flight: int | None = None,
     ) -> None:
         pass
 
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import resource
+from collections.abc import Callable
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any
+
+_LOG = logging.getLogger(__name__)
+
+
+class WorkerCrashedException(Exception):
+    pass
+
+
+def _get_rss() -> int:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _make_portable(error: BaseException) -> BaseException:
+    try:
+        return pickle.loads(pickle.dumps(error))
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _work(
+    connection: Connection,
+    initializer: Callable[..., None] | None,
+    initargs: tuple[Any, ...],
+) -> None:
+    if initializer is not None:
+        initializer(*initargs)
+
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+
+        if job is None:
+            return
+
+        func, args = job
+        try:
+            response = (True, func(*args), _get_rss())
+        except Exception as e:
+            response = (False, _make_portable(e), _get_rss())
+
+        try:
+            connection.send(response)
+        except Exception as e:
+            connection.send((False, _make_portable(e), _get_rss()))
+
+
+@dataclass(eq=False)
+class _Worker:
+    process: BaseProcess
+    connection: Connection
+    jobs: int = 0
+
+
+class ProcessPool:
+    def __init__(
+        self,
+        *,
+        size: int,
+        max_jobs_per_worker: int,
+        max_worker_rss: int,
+        initializer: Callable[..., None] | None = None,
+        initargs: tuple[Any, ...] = (),
+    ) -> None:
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_worker_rss = max_worker_rss
+        self._initializer = initializer
+        self._initargs = initargs
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue[_Worker] | None = None
+        self._workers: set[_Worker] = set()
+        self._replacements: set[asyncio.Task[None]] = set()
+
+    def _spawn(self) -> _Worker:
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_work,
+            args=(child_connection, self._initializer, self._initargs),
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+
+        worker = _Worker(process, parent_connection)
+        self._workers.add(worker)
+        _LOG.debug("Started worker process %d", process.pid)
+        return worker
+
+    def _retire(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        try:
+            worker.connection.send(None)
+        except OSError:
+            pass
+        worker.connection.close()
+        worker.process.join(timeout=1)
+        if worker.process.is_alive():
+            worker.process.kill()
+        _LOG.debug("Retired worker process %d", worker.process.pid)
+
+    def _replace(self, worker: _Worker) -> _Worker:
+        self._retire(worker)
+        return self._spawn()
+
+    async def _refill(self, idle: asyncio.Queue[_Worker], worker: _Worker) -> None:
+        idle.put_nowait(await asyncio.to_thread(self._replace, worker))
+
+    def _replace_later(self, idle: asyncio.Queue[_Worker], worker: _Worker) -> None:
+        # Joining and spawning processes blocks, so it happens off the loop and
+        # without holding up the job that triggered it
+        task = asyncio.create_task(self._refill(idle, worker))
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def start(self) -> asyncio.Queue[_Worker]:
+        idle = self._idle
+        if idle is None:
+            idle = asyncio.Queue()
+            self._idle = idle
+            for _ in range(self.size):
+                idle.put_nowait(await asyncio.to_thread(self._spawn))
+        return idle
+
+    @staticmethod
+    def _call(
+        worker: _Worker,
+        func: Callable[..., Any],
+        args: tuple[Any, ...],
+    ) -> tuple[bool, Any, int]:
+        worker.connection.send((func, args))
+        try:
+            return worker.connection.recv()
+        except EOFError as e:
+            raise WorkerCrashedException(
+                f"Worker process {worker.process.pid} died during job"
+            ) from e
+
+    async def run[T](self, func: Callable[..., T], *args: Any) -> T:
+        idle = await self.start()
+        worker = await idle.get()
+
+        try:
+            is_success, result, rss = await asyncio.to_thread(
+                self._call, worker, func, args
+            )
+        except BaseException:
+            # The worker may still be busy (cancellation) or dead, so we can't reuse it
+            worker.process.kill()
+            self._replace_later(idle, worker)
+            raise
+
+        worker.jobs += 1
+        if worker.jobs >= self.max_jobs_per_worker or rss > self.max_worker_rss:
+            _LOG.info(
+                "Recycling worker process %d after %d jobs (RSS: %d MB)",
+                worker.process.pid,
+                worker.jobs,
+                rss // 1_000_000,
+            )
+            self._replace_later(idle, worker)
+        else:
+            idle.put_nowait(worker)
+
+        if not is_success:
+            raise result
+
+        return result
+
+    async def close(self) -> None:
+        if self._replacements:
+            await asyncio.wait(self._replacements)
+        for worker in list(self._workers):
+            await asyncio.to_thread(self._retire, worker)
+        self._idle = None
+        _LOG.info("Process pool closed")
@@ -0,0 +1,151 @@
+import json
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlsplit
+
+from cancer.message import Topic
+from cancer.url import normalize_host
+
+
+@dataclass
+class Cancer:
+    host: str
+    treatment: Topic | None
+    private_treatment: Topic | None = None
+    path: str | None = None
+
+    def get_treatment(self, *, is_private: bool) -> Topic | None:
+        if is_private:
+            return self.private_treatment or self.treatment
+
+        return self.treatment
+
+
+class InvalidRulesException(Exception):
+    pass
+
+
+# Voice messages aren't URLs, so they can't be routed
+_URL_TOPICS = frozenset(topic for topic in Topic if topic != Topic.voiceDownload)
+_RULE_KEYS = frozenset({"host", "path", "treatment", "private-treatment"})
+
+
+def _parse_topic(rule: dict[str, Any], key: str) -> Topic | None:
+    value = rule.get(key)
+    if value is None:
+        return None
+
+    try:
+        topic = Topic(value)
+    except ValueError as e:
+        raise InvalidRulesException(f"Unknown {key} {value!r}") from e
+
+    if topic not in _URL_TOPICS:
+        raise InvalidRulesException(f"{key} {value!r} can't handle URLs")
+
+    return topic
+
+
+def _parse_rule(rule: Any) -> Cancer:
+    if not isinstance(rule, dict):
+        raise InvalidRulesException(f"Rule must be an object, got {rule!r}")
+
+    if unknown := rule.keys() - _RULE_KEYS:
+        raise InvalidRulesException(f"Unknown rule keys {sorted(unknown)}")
+
+    host = rule.get("host")
+    if not isinstance(host, str) or not host:
+        raise InvalidRulesException(f"Rule without host: {rule!r}")
+
+    path = rule.get("path")
+    if path is not None and not isinstance(path, str):
+        raise InvalidRulesException(f"Path of {host} must be a string")
+
+    cancer = Cancer(
+        host=host,
+        path=path,
+        treatment=_parse_topic(rule, "treatment"),
+        private_treatment=_parse_topic(rule, "private-treatment"),
+    )
+    if cancer.treatment is None and cancer.private_treatment is None:
+        raise InvalidRulesException(f"Rule for {host} has no treatment")
+
+    return cancer
+
+
+def parse_rules(document: bytes) -> list[Cancer]:
+    try:
+        rules = json.loads(document)
+    except ValueError as e:
+        raise InvalidRulesException("Rules are not valid JSON") from e
+
+    if not isinstance(rules, list):
+        raise InvalidRulesException("Rules must be a list")
+
+    return [_parse_rule(rule) for rule in rules]
+
+
+@dataclass
+class _PathNode:
+    children: dict[str, _PathNode] = field(default_factory=dict)
+    cancers: list[Cancer] = field(default_factory=list)
+
+
+def _split_path(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+def _iter_candidate_hosts(host: str) -> Iterator[str]:
+    yield host
+
+    # Subdomains are routed like their parent domain, but never like a bare TLD
+    labels = host.split(".")
+    for index in range(1, len(labels) - 1):
+        yield ".".join(labels[index:])
+
+
+class UrlRouter:
+    def __init__(self, cancers: Iterable[Cancer]) -> None:
+        self._hosts: dict[str, _PathNode] = {}
+        for cancer in cancers:
+            self._add(cancer)
+
+    def _add(self, cancer: Cancer) -> None:
+        host = normalize_host(cancer.host)
+        node = self._hosts.setdefault(host, _PathNode())
+        for segment in _split_path(cancer.path or ""):
+            node = node.children.setdefault(segment, _PathNode())
+
+        # www. and bare hosts collapse into the same rule
+        if cancer not in node.cancers:
+            node.cancers.append(cancer)
+
+    def route(self, url: str, *, is_private: bool) -> Cancer | None:
+        if "://" not in url:
+            url = f"https://{url}"
+
+        parts = urlsplit(url)
+        host = normalize_host(parts.netloc)
+        for candidate in _iter_candidate_hosts(host):
+            node = self._hosts.get(candidate)
+            if node is not None:
+                break
+        else:
+            return None
+
+        matches = [node.cancers]
+        for segment in _split_path(parts.path):
+            child = node.children.get(segment)
+            if child is None:
+                break
+            node = child
+            matches.append(node.cancers)
+
+        # The most specific rule with a treatment wins
+        for cancers in reversed(matches):
+            for cancer in cancers:
+                if cancer.get_treatment(is_private=is_private) is not None:
+                    return cancer
+
+        return None
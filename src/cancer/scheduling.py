@@ -0,0 +1,174 @@
+import asyncio
+import logging
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+_LOG = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    future: asyncio.Future[None]
+    cost: int
+
+
+# Deficit round robin over the keys that are waiting for a slot
+class FairScheduler[K: Hashable]:
+    def __init__(
+        self,
+        *,
+        max_running: int,
+        max_running_per_key: int,
+        quantum: int = 1,
+    ) -> None:
+        self.max_running = max_running
+        self.max_running_per_key = max_running_per_key
+        self.quantum = quantum
+        self._running = 0
+        self._running_by_key: dict[K, int] = defaultdict(int)
+        self._waiting: dict[K, deque[_Waiter]] = {}
+        self._deficits: dict[K, int] = {}
+        # Keys with waiters in round robin order
+        self._active: deque[K] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def _deactivate(self, key: K) -> None:
+        del self._waiting[key]
+        del self._deficits[key]
+        self._active.remove(key)
+
+    def _grant(self, key: K, waiter: _Waiter) -> None:
+        waiters = self._waiting[key]
+        waiters.popleft()
+        self._deficits[key] -= waiter.cost
+        self._running += 1
+        self._running_by_key[key] += 1
+        waiter.future.set_result(None)
+
+        if not waiters:
+            self._deactivate(key)
+        elif self._deficits[key] < waiters[0].cost:
+            self._active.rotate(-1)
+
+    def _dispatch(self) -> None:
+        capped = 0
+        while self._running < self.max_running and capped < len(self._active):
+            key = self._active[0]
+            waiters = self._waiting[key]
+            waiter = waiters[0]
+            if waiter.future.done():
+                # Cancelled while waiting
+                waiters.popleft()
+                if not waiters:
+                    self._deactivate(key)
+                continue
+
+            if self._running_by_key[key] >= self.max_running_per_key:
+                self._active.rotate(-1)
+                capped += 1
+                continue
+
+            capped = 0
+            if self._deficits[key] < waiter.cost:
+                self._deficits[key] += self.quantum
+
+            if self._deficits[key] >= waiter.cost:
+                self._grant(key, waiter)
+            else:
+                self._active.rotate(-1)
+
+    def _release(self, key: K) -> None:
+        self._running -= 1
+        self._running_by_key[key] -= 1
+        if not self._running_by_key[key]:
+            del self._running_by_key[key]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, key: K, cost: int = 1) -> AsyncIterator[None]:
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), max(cost, 1))
+        if key not in self._waiting:
+            self._waiting[key] = deque()
+            self._deficits[key] = 0
+            self._active.append(key)
+        self._waiting[key].append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted right before the cancellation
+                self._release(key)
+            else:
+                self._dispatch()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(key)
+
+
+# Fire-and-forget jobs with bounded concurrency, dropping the oldest pending job
+# once the backlog is full
+class BackgroundQueue:
+    def __init__(self, *, max_running: int, max_pending: int) -> None:
+        self.max_running = max_running
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: deque[Callable[[], Awaitable[None]]] = deque()
+        self._running: set[asyncio.Task[None]] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, job: Callable[[], Awaitable[None]]) -> None:
+        if len(self._running) < self.max_running:
+            self._start(job)
+            return
+
+        self._pending.append(job)
+        if len(self._pending) > self.max_pending:
+            self._pending.popleft()
+            self.dropped += 1
+            _LOG.warning("Dropped background job (%d so far)", self.dropped)
+
+    def _start(self, job: Callable[[], Awaitable[None]]) -> None:
+        task = asyncio.create_task(self._run(job))
+        self._running.add(task)
+        task.add_done_callback(self._on_done)
+
+    @staticmethod
+    async def _run(job: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await job()
+        except Exception as e:
+            _LOG.error("Background job failed", exc_info=e)
+
+    def _on_done(self, task: asyncio.Task[None]) -> None:
+        self._running.discard(task)
+        if self._pending:
+            self._start(self._pending.popleft())
+
+    async def close(self, timeout: float) -> None:
+        try:
+            async with asyncio.timeout(timeout):
+                while self._running:
+                    await asyncio.wait(set(self._running))
+        except TimeoutError:
+            _LOG.warning(
+                "Cancelling %d running and %d pending background jobs",
+                len(self._running),
+                len(self._pending),
+            )
+            self._pending.clear()
+            for task in self._running:
+                task.cancel()
+            await asyncio.wait(set(self._running))
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import shutil
+import time
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from pathlib import Path
+
+from cancer.config import StorageConfig
+
+_LOG = logging.getLogger(__name__)
+
+_WORK_DIR_PREFIX = "cure-"
+# Left behind by versions that used TemporaryDirectory
+_LEGACY_WORK_DIR_PREFIX = "tmp"
+
+
+class StorageFullException(Exception):
+    pass
+
+
+@dataclass
+class _Tier:
+    name: str
+    path: Path
+    quota: int
+    reserved: int = 0
+
+    def has_room(self, size: int) -> bool:
+        if self.reserved + size > self.quota:
+            return False
+
+        return shutil.disk_usage(self.path).free >= size
+
+
+class StorageManager:
+    def __init__(self, storage_dir: Path, config: StorageConfig) -> None:
+        self.config = config
+        self._disk = _Tier("disk", storage_dir, config.quota)
+        self._scratch: _Tier | None = None
+        if (scratch_dir := config.scratch_dir) is not None:
+            self._scratch = _Tier("scratch", scratch_dir, config.scratch_quota)
+
+        self._active: set[Path] = set()
+
+    def _tiers(self) -> list[_Tier]:
+        if self._scratch is None:
+            return [self._disk]
+        return [self._disk, self._scratch]
+
+    def start(self) -> None:
+        for tier in self._tiers():
+            tier.path.mkdir(parents=True, exist_ok=True)
+
+        # Nothing can be in use before the first payload arrived
+        self.sweep(timedelta())
+
+    def _choose_tier(self, size: int, is_estimated: bool) -> _Tier:
+        scratch = self._scratch
+        if (
+            scratch is not None
+            and is_estimated
+            and size <= self.config.scratch_max_file_size
+            and scratch.has_room(size)
+        ):
+            return scratch
+
+        if not self._disk.has_room(size):
+            raise StorageFullException(
+                f"Can't reserve {size} bytes, {self._disk.reserved} bytes are in use"
+            )
+
+        return self._disk
+
+    @contextmanager
+    def work_dir(self, estimated_size: int | None, max_size: int) -> Iterator[Path]:
+        # The original download and its converted copy may exist at the same time
+        size = 2 * (estimated_size or max_size)
+        tier = self._choose_tier(size, is_estimated=estimated_size is not None)
+
+        path = tier.path / f"{_WORK_DIR_PREFIX}{uuid.uuid4()}"
+        path.mkdir()
+        tier.reserved += size
+        self._active.add(path)
+        _LOG.debug("Reserved %d bytes in %s storage at %s", size, tier.name, path)
+
+        try:
+            yield path
+        finally:
+            self._active.discard(path)
+            tier.reserved -= size
+            shutil.rmtree(path, ignore_errors=True)
+
+    def sweep(self, min_age: timedelta) -> int:
+        removed = 0
+        now = time.time()
+        for tier in self._tiers():
+            for path in tier.path.iterdir():
+                if not path.is_dir() or path in self._active:
+                    continue
+
+                if not path.name.startswith(
+                    (_WORK_DIR_PREFIX, _LEGACY_WORK_DIR_PREFIX)
+                ):
+                    continue
+
+                if now - path.stat().st_mtime < min_age.total_seconds():
+                    continue
+
+                _LOG.warning("Removing orphaned work dir %s", path)
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+
+        return removed
+
+    async def sweep_periodically(self) -> None:
+        interval = self.config.sweep_interval.total_seconds()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await asyncio.to_thread(
+                    self.sweep, self.config.orphan_max_age
+                )
+            except OSError as e:
+                _LOG.error("Could not sweep storage", exc_info=e)
+            else:
+                if removed:
+                    _LOG.info("Removed %d orphaned work dirs", removed)
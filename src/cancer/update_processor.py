@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import sys
+from collections.abc import Awaitable
+from typing import Any
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from cancer.scheduling import FairScheduler
+
+_LOG = logging.getLogger(__name__)
+
+
+def _get_chat_id(update: object) -> int | None:
+    if isinstance(update, Update) and (chat := update.effective_chat) is not None:
+        return chat.id
+
+    return None
+
+
+# Handles updates of different chats concurrently, but the updates of a single
+# chat one after another and in the order they arrived.
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, *, max_running: int, max_queued: int) -> None:
+        # The application starts a task per update right away, so the base class
+        # semaphore would only let them pile up. Instead, updates beyond the
+        # queue are dropped and the scheduler decides which of the rest may run.
+        super().__init__(sys.maxsize)
+        self._max_pending = max_running + max_queued
+        self._pending = 0
+        self._scheduler: FairScheduler[int | None] = FairScheduler(
+            max_running=max_running,
+            max_running_per_key=1,
+        )
+
+    @property
+    def waiting(self) -> int:
+        return self._scheduler.waiting
+
+    async def do_process_update(
+        self,
+        update: object,
+        coroutine: Awaitable[Any],
+    ) -> None:
+        if self._pending >= self._max_pending:
+            _LOG.warning("Dropping update, %d updates are pending", self._pending)
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            return
+
+        self._pending += 1
+        try:
+            async with self._scheduler.slot(_get_chat_id(update)):
+                await coroutine
+        finally:
+            self._pending -= 1
+            if asyncio.iscoroutine(coroutine):
+                # Never started if we were cancelled while waiting for the slot
+                coroutine.close()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
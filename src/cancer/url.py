@@ -0,0 +1,62 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+_DEFAULT_PORTS = {
+    "http": 80,
+    "https": 443,
+}
+
+# Share and campaign tracking that doesn't change what the URL points to
+_TRACKING_PARAMS = frozenset(
+    {
+        "fbclid",
+        "feature",
+        "gclid",
+        "igsh",
+        "igshid",
+        "is_from_webapp",
+        "mibextid",
+        "sender_device",
+        "share_id",
+        "si",
+    }
+)
+
+
+def _is_tracking_param(key: str) -> bool:
+    return key in _TRACKING_PARAMS or key.startswith("utm_")
+
+
+def normalize_host(netloc: str) -> str:
+    host = netloc.rsplit("@", maxsplit=1)[-1].lower()
+    if host.startswith("["):
+        # IPv6 literal, leave it alone apart from the port
+        return host.split("]", maxsplit=1)[0] + "]"
+
+    host = host.split(":", maxsplit=1)[0].rstrip(".")
+    return host.removeprefix("www.")
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "https"
+    host = normalize_host(parts.netloc)
+
+    port: int | None
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not _is_tracking_param(key)
+        )
+    )
+
+    return urlunsplit((scheme, host, path, query, ""))
@@ -0,0 +1,41 @@
+import asyncio
+from datetime import timedelta
+
+from cancer.adapter.file_id_cache_sqlite import SqliteFileIdCache
+
+
+def test_normalized_url_hits(tmp_path):
+    cache = SqliteFileIdCache(tmp_path / "cache.sqlite3", timedelta(days=1), 10)
+
+    async def _run() -> list[str] | None:
+        await cache.put("https://www.reddit.com/r/foo/comments/bar/", ["a", "b"])
+        return await cache.get("https://REDDIT.com:443/r/foo/comments/bar#baz")
+
+    assert asyncio.run(_run()) == ["a", "b"]
+
+
+def test_expired_entry_misses(tmp_path):
+    cache = SqliteFileIdCache(tmp_path / "cache.sqlite3", timedelta(seconds=-1), 10)
+
+    async def _run() -> list[str] | None:
+        await cache.put("https://v.redd.it/abc", ["a"])
+        return await cache.get("https://v.redd.it/abc")
+
+    assert asyncio.run(_run()) is None
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = SqliteFileIdCache(tmp_path / "cache.sqlite3", timedelta(days=1), 2)
+
+    async def _run() -> list[list[str] | None]:
+        await cache.put("https://v.redd.it/first", ["1"])
+        await cache.put("https://v.redd.it/second", ["2"])
+        await cache.get("https://v.redd.it/first")
+        await cache.put("https://v.redd.it/third", ["3"])
+        return [
+            await cache.get("https://v.redd.it/first"),
+            await cache.get("https://v.redd.it/second"),
+            await cache.get("https://v.redd.it/third"),
+        ]
+
+    assert asyncio.run(_run()) == [["1"], None, ["3"]]
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from cancer.adapter.publisher_memory import (
+    MemoryBroker,
+    MemoryPublisher,
+    MemorySubscriber,
+)
+from cancer.message import DownloadMessage, Topic
+from cancer.port.publisher import PublishingException
+from cancer.port.subscriber import Subscriber
+
+
+def _run_until_handled(
+    messages: list[DownloadMessage],
+    handle,
+    expected_calls: int,
+) -> None:
+    broker = MemoryBroker()
+    publisher = MemoryPublisher(broker)
+    subscriber = MemorySubscriber(broker, max_in_flight=2)
+    calls = 0
+
+    async def _handle(message: DownloadMessage, attempt: int):
+        nonlocal calls
+        calls += 1
+        try:
+            return await handle(message, attempt)
+        finally:
+            if calls == expected_calls:
+                await subscriber.close()
+
+    async def _run() -> None:
+        for message in messages:
+            await publisher.publish(Topic.download, message)
+        await asyncio.wait_for(
+            subscriber.subscribe(Topic.download, DownloadMessage, _handle),
+            timeout=1,
+        )
+
+    asyncio.run(_run())
+
+
+def test_requeued_message_is_redelivered_with_delivery_count():
+    attempts: list[int] = []
+
+    async def _handle(message: DownloadMessage, attempt: int):
+        attempts.append(attempt)
+        if attempt < 3:
+            return Subscriber.RequeueAfter(timedelta(milliseconds=10))
+        return Subscriber.Result.Ack
+
+    _run_until_handled([DownloadMessage(1, 2, [])], _handle, expected_calls=3)
+
+    assert attempts == [1, 2, 3]
+
+
+def test_failing_handler_is_retried_and_dropped_message_is_not():
+    handled: list[tuple[int, int]] = []
+
+    async def _handle(message: DownloadMessage, attempt: int):
+        handled.append((message.message_id, attempt))
+        if message.message_id == 1 and attempt == 1:
+            raise ValueError("Handler failed")
+        return Subscriber.Result.Drop
+
+    _run_until_handled(
+        [DownloadMessage(1, 1, []), DownloadMessage(1, 2, [])],
+        _handle,
+        expected_calls=3,
+    )
+
+    assert sorted(handled) == [(1, 1), (1, 2), (2, 1)]
+
+
+def test_closing_subscriber_keeps_delayed_messages_of_others():
+    broker = MemoryBroker()
+    publisher = MemoryPublisher(broker)
+    subscribers = [MemorySubscriber(broker), MemorySubscriber(broker)]
+    attempts: list[tuple[Topic, int]] = []
+
+    def _create_handler(topic: Topic, subscriber: MemorySubscriber):
+        async def _handle(message: DownloadMessage, attempt: int):
+            attempts.append((topic, attempt))
+            if attempt == 1:
+                return Subscriber.RequeueAfter(timedelta(milliseconds=50))
+            await subscriber.close()
+            return Subscriber.Result.Ack
+
+        return _handle
+
+    async def _run() -> None:
+        await publisher.publish(Topic.download, DownloadMessage(1, 2, []))
+        await publisher.publish(Topic.instaDownload, DownloadMessage(1, 3, []))
+        download = asyncio.create_task(
+            subscribers[0].subscribe(
+                Topic.download,
+                DownloadMessage,
+                _create_handler(Topic.download, subscribers[0]),
+            )
+        )
+        insta = asyncio.create_task(
+            subscribers[1].subscribe(
+                Topic.instaDownload,
+                DownloadMessage,
+                _create_handler(Topic.instaDownload, subscribers[1]),
+            )
+        )
+        await asyncio.sleep(0.01)
+        # Discards its own delayed redelivery, but not the one of the other topic
+        await subscribers[0].close()
+        await asyncio.wait_for(asyncio.gather(download, insta), timeout=1)
+
+    asyncio.run(_run())
+
+    assert sorted(attempts) == [
+        (Topic.download, 1),
+        (Topic.instaDownload, 1),
+        (Topic.instaDownload, 2),
+    ]
+
+
+def test_topics_without_local_subscriber_are_dropped():
+    broker = MemoryBroker()
+    publisher = MemoryPublisher(broker, topics={Topic.voiceDownload})
+
+    asyncio.run(publisher.publish(Topic.download, DownloadMessage(1, 2, [])))
+
+    assert broker.get_queue(Topic.download).empty()
+
+
+def test_publishing_to_a_full_queue_fails():
+    broker = MemoryBroker(max_pending=1)
+    publisher = MemoryPublisher(broker)
+
+    async def _publish_twice() -> None:
+        await publisher.publish(Topic.download, DownloadMessage(1, 2, []))
+        await publisher.publish(Topic.download, DownloadMessage(1, 3, []))
+
+    with pytest.raises(PublishingException):
+        asyncio.run(_publish_twice())
+
+    assert broker.get_queue(Topic.download).qsize() == 1
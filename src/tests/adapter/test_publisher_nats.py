@@ -0,0 +1,79 @@
+import asyncio
+from datetime import timedelta
+from typing import Any
+
+from nats.js.api import Header, PubAck
+
+from cancer.adapter import publisher_nats
+from cancer.adapter.publisher_nats import NatsPublisher
+from cancer.config import EventNatsConfig
+from cancer.message import Codec, DownloadMessage, Topic
+
+
+def _create_config() -> EventNatsConfig:
+    return EventNatsConfig(
+        codec=Codec.json,
+        endpoint="nats://localhost:4222",
+        credentials=None,
+        stream_name="cancer",
+        fetch_batch_size=4,
+        heartbeat_interval=None,
+        max_in_flight=4,
+        max_pending_acks=256,
+        priority_weight=0,
+        publish_timeout=timedelta(seconds=5),
+        shutdown_grace_period=timedelta(seconds=5),
+    )
+
+
+class _FakeJetStream:
+    def __init__(self) -> None:
+        self.message_ids: set[str] = set()
+
+    async def publish_async(
+        self, headers: dict[str, str], **kwargs: Any
+    ) -> asyncio.Future[PubAck]:
+        message_id = headers[Header.MSG_ID]
+        future: asyncio.Future[PubAck] = asyncio.Future()
+        future.set_result(
+            PubAck(
+                stream="cancer",
+                seq=len(self.message_ids),
+                duplicate=message_id in self.message_ids,
+            )
+        )
+        self.message_ids.add(message_id)
+        return future
+
+
+def test_message_id_ignores_url_noise():
+    first = DownloadMessage(1, 2, ["https://www.v.redd.it/abc/", "https://x.com/b"])
+    second = DownloadMessage(1, 2, ["https://x.com/b", "https://v.redd.it/abc"])
+
+    assert publisher_nats._create_message_id(
+        Topic.download, first
+    ) == publisher_nats._create_message_id(Topic.download, second)
+
+
+def test_message_id_depends_on_topic_and_message():
+    message = DownloadMessage(1, 2, ["https://v.redd.it/abc"])
+    message_id = publisher_nats._create_message_id(Topic.download, message)
+
+    assert message_id != publisher_nats._create_message_id(Topic.instaDownload, message)
+    assert message_id != publisher_nats._create_message_id(
+        Topic.download, DownloadMessage(1, 3, message.urls)
+    )
+
+
+def test_duplicate_publishes_are_counted():
+    publisher = NatsPublisher(_create_config())
+    publisher._jetstream = _FakeJetStream()  # type: ignore[assignment]
+    message = DownloadMessage(1, 2, ["https://v.redd.it/abc"])
+
+    async def _publish_twice() -> None:
+        await publisher.publish(Topic.download, message)
+        await publisher.publish(Topic.download, message)
+
+    asyncio.run(_publish_twice())
+
+    assert publisher.deduplicated_count == 1
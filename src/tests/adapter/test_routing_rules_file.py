@@ -0,0 +1,32 @@
+import asyncio
+from datetime import timedelta
+
+from cancer.adapter.routing_rules_file import FileRoutingRuleSource
+
+
+def test_changes_of_the_file_are_yielded(tmp_path):
+    path = tmp_path / "rules.json"
+    source = FileRoutingRuleSource(path, poll_interval=timedelta(0))
+
+    async def _run() -> list[bytes | None]:
+        documents = source.watch()
+        try:
+            result = [await anext(documents)]
+            path.write_bytes(b"[]")
+            result.append(await anext(documents))
+            path.write_bytes(b'[{"host": "v.redd.it", "treatment": "cancer"}]')
+            result.append(await anext(documents))
+            path.unlink()
+            result.append(await anext(documents))
+            return result
+        finally:
+            await documents.aclose()
+
+    documents = asyncio.run(_run())
+
+    assert documents == [
+        None,
+        b"[]",
+        b'[{"host": "v.redd.it", "treatment": "cancer"}]',
+        None,
+    ]
@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from nats.errors import TimeoutError
+from nats.js.kv import KV_DEL, KeyValue
+
+from cancer.adapter.routing_rules_nats import NatsRoutingRuleSource
+
+
+def _create_entry(value: bytes | None, operation: str | None = None) -> KeyValue.Entry:
+    return KeyValue.Entry(
+        bucket="cancer",
+        key="routing-rules",
+        value=value,
+        revision=None,
+        delta=None,
+        created=None,
+        operation=operation,
+    )
+
+
+class _FakeWatcher:
+    def __init__(self, updates: list[KeyValue.Entry | Exception | None]) -> None:
+        self._updates = updates
+        self.is_stopped = False
+
+    async def updates(self, timeout: float) -> KeyValue.Entry | None:
+        update = self._updates.pop(0)
+        if isinstance(update, Exception):
+            raise update
+        return update
+
+    async def stop(self) -> None:
+        self.is_stopped = True
+
+
+class _FakeConnection:
+    def __init__(self, watcher: _FakeWatcher) -> None:
+        self.watcher = watcher
+        self.is_closed = False
+
+    async def get_client(self) -> SimpleNamespace:
+        async def _key_value(bucket: str) -> SimpleNamespace:
+            return SimpleNamespace(watch=_watch)
+
+        async def _watch(key: str) -> _FakeWatcher:
+            return self.watcher
+
+        return SimpleNamespace(jetstream=lambda: SimpleNamespace(key_value=_key_value))
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+def _create_source(
+    updates: list[KeyValue.Entry | Exception | None],
+) -> NatsRoutingRuleSource:
+    connection = _FakeConnection(_FakeWatcher(updates))
+    return NatsRoutingRuleSource(
+        connection,  # type: ignore[arg-type]
+        bucket="cancer",
+        key="routing-rules",
+    )
+
+
+def _take(source: NatsRoutingRuleSource, count: int) -> list[bytes | None]:
+    async def _run() -> list[bytes | None]:
+        documents = source.watch()
+        try:
+            return [await anext(documents) for _ in range(count)]
+        finally:
+            await documents.aclose()
+
+    return asyncio.run(_run())
+
+
+def test_values_and_deletions_are_yielded():
+    source = _create_source(
+        [
+            TimeoutError(),
+            _create_entry(b"[]"),
+            None,
+            _create_entry(None, operation=KV_DEL),
+        ]
+    )
+
+    assert _take(source, 2) == [b"[]", None]
+
+
+def test_missing_key_yields_none_once():
+    source = _create_source([None, _create_entry(b"[]")])
+
+    assert _take(source, 2) == [None, b"[]"]
+
+
+def test_watcher_is_stopped_if_the_watch_fails():
+    watcher = _FakeWatcher([ConnectionError("NATS is gone")])
+    connection = _FakeConnection(watcher)
+    source = NatsRoutingRuleSource(
+        connection,  # type: ignore[arg-type]
+        bucket="cancer",
+        key="routing-rules",
+    )
+
+    with pytest.raises(ConnectionError):
+        _take(source, 1)
+
+    assert watcher.is_stopped
+    asyncio.run(source.close())
+    # Owned by the publisher
+    assert not connection.is_closed
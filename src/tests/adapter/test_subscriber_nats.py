@@ -0,0 +1,289 @@
+import asyncio
+import os
+import signal
+from datetime import timedelta
+from types import SimpleNamespace
+
+from nats.errors import TimeoutError
+
+from cancer.adapter.publisher_nats import NatsSubscriber
+from cancer.command import util
+from cancer.config import EventNatsConfig
+from cancer.message import CODEC_HEADER, Codec, DownloadMessage, Topic
+from cancer.port.subscriber import Subscriber
+
+
+def _create_config(
+    max_in_flight: int = 4,
+    priority_weight: int = 0,
+) -> EventNatsConfig:
+    return EventNatsConfig(
+        codec=Codec.json,
+        endpoint="nats://localhost:4222",
+        credentials=None,
+        stream_name="cancer",
+        fetch_batch_size=4,
+        heartbeat_interval=None,
+        max_in_flight=max_in_flight,
+        max_pending_acks=256,
+        priority_weight=priority_weight,
+        publish_timeout=timedelta(seconds=5),
+        shutdown_grace_period=timedelta(milliseconds=50),
+    )
+
+
+class _FakeMsg:
+    def __init__(self, message: DownloadMessage) -> None:
+        self.data = message.serialize()
+        self.headers = None
+        self.metadata = SimpleNamespace(num_delivered=1)
+        self.settled: str | None = None
+        self.nak_delay: float | None = None
+        self.heartbeats = 0
+
+    @property
+    def is_acked(self) -> bool:
+        return self.settled is not None
+
+    async def in_progress(self) -> None:
+        self.heartbeats += 1
+
+    async def ack(self) -> None:
+        self.settled = "ack"
+
+    async def nak(self, delay: float | None = None) -> None:
+        self.settled = "nak"
+        self.nak_delay = delay
+
+    async def term(self) -> None:
+        self.settled = "term"
+
+
+class _FakeLane:
+    def __init__(self, msgs: list[_FakeMsg]) -> None:
+        self.pending = list(msgs)
+
+    async def fetch(self, batch: int = 1, timeout: float = 5) -> list[_FakeMsg]:
+        if not self.pending:
+            raise TimeoutError
+
+        msgs = self.pending[:batch]
+        del self.pending[:batch]
+        return msgs
+
+
+class _FakeClient:
+    def __init__(
+        self,
+        msgs: list[_FakeMsg],
+        ack_wait: float,
+        close_when_empty: bool = True,
+        priority_msgs: list[_FakeMsg] | None = None,
+    ) -> None:
+        self.priority_lane = _FakeLane(priority_msgs or [])
+        self.ack_wait = ack_wait
+        self.close_when_empty = close_when_empty
+        self.pending = list(msgs)
+        self.batches: list[int] = []
+        self.is_draining = False
+        self.is_closed = False
+
+    def jetstream(self) -> _FakeClient:
+        return self
+
+    async def pull_subscribe_bind(
+        self, consumer: str, **kwargs
+    ) -> _FakeClient | _FakeLane:
+        if consumer.endswith("-priority"):
+            return self.priority_lane
+        return self
+
+    async def drain(self) -> None:
+        # Flushing takes a round trip to the server
+        await asyncio.sleep(0.01)
+        self.is_closed = True
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+    async def consumer_info(self) -> SimpleNamespace:
+        return SimpleNamespace(config=SimpleNamespace(ack_wait=self.ack_wait))
+
+    async def fetch(self, batch: int = 1, timeout: float = 5) -> list[_FakeMsg]:
+        self.batches.append(batch)
+        if not self.pending:
+            if self.close_when_empty:
+                self.is_closed = True
+            await asyncio.sleep(0.01)
+            raise TimeoutError
+
+        msgs = self.pending[:batch]
+        del self.pending[:batch]
+        return msgs
+
+
+def _subscribe(
+    config: EventNatsConfig,
+    msgs: list[_FakeMsg],
+    handle,
+    ack_wait: float = 30,
+    priority_msgs: list[_FakeMsg] | None = None,
+) -> tuple[NatsSubscriber, _FakeClient]:
+    client = _FakeClient(msgs, ack_wait, priority_msgs=priority_msgs)
+    subscriber = NatsSubscriber(config)
+    subscriber._connection._client = client  # type: ignore[assignment]
+    asyncio.run(subscriber.subscribe(Topic.download, DownloadMessage, handle))
+    return subscriber, client
+
+
+def test_handlers_run_concurrently_up_to_limit():
+    msgs = [_FakeMsg(DownloadMessage(1, index, [])) for index in range(10)]
+    running = 0
+    max_running = 0
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return Subscriber.Result.Ack
+
+    _, client = _subscribe(_create_config(max_in_flight=3), msgs, _handle)
+
+    assert max_running == 3
+    assert all(batch <= 3 for batch in client.batches)
+    assert [msg.settled for msg in msgs] == ["ack"] * len(msgs)
+
+
+def test_each_message_is_settled_individually():
+    msgs = [_FakeMsg(DownloadMessage(1, index, [])) for index in range(3)]
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        match message.message_id:
+            case 0:
+                return Subscriber.Result.Drop
+            case 1:
+                raise ValueError("Handler failed")
+            case _:
+                return Subscriber.Result.Ack
+
+    _subscribe(_create_config(), msgs, _handle)
+
+    assert [msg.settled for msg in msgs] == ["term", "nak", "ack"]
+
+
+def test_message_with_unknown_codec_is_requeued():
+    msgs = [_FakeMsg(DownloadMessage(1, index, [])) for index in range(2)]
+    msgs[0].headers = {CODEC_HEADER: "compact/99"}
+    handled: list[int] = []
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        handled.append(message.message_id)
+        return Subscriber.Result.Ack
+
+    _subscribe(_create_config(), msgs, _handle)
+
+    assert handled == [1]
+    assert [msg.settled for msg in msgs] == ["nak", "ack"]
+    assert msgs[0].nak_delay
+
+
+def test_long_running_handler_sends_heartbeats():
+    msg = _FakeMsg(DownloadMessage(1, 2, []))
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        await asyncio.sleep(0.1)
+        return Subscriber.Result.Ack
+
+    subscriber, _ = _subscribe(_create_config(), [msg], _handle, ack_wait=0.03)
+
+    assert msg.heartbeats >= 2
+    assert msg.settled == "ack"
+    assert subscriber.heartbeat_stats.heartbeats_sent == msg.heartbeats
+    assert subscriber.heartbeat_stats.redeliveries_avoided == 1
+
+
+def test_close_waits_for_handlers_and_requeues_the_rest():
+    fast = _FakeMsg(DownloadMessage(1, 1, []))
+    slow = _FakeMsg(DownloadMessage(1, 2, []))
+    client = _FakeClient([fast, slow], ack_wait=30, close_when_empty=False)
+    subscriber = NatsSubscriber(_create_config())
+    subscriber._connection._client = client  # type: ignore[assignment]
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        await asyncio.sleep(0.02 if message.message_id == 1 else 10)
+        return Subscriber.Result.Ack
+
+    async def _run() -> None:
+        subscription = asyncio.create_task(
+            subscriber.subscribe(Topic.download, DownloadMessage, _handle)
+        )
+        await asyncio.sleep(0.01)
+        report = await subscriber.drain()
+        await subscription
+
+        assert report.finished == 1
+        assert report.requeued == 1
+
+    asyncio.run(_run())
+
+    assert fast.settled == "ack"
+    assert slow.settled == "nak"
+
+
+def test_signal_closes_subscriber_before_subscribe_returns():
+    fast = _FakeMsg(DownloadMessage(1, 1, []))
+    slow = _FakeMsg(DownloadMessage(1, 2, []))
+    client = _FakeClient([fast, slow], ack_wait=30, close_when_empty=False)
+    subscriber = NatsSubscriber(_create_config())
+    subscriber._connection._client = client  # type: ignore[assignment]
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        if message.message_id == 1:
+            os.kill(os.getpid(), signal.SIGTERM)
+        else:
+            await asyncio.sleep(10)
+        return Subscriber.Result.Ack
+
+    async def _run() -> None:
+        util._close_subscriber_on_signal(subscriber)
+        await asyncio.wait_for(
+            subscriber.subscribe(Topic.download, DownloadMessage, _handle),
+            timeout=1,
+        )
+
+        # Checked before the loop shuts down and cancels leftover tasks
+        assert fast.settled == "ack"
+        assert slow.settled == "nak"
+        assert client.is_closed
+
+    asyncio.run(_run())
+
+
+def test_priority_lane_is_fetched_first_with_weight():
+    normal = [_FakeMsg(DownloadMessage(-1, index, [])) for index in range(4)]
+    priority = [_FakeMsg(DownloadMessage(1, index, [])) for index in range(4)]
+    handled: list[tuple[int, int]] = []
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        handled.append((message.chat_id, message.message_id))
+        return Subscriber.Result.Ack
+
+    _subscribe(
+        _create_config(max_in_flight=1, priority_weight=2),
+        normal,
+        _handle,
+        priority_msgs=priority,
+    )
+
+    assert handled == [
+        (1, 0),
+        (1, 1),
+        (-1, 0),
+        (1, 2),
+        (1, 3),
+        (-1, 1),
+        (-1, 2),
+        (-1, 3),
+    ]
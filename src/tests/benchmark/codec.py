@@ -0,0 +1,70 @@
+"""Compares the message codecs with the original asdict/json.dumps serialization.
+
+Usage: uv run python src/tests/benchmark/codec.py [ROUNDS]
+"""
+
+import dataclasses
+import json
+import sys
+import timeit
+
+from cancer.message import (
+    Codec,
+    DownloadMessage,
+    Message,
+    UrlConvertMessage,
+    VoiceMessage,
+)
+
+_MESSAGES: list[Message] = [
+    DownloadMessage(
+        -1001234567890,
+        123456,
+        ["https://v.redd.it/abcdef", "https://www.instagram.com/reel/abcdef/"],
+    ),
+    VoiceMessage(
+        chat_id=123456789,
+        message_id=123456,
+        file_id="AwACAgIAAxkBAAIBNmVx-abcdefghijklmnopqrstuvwxyz",
+        file_size=123456,
+    ),
+    UrlConvertMessage(-1001234567890, 123456, ["https://youtube.com/shorts/abc"]),
+]
+
+
+def _legacy_serialize(message: Message) -> bytes:
+    return json.dumps(dataclasses.asdict(message)).encode("utf-8")
+
+
+def _legacy_deserialize(message_type: type[Message], serialized: bytes) -> Message:
+    return message_type(**json.loads(serialized.decode("utf-8")))
+
+
+def _measure(rounds: int, func) -> float:
+    return rounds / timeit.timeit(func, number=rounds)
+
+
+def main(rounds: int) -> None:
+    for message in _MESSAGES:
+        message_type = type(message)
+        legacy = _legacy_serialize(message)
+        print(f"{message_type.__name__}:")
+        print(
+            f"{'legacy':>12}: {len(legacy):4d} bytes,"
+            f" encode {_measure(rounds, lambda: _legacy_serialize(message)):10.0f}/s,"
+            f" decode {_measure(rounds, lambda: _legacy_deserialize(message_type, legacy)):10.0f}/s"
+        )
+
+        for codec in Codec:
+            encoded = message.serialize(codec)
+            encode = _measure(rounds, lambda: message.serialize(codec))
+            decode = _measure(rounds, lambda: message_type.deserialize(encoded, codec))
+            print(
+                f"{codec.value:>12}: {len(encoded):4d} bytes,"
+                f" encode {encode:10.0f}/s,"
+                f" decode {decode:10.0f}/s"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
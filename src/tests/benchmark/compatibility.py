@@ -0,0 +1,84 @@
+"""Compares the bare ffmpeg re-encode with the remux-first compatibility path.
+
+Usage: uv run python src/tests/benchmark/compatibility.py [ROUNDS]
+Requires ffmpeg and ffprobe with libx264 and libvpx-vp9 support.
+"""
+
+import asyncio
+import subprocess
+import sys
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from cancer.command import download
+
+_SAMPLES = {
+    "h264-aac.mkv": ["-c:v", "libx264", "-c:a", "aac"],
+    "h264-opus.mkv": ["-c:v", "libx264", "-c:a", "libopus"],
+    "vp9-opus.webm": ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-c:a", "libopus"],
+}
+
+
+def _create_sample(path: Path, codec_args: list[str]) -> None:
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=duration=20:size=1280x720:rate=30",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440:duration=20",
+            *codec_args,
+            path,
+        ],
+        check=True,
+    )
+
+
+def _legacy_convert(input_path: Path, output_path: Path) -> None:
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", input_path, output_path],
+        check=True,
+    )
+
+
+async def _remux_first(input_path: Path, output_path: Path) -> None:
+    codecs = await download._probe_codecs(input_path)
+    await download._make_compatible(input_path, output_path, codecs)
+
+
+def _measure(rounds: int, func) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds
+
+
+def main(rounds: int) -> None:
+    with TemporaryDirectory() as directory:
+        folder = Path(directory)
+        for name, codec_args in _SAMPLES.items():
+            sample = folder / name
+            _create_sample(sample, codec_args)
+            output = folder / "output.mp4"
+
+            legacy = _measure(rounds, lambda: _legacy_convert(sample, output))
+            remux_first = _measure(
+                rounds,
+                lambda: asyncio.run(_remux_first(sample, output)),
+            )
+            print(
+                f"{name:>20}: legacy {legacy:6.2f} s/file,"
+                f" remux-first {remux_first:6.2f} s/file"
+                f" ({legacy / remux_first:5.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
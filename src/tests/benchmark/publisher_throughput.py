@@ -0,0 +1,97 @@
+"""Compares sequential JetStream publishing with the pipelined NatsPublisher.
+
+Usage: uv run python src/tests/benchmark/publisher_throughput.py [UPDATES]
+Requires a local nats-server with JetStream enabled (nats-server -js).
+"""
+
+import asyncio
+import sys
+import time
+from datetime import timedelta
+
+from nats.aio.client import Client
+from nats.js.api import StreamConfig
+
+from cancer.adapter.publisher_nats import NatsPublisher
+from cancer.config import EventNatsConfig
+from cancer.message import Codec, DownloadMessage, Message, Topic
+
+_ENDPOINT = "nats://localhost:4222"
+_STREAM = "cancer-benchmark"
+# A typical update with links for two different downloaders
+_TOPICS = [Topic.download, Topic.instaDownload]
+
+
+def _create_config() -> EventNatsConfig:
+    return EventNatsConfig(
+        codec=Codec.json,
+        endpoint=_ENDPOINT,
+        credentials=None,
+        stream_name=_STREAM,
+        fetch_batch_size=1,
+        heartbeat_interval=None,
+        max_in_flight=1,
+        max_pending_acks=256,
+        priority_weight=0,
+        publish_timeout=timedelta(seconds=5),
+        shutdown_grace_period=timedelta(seconds=5),
+    )
+
+
+async def _reset_stream() -> None:
+    client = Client()
+    await client.connect(_ENDPOINT)
+    jetstream = client.jetstream()
+    try:
+        await jetstream.delete_stream(_STREAM)
+    except Exception:
+        pass
+    await jetstream.add_stream(StreamConfig(name=_STREAM, subjects=[f"{_STREAM}.>"]))
+    await client.close()
+
+
+async def _publish_sequentially(updates: list[Message]) -> None:
+    config = _create_config()
+    client = Client()
+    await client.connect(_ENDPOINT)
+    for message in updates:
+        for topic in _TOPICS:
+            jetstream = client.jetstream()
+            await jetstream.publish(
+                subject=config.get_publish_subject(topic),
+                payload=message.serialize(),
+                stream=_STREAM,
+            )
+    await client.close()
+
+
+async def _publish_pipelined(updates: list[Message]) -> None:
+    publisher = NatsPublisher(_create_config())
+
+    async def _publish_update(message: Message) -> None:
+        await asyncio.gather(*(publisher.publish(topic, message) for topic in _TOPICS))
+
+    await asyncio.gather(*(_publish_update(message) for message in updates))
+    await publisher.close()
+
+
+async def main(update_count: int) -> None:
+    updates: list[Message] = [
+        DownloadMessage(1, message_id, ["https://v.redd.it/abc"])
+        for message_id in range(update_count)
+    ]
+    messages = update_count * len(_TOPICS)
+
+    for name, publish in [
+        ("sequential", _publish_sequentially),
+        ("pipelined", _publish_pipelined),
+    ]:
+        await _reset_stream()
+        start = time.perf_counter()
+        await publish(updates)
+        duration = time.perf_counter() - start
+        print(f"{name:>10}: {messages / duration:8.1f} msg/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
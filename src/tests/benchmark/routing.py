@@ -0,0 +1,66 @@
+"""Compares the indexed URL router with the original linear scan over all rules.
+
+Usage: uv run python src/tests/benchmark/routing.py [ROUNDS]
+"""
+
+import sys
+import timeit
+from urllib.parse import urlparse
+
+from cancer.command.handle_updates import _CANCERS
+from cancer.routing import Cancer, UrlRouter
+
+# Roughly what shows up in the chats: mostly supported links, plus a long tail
+# of news, shops and everything else that has to be rejected.
+_CORPUS = [
+    "https://v.redd.it/8x2k1abcdefg",
+    "https://www.reddit.com/r/de/comments/1abcdef/irgendwas/",
+    "https://www.instagram.com/reel/C1aBcDeFgHi/?igsh=MWQ1ZGUxMzBkMA==",
+    "https://vm.tiktok.com/ZGe7abcde/",
+    "https://www.tiktok.com/@someone/video/7301234567890123456",
+    "https://youtube.com/shorts/abcdefghijk?si=abcdef",
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://youtu.be/dQw4w9WgXcQ",
+    "https://www.linkedin.com/posts/someone_activity-7123456789012345678-abcd",
+    "https://vimeo.com/123456789",
+    "https://share.google/abcdefghijk",
+    "https://www.spiegel.de/politik/deutschland/irgendwas-a-1234.html",
+    "https://www.tagesschau.de/inland/irgendwas-100.html",
+    "https://github.com/preparingforexams/telegram-vreddit-bot/pull/123",
+    "https://www.amazon.de/dp/B0ABCDEFGH",
+    "https://twitter.com/someone/status/1234567890123456789",
+    "https://en.wikipedia.org/wiki/Python_(programming_language)",
+    "https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC",
+]
+
+
+def _linear_route(url: str, *, is_private: bool) -> Cancer | None:
+    symptoms = urlparse(url)
+    for cancer in _CANCERS:
+        if symptoms.netloc.startswith(cancer.host) and (
+            not cancer.path or symptoms.path.startswith(cancer.path)
+        ):
+            if cancer.get_treatment(is_private=is_private) is not None:
+                return cancer
+
+    return None
+
+
+def _measure(rounds: int, route) -> float:
+    def _run() -> None:
+        for url in _CORPUS:
+            route(url, is_private=True)
+            route(url, is_private=False)
+
+    urls = rounds * len(_CORPUS) * 2
+    return urls / timeit.timeit(_run, number=rounds)
+
+
+def main(rounds: int) -> None:
+    router = UrlRouter(_CANCERS)
+    print(f"{'linear':>8}: {_measure(rounds, _linear_route):10.0f} urls/s")
+    print(f"{'indexed':>8}: {_measure(rounds, router.route):10.0f} urls/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,102 @@
+"""Measures NatsSubscriber throughput for different in-flight limits.
+
+Usage: uv run python src/tests/benchmark/subscriber_throughput.py [MESSAGES]
+Requires a local nats-server with JetStream enabled (nats-server -js).
+"""
+
+import asyncio
+import sys
+import time
+from datetime import timedelta
+
+from nats.aio.client import Client
+from nats.js.api import AckPolicy, ConsumerConfig, StreamConfig
+
+from cancer.adapter.publisher_nats import NatsSubscriber
+from cancer.config import EventNatsConfig
+from cancer.message import Codec, DownloadMessage, Topic
+from cancer.port.subscriber import Subscriber
+
+_ENDPOINT = "nats://localhost:4222"
+_STREAM = "cancer-benchmark"
+_HANDLER_LATENCY = 0.05
+_IN_FLIGHT_LIMITS = [1, 4, 16, 64]
+
+
+async def _prepare(client: Client, topic: Topic, messages: int) -> None:
+    jetstream = client.jetstream()
+    try:
+        await jetstream.delete_stream(_STREAM)
+    except Exception:
+        pass
+
+    await jetstream.add_stream(
+        StreamConfig(name=_STREAM, subjects=[f"{_STREAM}.>"]),
+    )
+    await jetstream.add_consumer(
+        _STREAM,
+        ConsumerConfig(durable_name=topic.value, ack_policy=AckPolicy.EXPLICIT),
+    )
+
+    payload = DownloadMessage(1, 2, ["https://v.redd.it/abc"]).serialize()
+    for _ in range(messages):
+        await jetstream.publish(f"{_STREAM}.{topic.value}", payload)
+
+
+async def _measure(messages: int, max_in_flight: int) -> float:
+    topic = Topic.download
+    client = Client()
+    await client.connect(_ENDPOINT)
+    try:
+        await _prepare(client, topic, messages)
+    finally:
+        await client.close()
+
+    subscriber = NatsSubscriber(
+        EventNatsConfig(
+            codec=Codec.json,
+            endpoint=_ENDPOINT,
+            credentials=None,
+            stream_name=_STREAM,
+            fetch_batch_size=max_in_flight,
+            heartbeat_interval=None,
+            max_in_flight=max_in_flight,
+            max_pending_acks=256,
+            priority_weight=0,
+            publish_timeout=timedelta(seconds=5),
+            shutdown_grace_period=timedelta(seconds=5),
+        )
+    )
+    handled = 0
+    end = 0.0
+    closing: list[asyncio.Task[None]] = []
+
+    async def _close() -> None:
+        # Give the last acks a moment to go out before draining
+        await asyncio.sleep(_HANDLER_LATENCY)
+        await subscriber.close()
+
+    async def _handle(message: DownloadMessage, attempt: int) -> Subscriber.Result:
+        nonlocal handled, end
+        # Simulates a handler that mostly waits for I/O
+        await asyncio.sleep(_HANDLER_LATENCY)
+        handled += 1
+        if handled == messages:
+            end = time.perf_counter()
+            closing.append(asyncio.create_task(_close()))
+        return Subscriber.Result.Ack
+
+    start = time.perf_counter()
+    await subscriber.subscribe(topic, DownloadMessage, _handle)
+    await asyncio.gather(*closing)
+    return messages / (end - start)
+
+
+async def main(messages: int) -> None:
+    for max_in_flight in _IN_FLIGHT_LIMITS:
+        throughput = await _measure(messages, max_in_flight)
+        print(f"max in-flight {max_in_flight:>3}: {throughput:8.1f} msg/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,96 @@
+"""Measures handle_update throughput for different update concurrency limits.
+
+Usage: uv run python src/tests/benchmark/update_throughput.py [UPDATES]
+"""
+
+import asyncio
+import sys
+import time
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+
+from telegram import Chat, Message, MessageEntity, Update
+from telegram.constants import ChatType, MessageEntityType
+
+from cancer.command.handle_updates import _CancerBot
+from cancer.dedup import RecentLinks
+from cancer.message import Message as CancerMessage
+from cancer.message import Topic
+from cancer.port.publisher import Publisher
+from cancer.scheduling import BackgroundQueue
+from cancer.update_processor import ChatUpdateProcessor
+
+_PUBLISH_LATENCY = 0.005
+_CHATS = 20
+_CONCURRENCY_LIMITS = [1, 4, 16, 64]
+_TEXTS = [
+    "https://v.redd.it/8x2k1abcdefg",
+    "guckt euch das an https://www.instagram.com/reel/C1aBcDeFgHi/",
+    "https://vm.tiktok.com/ZGe7abcde/ https://youtube.com/shorts/abcdefghijk",
+    "https://www.spiegel.de/politik/deutschland/irgendwas-a-1234.html",
+]
+
+
+class _FakePublisher(Publisher):
+    async def publish(
+        self,
+        topic: Topic,
+        message: CancerMessage,
+        *,
+        is_priority: bool = False,
+    ):
+        await asyncio.sleep(_PUBLISH_LATENCY)
+
+    async def close(self) -> None:
+        pass
+
+
+async def _set_message_reaction(*args, **kwargs) -> None:
+    pass
+
+
+def _create_update(update_id: int) -> Update:
+    text = _TEXTS[update_id % len(_TEXTS)]
+    url = text.split()[-1]
+    message = Message(
+        update_id,
+        datetime.now(UTC),
+        # Half of the updates come from a single busy chat
+        Chat(-1 if update_id % 2 else -2 - update_id % _CHATS, ChatType.GROUP),
+        text=text,
+        entities=[
+            MessageEntity(MessageEntityType.URL, text.index(url), len(url)),
+        ],
+    )
+    message.set_bot(SimpleNamespace(set_message_reaction=_set_message_reaction))  # type: ignore[arg-type]
+    return Update(update_id, message=message)
+
+
+async def _measure(updates: list[Update], max_running: int) -> float:
+    side_effects = BackgroundQueue(max_running=16, max_pending=len(updates))
+    # The corpus repeats its links, so duplicate suppression is disabled
+    recent_links = RecentLinks(window=timedelta(0), max_entries=1)
+    bot = _CancerBot(_FakePublisher(), side_effects, recent_links)
+    processor = ChatUpdateProcessor(max_running=max_running, max_queued=len(updates))
+
+    start = time.perf_counter()
+    async with processor, asyncio.TaskGroup() as tg:
+        for update in updates:
+            tg.create_task(
+                processor.process_update(update, bot.handle_update(update, None))
+            )
+    elapsed = time.perf_counter() - start
+
+    await side_effects.close(10)
+    return len(updates) / elapsed
+
+
+async def main(updates: int) -> None:
+    batch = [_create_update(update_id) for update_id in range(updates)]
+    for max_running in _CONCURRENCY_LIMITS:
+        throughput = await _measure(batch, max_running)
+        print(f"max concurrent updates {max_running:>3}: {throughput:8.1f} updates/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
@@ -1,12 +1,395 @@
+import asyncio
+import pickle
+from datetime import timedelta
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace, TracebackType
+from typing import Any, cast
+
+import httpx
 import pytest
+from PIL import Image
+from telegram import InputFile, InputMediaVideo
+from telegram.error import BadRequest, RetryAfter
+from yt_dlp.utils import DownloadError, ExtractorError
 
+from cancer.adapter.file_id_cache_sqlite import SqliteFileIdCache
 from cancer.command import download
+from cancer.config import (
+    CircuitBreakerConfig,
+    DownloaderConcurrency,
+    DownloaderConfig,
+    DownloaderCredentials,
+    FileIdCacheConfig,
+    StorageConfig,
+)
+from cancer.message import DownloadMessage, Topic
+from cancer.port.subscriber import Subscriber
+from cancer.storage import StorageManager
+from cancer.url import normalize_host
+
+_CREDENTIALS = DownloaderCredentials(username=None, password=None, cookie_file=None)
+
+
+class _FakeYoutubeDL:
+    extracted_urls: list[str] = []
+
+    def __init__(self, params: dict[str, Any] | None = None) -> None:
+        self.params = params or {}
+
+    def extract_info(self, url: str, download: bool = True) -> dict[str, Any]:
+        assert not download
+        self.extracted_urls.append(url)
+        if "rate-limited" in url:
+            try:
+                raise ExtractorError("rate-limit reached or login required")
+            except ExtractorError as e:
+                traceback = cast(TracebackType, e.__traceback__)
+                raise DownloadError(str(e), (type(e), e, traceback)) from e
+        return {
+            "webpage_url": url,
+            "ext": "mp4",
+            "filesize": 1000,
+            "thumbnails": [],
+        }
+
+    @staticmethod
+    def sanitize_info(info: dict[str, Any]) -> dict[str, Any]:
+        return dict(info)
+
+    def process_ie_result(
+        self,
+        ie_result: dict[str, Any],
+        download: bool = True,
+    ) -> dict[str, Any]:
+        assert download
+        output = (
+            self.params["outtmpl"]
+            .replace("%(autonumber)d", "1")
+            .replace("%(ext)s", ie_result["ext"])
+        )
+        Path(output).write_bytes(b"video")
+        return ie_result
+
+
+class _FakeBot:
+    def __init__(self) -> None:
+        self.sent_videos: list[InputFile | str] = []
+        self.media_groups: list[list[InputMediaVideo]] = []
+        self.rejected_file_ids: set[str] = set()
+        self.flood_controlled_calls = 0
+
+    async def send_media_group(
+        self, chat_id: int, media: list[InputMediaVideo], **kwargs
+    ) -> Any:
+        if self.flood_controlled_calls > 0:
+            self.flood_controlled_calls -= 1
+            raise RetryAfter(timedelta(0))
+        if any(item.media in self.rejected_file_ids for item in media):
+            raise BadRequest("Wrong file identifier/http url specified")
+        self.media_groups.append(media)
+        return [
+            SimpleNamespace(video=SimpleNamespace(file_id=f"group-file-{index}"))
+            for index in range(len(media))
+        ]
+
+    async def send_video(self, chat_id: int, video: InputFile | str, **kwargs) -> Any:
+        if video in self.rejected_file_ids:
+            raise BadRequest("Wrong file identifier/http url specified")
+        self.sent_videos.append(video)
+        file_id = f"file-{video.filename}" if isinstance(video, InputFile) else video
+        return SimpleNamespace(video=SimpleNamespace(file_id=file_id))
+
+
+@pytest.fixture
+def fake_ytdl(monkeypatch) -> type[_FakeYoutubeDL]:
+    monkeypatch.setattr(_FakeYoutubeDL, "extracted_urls", [])
+    monkeypatch.setattr(download, "YoutubeDL", _FakeYoutubeDL)
+    return _FakeYoutubeDL
+
+
+def _create_config(storage_dir: Path) -> DownloaderConfig:
+    return DownloaderConfig(
+        circuit_breaker=CircuitBreakerConfig(
+            failure_threshold=1,
+            base_delay=timedelta(minutes=1),
+            max_delay=timedelta(hours=1),
+        ),
+        concurrency=DownloaderConcurrency(
+            max_payloads=2,
+            max_payloads_per_chat=1,
+            max_pending_payloads=4,
+            max_urls_per_payload=2,
+            max_extractions=2,
+            max_downloads=2,
+            max_conversions=1,
+            max_uploads=1,
+        ),
+        credentials=_CREDENTIALS,
+        file_id_cache=FileIdCacheConfig(
+            path=storage_dir / "file-id-cache.sqlite3",
+            ttl=timedelta(days=1),
+            max_entries=100,
+        ),
+        max_file_size=40_000_000,
+        process_pool=None,
+        storage=StorageConfig(
+            quota=1_000_000_000,
+            orphan_max_age=timedelta(hours=1),
+            sweep_interval=timedelta(minutes=10),
+            scratch_dir=None,
+            scratch_max_file_size=0,
+            scratch_quota=0,
+        ),
+        storage_dir=storage_dir,
+        topic=Topic.download,
+        upload_chat_id=1,
+    )
 
 
 @pytest.mark.skip(reason="The YouTube API lies")
 def test_check_size():
     url = "https://www.youtube.com/watch?v=eomhW5MLGWA"
-    info = download._get_info(url)
+    info = download._get_info(url, _CREDENTIALS, 40_000_000)
+    assert info
     size = info.size
     assert size
     assert 4_000_000 < size < 6_000_000
+
+
+def _create_downloader(bot: _FakeBot, storage_dir: Path) -> download._Downloader:
+    config = _create_config(storage_dir)
+    return download._Downloader(
+        bot,  # type: ignore[arg-type]
+        config,
+        SqliteFileIdCache.from_config(config.file_id_cache),
+        process_pool=None,
+        storage=StorageManager(storage_dir, config.storage),
+    )
+
+
+def test_single_extraction_per_url(fake_ytdl, tmp_path):
+    bot = _FakeBot()
+    downloader = _create_downloader(bot, tmp_path)
+    urls = ["https://v.redd.it/first", "https://v.redd.it/second"]
+
+    result = asyncio.run(downloader.handle_payload(DownloadMessage(1, 2, urls), 1))
+
+    assert result == Subscriber.Result.Ack
+    assert sorted(fake_ytdl.extracted_urls) == urls
+    assert not bot.sent_videos
+    assert [len(group) for group in bot.media_groups] == [len(urls)]
+    # Streamed from disk instead of being read into memory
+    assert all(
+        isinstance(media.media, InputFile)
+        and not isinstance(media.media.input_file_content, bytes)
+        for media in bot.media_groups[0]
+    )
+
+
+def test_flood_controlled_media_group_is_retried(fake_ytdl, tmp_path):
+    bot = _FakeBot()
+    bot.flood_controlled_calls = 1
+    downloader = _create_downloader(bot, tmp_path)
+    urls = ["https://v.redd.it/first", "https://v.redd.it/second"]
+
+    result = asyncio.run(downloader.handle_payload(DownloadMessage(1, 2, urls), 1))
+
+    assert result == Subscriber.Result.Ack
+    assert [len(group) for group in bot.media_groups] == [len(urls)]
+    assert not bot.sent_videos
+
+
+def test_cached_url_skips_download(fake_ytdl, tmp_path):
+    bot = _FakeBot()
+    downloader = _create_downloader(bot, tmp_path)
+    urls = ["https://v.redd.it/first"]
+
+    async def _handle_twice() -> None:
+        await downloader.handle_payload(DownloadMessage(1, 2, urls), 1)
+        await downloader.handle_payload(DownloadMessage(3, 4, urls), 1)
+
+    asyncio.run(_handle_twice())
+
+    assert fake_ytdl.extracted_urls == urls
+    first_upload = cast(InputFile, bot.sent_videos[0])
+    assert bot.sent_videos[1] == f"file-{first_upload.filename}"
+
+
+def test_rejected_cached_file_id_is_downloaded_again(fake_ytdl, tmp_path):
+    bot = _FakeBot()
+    bot.rejected_file_ids.add("stale-file")
+    downloader = _create_downloader(bot, tmp_path)
+    urls = ["https://v.redd.it/first", "https://v.redd.it/second"]
+
+    async def _handle() -> Subscriber.Result | Subscriber.RequeueAfter:
+        await downloader.file_id_cache.put(urls[0], ["stale-file"])
+        return await downloader.handle_payload(DownloadMessage(1, 2, urls), 1)
+
+    result = asyncio.run(_handle())
+
+    assert result == Subscriber.Result.Ack
+    # The album with the stale file falls back to single uploads
+    assert not bot.media_groups
+    assert fake_ytdl.extracted_urls == [urls[1], urls[0]]
+    assert [type(video) for video in bot.sent_videos] == [InputFile, InputFile]
+
+
+def test_compatible_streams_are_copied():
+    codecs = download._StreamCodecs(video="h264", audio="aac")
+    assert download._get_codec_args(codecs) == ["-c:v", "copy", "-c:a", "copy"]
+
+
+def test_only_incompatible_stream_is_transcoded():
+    codecs = download._StreamCodecs(video="h264", audio="opus")
+    args = download._get_codec_args(codecs)
+    assert args[:2] == ["-c:v", "copy"]
+    assert "aac" in args
+
+
+@pytest.mark.parametrize(
+    "codecs,is_converted",
+    [
+        (download._StreamCodecs(video="h264", audio="aac"), False),
+        (download._StreamCodecs(video="vp9", audio="opus"), True),
+        (download._StreamCodecs(video="h264", audio="opus"), True),
+    ],
+)
+def test_incompatible_mp4_is_converted(
+    monkeypatch,
+    tmp_path,
+    codecs: download._StreamCodecs,
+    is_converted: bool,
+):
+    conversions: list[tuple[Path, Path, list[str]]] = []
+
+    async def _probe_codecs(path: Path) -> download._StreamCodecs:
+        return codecs
+
+    async def _convert_cure(
+        input_path: Path,
+        output_path: Path,
+        codec_args: list[str],
+    ) -> None:
+        conversions.append((input_path, output_path, codec_args))
+
+    monkeypatch.setattr(download, "_probe_codecs", _probe_codecs)
+    monkeypatch.setattr(download, "_convert_cure", _convert_cure)
+    downloader = _create_downloader(_FakeBot(), tmp_path)
+    video = tmp_path / "video.mp4"
+
+    cure = asyncio.run(downloader._ensure_compatibility(video))
+
+    if is_converted:
+        assert cure == tmp_path / "video-cured.mp4"
+        assert [(i, o) for i, o, _ in conversions] == [(video, cure)]
+    else:
+        assert cure == video
+        assert not conversions
+
+
+def _create_jpeg(size: tuple[int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", size, color="red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def _create_thumb_client(images: dict[str, bytes]) -> httpx.AsyncClient:
+    def _handle(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=images[request.url.path])
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(_handle))
+
+
+def _download_thumb(tmp_path: Path, images: dict[str, bytes]) -> Path | None:
+    downloader = _create_downloader(_FakeBot(), tmp_path)
+    urls = [f"https://thumbs.example{path}" for path in images]
+
+    async def _run() -> Path | None:
+        async with _create_thumb_client(images) as client:
+            return await downloader._download_thumb(client, tmp_path, urls)
+
+    return asyncio.run(_run())
+
+
+def test_thumb_prefers_fitting_candidate(tmp_path):
+    fitting = _create_jpeg((320, 180))
+    thumb = _download_thumb(
+        tmp_path,
+        {
+            "/huge.jpg": b"x" * 300_000,
+            "/large.jpg": _create_jpeg((1280, 720)),
+            "/small.jpg": fitting,
+        },
+    )
+
+    assert thumb is not None
+    assert thumb.read_bytes() == fitting
+
+
+def test_thumb_is_shrunk_if_nothing_fits(tmp_path):
+    thumb = _download_thumb(tmp_path, {"/large.jpg": _create_jpeg((1280, 720))})
+
+    assert thumb is not None
+    with Image.open(thumb) as image:
+        assert image.size == (320, 180)
+
+
+def test_size_guard_aborts_oversized_download():
+    guard = download._create_size_guard(1000)
+    entry = {"id": "first"}
+    guard({"filename": "video.mp4", "downloaded_bytes": 600, "info_dict": entry})
+    guard({"filename": "audio.m4a", "downloaded_bytes": 300, "info_dict": entry})
+
+    with pytest.raises(download.FileTooLargeException):
+        guard({"filename": "video.mp4", "downloaded_bytes": 800, "info_dict": entry})
+
+
+def test_size_guard_limits_each_playlist_entry():
+    guard = download._create_size_guard(1000)
+
+    for index in range(10):
+        guard(
+            {
+                "filename": f"output{index}.mp4",
+                "downloaded_bytes": 900,
+                "info_dict": {"id": f"entry-{index}"},
+            }
+        )
+
+
+def test_open_circuit_requeues_without_extraction(fake_ytdl, tmp_path):
+    downloader = _create_downloader(_FakeBot(), tmp_path)
+    urls = ["https://www.instagram.com/reel/rate-limited"]
+
+    async def _handle_twice() -> list[Subscriber.Result | Subscriber.RequeueAfter]:
+        return [
+            await downloader.handle_payload(DownloadMessage(1, 2, urls), 1),
+            await downloader.handle_payload(DownloadMessage(3, 4, urls), 1),
+        ]
+
+    results = asyncio.run(_handle_twice())
+
+    assert all(isinstance(result, Subscriber.RequeueAfter) for result in results)
+    assert fake_ytdl.extracted_urls == urls
+
+
+def test_access_denied_only_trips_the_circuit_of_its_host(fake_ytdl, tmp_path):
+    downloader = _create_downloader(_FakeBot(), tmp_path)
+    urls = ["https://www.instagram.com/reel/rate-limited", "https://v.redd.it/first"]
+
+    result = asyncio.run(downloader.handle_payload(DownloadMessage(1, 2, urls), 1))
+
+    assert isinstance(result, Subscriber.RequeueAfter)
+    circuit_breaker = downloader._circuit_breaker
+    assert circuit_breaker.get_delay(normalize_host("www.instagram.com")) is not None
+    assert circuit_breaker.get_delay("v.redd.it") is None
+
+
+def test_access_denied_survives_pickling():
+    error = download.AccessDeniedException("Denied", host="instagram.com")
+
+    unpickled = pickle.loads(pickle.dumps(error))
+
+    assert str(unpickled) == "Denied"
+    assert unpickled.host == "instagram.com"
@@ -0,0 +1,261 @@
+import asyncio
+from collections.abc import AsyncGenerator
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from telegram import MessageEntity
+from telegram.constants import ChatType, MessageEntityType
+
+from cancer.command import handle_updates
+from cancer.dedup import RecentLinks
+from cancer.message import Message, Topic
+from cancer.port.publisher import Publisher, PublishingException
+from cancer.port.routing_rules import RoutingRuleSource
+from cancer.scheduling import BackgroundQueue
+
+
+class _FakePublisher(Publisher):
+    def __init__(self, failing_topics: set[Topic] | None = None) -> None:
+        self.failing_topics = failing_topics or set()
+        self.published: list[tuple[Topic, Message]] = []
+        self.events: list[str] = []
+        self.running = 0
+        self.max_running = 0
+
+    async def publish(
+        self,
+        topic: Topic,
+        message: Message,
+        *,
+        is_priority: bool = False,
+    ):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if topic in self.failing_topics:
+                raise PublishingException(f"Could not publish to {topic.value}")
+            self.published.append((topic, message))
+            self.events.append(f"publish {topic.value}")
+        finally:
+            self.running -= 1
+
+    async def close(self) -> None:
+        pass
+
+
+class _FakeMessage:
+    def __init__(
+        self,
+        text: str,
+        events: list[str],
+        chat_id: int = 1,
+        message_id: int = 2,
+    ) -> None:
+        self.events = events
+        self.text = text
+        self.chat = SimpleNamespace(id=chat_id, type=ChatType.GROUP)
+        self.message_id = message_id
+        self.entities = tuple(
+            MessageEntity(
+                MessageEntityType.URL, offset=text.index(url), length=len(url)
+            )
+            for url in text.split()
+            if url.startswith("https://")
+        )
+        self.voice = None
+        self.caption = None
+        self.reactions: list[str] = []
+
+    def parse_entity(self, entity: MessageEntity) -> str:
+        return self.text[entity.offset : entity.offset + entity.length]
+
+    async def set_reaction(self, reaction: str) -> None:
+        await asyncio.sleep(0.05)
+        self.reactions.append(reaction)
+        self.events.append("react")
+
+    async def reply_text(self, text: str) -> None:
+        pass
+
+
+def _handle(
+    publisher: _FakePublisher,
+    text: str,
+    recent_links: RecentLinks | None = None,
+) -> None:
+    if recent_links is None:
+        recent_links = RecentLinks(window=timedelta(minutes=10), max_entries=100)
+
+    async def _run() -> None:
+        side_effects = BackgroundQueue(max_running=1, max_pending=1)
+        bot = handle_updates._CancerBot(publisher, side_effects, recent_links)
+        update = SimpleNamespace(message=_FakeMessage(text, publisher.events))
+        try:
+            await bot.handle_update(update, None)  # type: ignore[arg-type]
+        finally:
+            await side_effects.close(1)
+
+    asyncio.run(_run())
+
+
+def test_topics_are_published_concurrently():
+    publisher = _FakePublisher()
+
+    _handle(publisher, "https://v.redd.it/abc https://www.instagram.com/reel/def")
+
+    assert {topic for topic, _ in publisher.published} == {
+        Topic.download,
+        Topic.instaDownload,
+    }
+    assert publisher.max_running == 2
+
+
+def test_publishing_failures_are_reported_per_topic():
+    publisher = _FakePublisher(failing_topics={Topic.instaDownload})
+
+    with pytest.raises(ExceptionGroup) as info:
+        _handle(publisher, "https://v.redd.it/abc https://www.instagram.com/reel/def")
+
+    assert [topic for topic, _ in publisher.published] == [Topic.download]
+    assert len(info.value.exceptions) == 1
+
+
+def test_reaction_does_not_delay_publishing():
+    publisher = _FakePublisher()
+
+    _handle(publisher, "https://v.redd.it/abc")
+
+    assert publisher.events == ["publish download", "react"]
+
+
+def test_reposted_links_are_skipped():
+    publisher = _FakePublisher()
+    recent_links = RecentLinks(window=timedelta(minutes=10), max_entries=100)
+
+    _handle(publisher, "https://v.redd.it/abc?utm_source=share", recent_links)
+    _handle(publisher, "https://v.redd.it/abc https://v.redd.it/def", recent_links)
+
+    assert [message.urls for _, message in publisher.published] == [
+        ["https://v.redd.it/abc?utm_source=share"],
+        ["https://v.redd.it/def"],
+    ]
+
+
+def test_links_of_failed_publishing_can_be_reposted():
+    recent_links = RecentLinks(window=timedelta(minutes=10), max_entries=100)
+
+    with pytest.raises(ExceptionGroup):
+        _handle(
+            _FakePublisher(failing_topics={Topic.download}),
+            "https://v.redd.it/abc",
+            recent_links,
+        )
+
+    publisher = _FakePublisher()
+    _handle(publisher, "https://v.redd.it/abc", recent_links)
+    assert len(publisher.published) == 1
+
+
+def test_only_links_of_failed_topics_can_be_reposted():
+    recent_links = RecentLinks(window=timedelta(minutes=10), max_entries=100)
+    text = "https://v.redd.it/abc https://www.instagram.com/reel/def"
+
+    with pytest.raises(ExceptionGroup):
+        _handle(
+            _FakePublisher(failing_topics={Topic.instaDownload}),
+            text,
+            recent_links,
+        )
+
+    publisher = _FakePublisher()
+    _handle(publisher, text, recent_links)
+    assert [topic for topic, _ in publisher.published] == [Topic.instaDownload]
+
+
+def test_all_publishing_failures_are_raised():
+    publisher = _FakePublisher(failing_topics={Topic.download, Topic.instaDownload})
+
+    with pytest.raises(ExceptionGroup) as e:
+        _handle(publisher, "https://v.redd.it/abc https://www.instagram.com/reel/def")
+
+    assert len(e.value.exceptions) == 2
+
+
+class _FakeRuleSource(RoutingRuleSource):
+    def __init__(self, watches: list[list[bytes | None] | Exception]) -> None:
+        self.watches = watches
+        self.is_exhausted = asyncio.Event()
+
+    async def watch(self) -> AsyncGenerator[bytes | None]:
+        if not self.watches:
+            self.is_exhausted.set()
+            await asyncio.Future()
+
+        watch = self.watches.pop(0)
+        if isinstance(watch, Exception):
+            raise watch
+
+        for document in watch:
+            yield document
+
+    async def close(self) -> None:
+        pass
+
+
+def _route_with_rules(
+    source: _FakeRuleSource,
+    texts: list[str],
+) -> list[Topic]:
+    publisher = _FakePublisher()
+    bot = handle_updates._CancerBot(
+        publisher,
+        BackgroundQueue(max_running=1, max_pending=1),
+        RecentLinks(window=timedelta(0), max_entries=1),
+    )
+
+    async def _run() -> None:
+        watcher = asyncio.create_task(bot.watch_routing_rules(source))
+        await source.is_exhausted.wait()
+        watcher.cancel()
+        for text in texts:
+            update = SimpleNamespace(message=_FakeMessage(text, publisher.events))
+            await bot.handle_update(update, None)  # type: ignore[arg-type]
+        await bot.side_effects.close(1)
+
+    asyncio.run(_run())
+    return [topic for topic, _ in publisher.published]
+
+
+def test_routing_rules_are_swapped_and_invalid_ones_ignored():
+    source = _FakeRuleSource(
+        [
+            [
+                None,
+                b'[{"host": "v.redd.it", "treatment": "insta-download"}]',
+                b'[{"host": "v.redd.it", "treatment": "cancer"}]',
+            ]
+        ]
+    )
+
+    topics = _route_with_rules(
+        source,
+        ["https://v.redd.it/abc", "https://www.instagram.com/reel/def"],
+    )
+
+    assert topics == [Topic.instaDownload]
+
+
+def test_failed_routing_rule_watch_is_retried(monkeypatch):
+    monkeypatch.setattr(handle_updates, "_RULE_WATCH_MIN_DELAY", 0.0)
+    source = _FakeRuleSource(
+        [
+            OSError("NATS is unreachable"),
+            [b'[{"host": "v.redd.it", "treatment": "insta-download"}]'],
+        ]
+    )
+
+    topics = _route_with_rules(source, ["https://v.redd.it/abc"])
+
+    assert topics == [Topic.instaDownload]
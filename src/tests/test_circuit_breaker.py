@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from cancer.circuit_breaker import CircuitBreaker
+from cancer.config import CircuitBreakerConfig
+
+_HOST = "instagram.com"
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _create_breaker(clock: _Clock) -> CircuitBreaker:
+    return CircuitBreaker(
+        CircuitBreakerConfig(
+            failure_threshold=2,
+            base_delay=timedelta(seconds=60),
+            max_delay=timedelta(seconds=600),
+        ),
+        clock=clock,
+    )
+
+
+def test_trips_after_threshold():
+    breaker = _create_breaker(_Clock())
+
+    breaker.record_failure(_HOST)
+    assert breaker.acquire(_HOST) is None
+
+    breaker.record_failure(_HOST)
+    delay = breaker.acquire(_HOST)
+    assert delay is not None
+    assert timedelta(seconds=60) <= delay <= timedelta(seconds=72)
+    assert breaker.acquire("v.redd.it") is None
+
+
+def test_single_probe_after_backoff():
+    clock = _Clock()
+    breaker = _create_breaker(clock)
+    breaker.record_failure(_HOST)
+    breaker.record_failure(_HOST)
+
+    clock.now = 61
+    assert breaker.acquire(_HOST) is None
+    assert breaker.acquire(_HOST) is not None
+
+    breaker.record_success(_HOST)
+    assert breaker.acquire(_HOST) is None
+
+
+def test_failed_probe_doubles_backoff():
+    clock = _Clock()
+    breaker = _create_breaker(clock)
+    breaker.record_failure(_HOST)
+    breaker.record_failure(_HOST)
+
+    clock.now = 61
+    assert breaker.acquire(_HOST) is None
+    breaker.record_failure(_HOST)
+
+    delay = breaker.acquire(_HOST)
+    assert delay is not None
+    assert delay >= timedelta(seconds=120)
@@ -0,0 +1,50 @@
+import dataclasses
+import json
+
+import pytest
+
+from cancer.message import (
+    CODEC_HEADER,
+    Codec,
+    DownloadMessage,
+    Message,
+    UrlConvertMessage,
+    VoiceMessage,
+)
+
+_MESSAGES: list[Message] = [
+    DownloadMessage(1, 2, ["https://v.redd.it/abc", "https://v.redd.it/def"]),
+    VoiceMessage(chat_id=1, message_id=2, file_id="abc", file_size=1234),
+    UrlConvertMessage(1, 2, ["https://youtube.com/shorts/abc"]),
+]
+
+
+@pytest.mark.parametrize("codec", list(Codec))
+@pytest.mark.parametrize("message", _MESSAGES)
+def test_round_trip(codec: Codec, message: Message):
+    serialized = message.serialize(codec)
+    assert type(message).deserialize(serialized, codec) == message
+
+
+@pytest.mark.parametrize("message", _MESSAGES)
+def test_decodes_legacy_json(message: Message):
+    legacy = json.dumps(dataclasses.asdict(message)).encode("utf-8")
+    codec = Codec.from_headers(None)
+    assert type(message).deserialize(legacy, codec) == message
+
+
+def test_ignores_fields_from_newer_producers():
+    message = DownloadMessage(1, 2, ["https://v.redd.it/abc"])
+
+    newer_json = json.dumps({**dataclasses.asdict(message), "priority": 1})
+    newer_compact = json.dumps([1, 2, ["https://v.redd.it/abc"], 1])
+
+    assert DownloadMessage.deserialize(newer_json.encode(), Codec.json) == message
+    assert DownloadMessage.deserialize(newer_compact.encode(), Codec.compact) == message
+
+
+def test_codec_is_negotiated_via_header():
+    assert Codec.from_headers({}) == Codec.json
+    assert Codec.from_headers(Codec.compact.to_headers()) == Codec.compact
+    with pytest.raises(ValueError):
+        Codec.from_headers({CODEC_HEADER: "msgpack/3"})
@@ -0,0 +1,15 @@
+import pytest
+
+from cancer.config import WorkerConfig
+from cancer.message import Topic
+
+
+def test_worker_topics_with_optional_limits():
+    topics = WorkerConfig._parse_topics("voice-download:2, youtube-url-convert")
+
+    assert topics == {Topic.voiceDownload: 2, Topic.youtubeUrlConvert: None}
+
+
+def test_worker_topics_reject_unknown_topic():
+    with pytest.raises(ValueError):
+        WorkerConfig._parse_topics("voice-download,cancer")
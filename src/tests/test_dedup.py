@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from cancer.dedup import RecentLinks
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_repeats_are_rejected_within_window():
+    clock = _Clock()
+    links = RecentLinks(timedelta(seconds=60), max_entries=10, clock=clock)
+
+    assert links.add(1, "https://www.instagram.com/reel/abc/?igsh=MWQ1ZGUx")
+    assert not links.add(1, "https://instagram.com/reel/abc?utm_source=ig_web")
+    assert links.add(2, "https://instagram.com/reel/abc")
+
+    clock.now = 61
+    assert links.add(1, "https://instagram.com/reel/abc")
+
+
+def test_repeats_do_not_extend_window():
+    clock = _Clock()
+    links = RecentLinks(timedelta(seconds=60), max_entries=10, clock=clock)
+
+    links.add(1, "https://v.redd.it/abc")
+    clock.now = 30
+    assert not links.add(1, "https://v.redd.it/abc")
+
+    clock.now = 61
+    assert links.add(1, "https://v.redd.it/abc")
+
+
+def test_oldest_links_are_evicted():
+    links = RecentLinks(timedelta(seconds=60), max_entries=2, clock=_Clock())
+
+    for url in ["https://v.redd.it/a", "https://v.redd.it/b", "https://v.redd.it/c"]:
+        links.add(1, url)
+
+    assert len(links) == 2
+    assert links.add(1, "https://v.redd.it/a")
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from cancer.process_pool import ProcessPool
+
+
+def _create_pool(max_jobs_per_worker: int) -> ProcessPool:
+    return ProcessPool(
+        size=1,
+        max_jobs_per_worker=max_jobs_per_worker,
+        max_worker_rss=1_000_000_000,
+    )
+
+
+def test_worker_is_recycled():
+    pool = _create_pool(max_jobs_per_worker=2)
+
+    async def _run() -> list[int]:
+        try:
+            return [await pool.run(os.getpid) for _ in range(3)]
+        finally:
+            await pool.close()
+
+    first, second, third = asyncio.run(_run())
+
+    assert first == second
+    assert third != first
+    assert os.getpid() not in (first, third)
+
+
+def test_exception_is_propagated():
+    pool = _create_pool(max_jobs_per_worker=10)
+
+    async def _run() -> int:
+        try:
+            return await pool.run(int, "not a number")
+        finally:
+            await pool.close()
+
+    with pytest.raises(ValueError):
+        asyncio.run(_run())
+
+
+def test_cancelled_worker_is_replaced():
+    pool = _create_pool(max_jobs_per_worker=10)
+
+    async def _run() -> tuple[int, int]:
+        try:
+            first = await pool.run(os.getpid)
+            with pytest.raises(TimeoutError):
+                await asyncio.wait_for(pool.run(time.sleep, 10), timeout=0.5)
+            return first, await pool.run(os.getpid)
+        finally:
+            await pool.close()
+
+    first, second = asyncio.run(_run())
+
+    assert first != second
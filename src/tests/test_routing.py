@@ -0,0 +1,90 @@
+import pytest
+
+from cancer.command.handle_updates import _CANCERS
+from cancer.message import Topic
+from cancer.routing import Cancer, InvalidRulesException, UrlRouter, parse_rules
+
+_ROUTER = UrlRouter(_CANCERS)
+
+
+@pytest.mark.parametrize(
+    "url,is_private,expected",
+    [
+        ("https://v.redd.it/abcdef", False, Topic.download),
+        ("https://www.reddit.com/r/de/comments/abc/", False, Topic.download),
+        ("https://old.reddit.com/r/de/comments/abc/", False, Topic.download),
+        ("https://www.instagram.com/reel/abc/", False, Topic.instaDownload),
+        ("https://instagram.com:443/reel/abc/", False, Topic.instaDownload),
+        ("https://vm.tiktok.com/ZGabc/", False, Topic.tiktokDownload),
+        ("https://youtube.com/shorts/abc", False, Topic.youtubeUrlConvert),
+        ("https://m.youtube.com/shorts/abc", True, Topic.youtubeDownload),
+        ("https://www.youtube.com/watch?v=abc", True, Topic.youtubeDownload),
+        ("https://www.youtube.com/watch?v=abc", False, None),
+        ("https://youtu.be/abc", False, None),
+        ("https://youtu.be/abc", True, Topic.youtubeDownload),
+        ("https://www.youtube.com/@channel", True, None),
+        ("https://www.linkedin.com/posts/abc_activity-123", False, Topic.download),
+        ("https://www.linkedin.com/in/abc", False, None),
+        ("https://vimeo.com/123", True, Topic.vimeoDownload),
+        ("https://share.google/abc", False, Topic.urlAliasResolution),
+        ("v.redd.it/abcdef", False, Topic.download),
+    ],
+)
+def test_route(url: str, is_private: bool, expected: Topic | None):
+    cancer = _ROUTER.route(url, is_private=is_private)
+    treatment = None if cancer is None else cancer.get_treatment(is_private=is_private)
+    assert treatment == expected
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://vimeo.com.evil.example/123",
+        "https://youtube.community/shorts/abc",
+        "https://notv.redd.it.example/abc",
+        "https://example.com/v.redd.it",
+    ],
+)
+def test_lookalike_hosts_do_not_match(url: str):
+    assert _ROUTER.route(url, is_private=True) is None
+
+
+def test_parse_rules():
+    rules = parse_rules(
+        b"""[
+            {"host": "v.redd.it", "treatment": "download"},
+            {
+                "host": "youtube.com",
+                "path": "/shorts/",
+                "treatment": "youtube-url-convert",
+                "private-treatment": "youtube-download"
+            }
+        ]"""
+    )
+
+    assert rules == [
+        Cancer("v.redd.it", Topic.download),
+        Cancer(
+            host="youtube.com",
+            path="/shorts/",
+            treatment=Topic.youtubeUrlConvert,
+            private_treatment=Topic.youtubeDownload,
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        b"{",
+        b'{"host": "v.redd.it", "treatment": "download"}',
+        b'[{"treatment": "download"}]',
+        b'[{"host": "v.redd.it"}]',
+        b'[{"host": "v.redd.it", "treatment": "cancer"}]',
+        b'[{"host": "v.redd.it", "treatment": "voice-download"}]',
+        b'[{"host": "v.redd.it", "treatment": "download", "paths": ["/"]}]',
+    ],
+)
+def test_parse_invalid_rules(document: bytes):
+    with pytest.raises(InvalidRulesException):
+        parse_rules(document)
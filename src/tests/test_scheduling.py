@@ -0,0 +1,121 @@
+import asyncio
+
+from cancer.scheduling import BackgroundQueue, FairScheduler
+
+
+def _run_jobs(
+    scheduler: FairScheduler[int],
+    jobs: list[tuple[int, int]],
+) -> list[int]:
+    order: list[int] = []
+
+    async def _job(key: int, cost: int) -> None:
+        async with scheduler.slot(key, cost):
+            order.append(key)
+            await asyncio.sleep(0.001)
+
+    async def _run() -> None:
+        async with asyncio.TaskGroup() as tg:
+            for key, cost in jobs:
+                tg.create_task(_job(key, cost))
+
+    asyncio.run(_run())
+    return order
+
+
+def test_spamming_chat_does_not_starve_others():
+    scheduler: FairScheduler[int] = FairScheduler(
+        max_running=1,
+        max_running_per_key=1,
+    )
+    jobs = [(1, 1)] * 6 + [(2, 1), (3, 1)]
+
+    order = _run_jobs(scheduler, jobs)
+
+    assert sorted(order[:4]) == [1, 1, 2, 3]
+    assert order[4:] == [1] * 4
+    assert scheduler.waiting == 0
+
+
+def test_expensive_payloads_get_proportionally_fewer_turns():
+    scheduler: FairScheduler[int] = FairScheduler(
+        max_running=1,
+        max_running_per_key=1,
+    )
+    jobs = [(1, 3)] * 2 + [(2, 1)] * 6
+
+    order = _run_jobs(scheduler, jobs)
+
+    assert order[:4] == [1, 2, 2, 1]
+
+
+def test_per_key_cap_limits_concurrency():
+    scheduler: FairScheduler[int] = FairScheduler(
+        max_running=4,
+        max_running_per_key=2,
+    )
+    running = 0
+    max_running = 0
+
+    async def _job() -> None:
+        nonlocal running, max_running
+        async with scheduler.slot(1):
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+    async def _run() -> None:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(6):
+                tg.create_task(_job())
+
+    asyncio.run(_run())
+
+    assert max_running == 2
+
+
+def test_cancelled_waiter_gives_up_its_turn():
+    scheduler: FairScheduler[int] = FairScheduler(
+        max_running=1,
+        max_running_per_key=1,
+    )
+    order: list[int] = []
+
+    async def _job(key: int) -> None:
+        async with scheduler.slot(key):
+            order.append(key)
+            await asyncio.sleep(0.01)
+
+    async def _run() -> None:
+        first = asyncio.create_task(_job(1))
+        cancelled = asyncio.create_task(_job(2))
+        last = asyncio.create_task(_job(3))
+        await asyncio.sleep(0.001)
+        cancelled.cancel()
+        await asyncio.gather(first, last)
+
+    asyncio.run(_run())
+
+    assert order == [1, 3]
+
+
+def test_background_queue_drops_oldest_pending_job():
+    finished: list[int] = []
+
+    async def _run() -> int:
+        queue = BackgroundQueue(max_running=1, max_pending=2)
+
+        for index in range(5):
+
+            async def _job(index: int = index) -> None:
+                await asyncio.sleep(0.001)
+                finished.append(index)
+
+            queue.submit(_job)
+
+        await queue.close(1)
+        return queue.dropped
+
+    assert asyncio.run(_run()) == 2
+    assert finished == [0, 3, 4]
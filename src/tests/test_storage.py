@@ -0,0 +1,68 @@
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+from cancer.config import StorageConfig
+from cancer.storage import StorageFullException, StorageManager
+
+
+def _create_storage(tmp_path: Path, *, scratch: bool = False) -> StorageManager:
+    return StorageManager(
+        tmp_path / "disk",
+        StorageConfig(
+            quota=1000,
+            orphan_max_age=timedelta(hours=1),
+            sweep_interval=timedelta(minutes=10),
+            scratch_dir=tmp_path / "scratch" if scratch else None,
+            scratch_max_file_size=100,
+            scratch_quota=400,
+        ),
+    )
+
+
+def test_reservation_over_quota_is_rejected(tmp_path):
+    storage = _create_storage(tmp_path)
+    storage.start()
+
+    with storage.work_dir(400, max_size=1000):
+        with pytest.raises(StorageFullException):
+            with storage.work_dir(None, max_size=1000):
+                pass
+
+        with storage.work_dir(50, max_size=1000):
+            pass
+
+
+def test_small_files_use_scratch(tmp_path):
+    storage = _create_storage(tmp_path, scratch=True)
+    storage.start()
+
+    with storage.work_dir(50, max_size=1000) as small:
+        with storage.work_dir(500, max_size=1000) as large:
+            assert small.parent == tmp_path / "scratch"
+            assert large.parent == tmp_path / "disk"
+
+    assert not small.exists()
+    assert not large.exists()
+
+
+def test_sweep_only_removes_orphaned_work_dirs(tmp_path):
+    disk = tmp_path / "disk"
+    orphan = disk / "cure-orphan"
+    orphan.mkdir(parents=True)
+    unrelated = disk / "keep"
+    unrelated.mkdir()
+    cache_file = disk / "file-id-cache.sqlite3"
+    cache_file.touch()
+
+    storage = _create_storage(tmp_path)
+    storage.start()
+
+    with storage.work_dir(10, max_size=1000) as active:
+        assert storage.sweep(timedelta()) == 0
+        assert active.exists()
+
+    assert not orphan.exists()
+    assert unrelated.exists()
+    assert cache_file.exists()
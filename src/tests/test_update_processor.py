@@ -0,0 +1,71 @@
+import asyncio
+from datetime import UTC, datetime
+
+from telegram import Chat, Message, Update
+from telegram.constants import ChatType
+
+from cancer.update_processor import ChatUpdateProcessor
+
+
+def _create_update(update_id: int, chat_id: int) -> Update:
+    return Update(
+        update_id,
+        message=Message(
+            update_id,
+            datetime.now(UTC),
+            Chat(chat_id, ChatType.GROUP),
+        ),
+    )
+
+
+def _process(
+    processor: ChatUpdateProcessor,
+    updates: list[Update],
+    delays: dict[int, float],
+) -> list[int]:
+    finished: list[int] = []
+
+    async def _handle(update: Update) -> None:
+        await asyncio.sleep(delays.get(update.update_id, 0.001))
+        finished.append(update.update_id)
+
+    async def _run() -> None:
+        async with processor, asyncio.TaskGroup() as tg:
+            for update in updates:
+                tg.create_task(processor.process_update(update, _handle(update)))
+
+    asyncio.run(_run())
+    return finished
+
+
+def test_updates_of_a_chat_keep_their_order():
+    processor = ChatUpdateProcessor(max_running=4, max_queued=16)
+    updates = [_create_update(update_id, chat_id=1) for update_id in range(5)]
+
+    # The first update is the slowest one, but still has to finish first
+    finished = _process(processor, updates, delays={0: 0.02})
+
+    assert finished == [0, 1, 2, 3, 4]
+
+
+def test_slow_chat_does_not_block_others():
+    processor = ChatUpdateProcessor(max_running=2, max_queued=16)
+    updates = [
+        _create_update(0, chat_id=1),
+        _create_update(1, chat_id=1),
+        _create_update(2, chat_id=2),
+        _create_update(3, chat_id=2),
+    ]
+
+    finished = _process(processor, updates, delays={0: 0.05})
+
+    assert finished == [2, 3, 0, 1]
+
+
+def test_updates_beyond_the_queue_are_dropped():
+    processor = ChatUpdateProcessor(max_running=1, max_queued=1)
+    updates = [_create_update(update_id, chat_id=1) for update_id in range(3)]
+
+    finished = _process(processor, updates, delays={})
+
+    assert finished == [0, 1]